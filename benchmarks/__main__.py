@@ -0,0 +1,148 @@
+"""
+Input: benchmark settings
+Output: throughput, peak memory and stage times of report building
+
+Run from repository root: `python -m benchmarks --help`
+"""
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+from log_analyzer.report import prepare_config
+
+from .bench import (
+    BenchCase,
+    BenchResult,
+    check_baseline,
+    get_case_name,
+    load_baseline,
+    parse_count,
+    prepare_log,
+    run_case_isolated,
+    save_baseline,
+)
+from .generator import generate_log
+
+
+def main():
+    args = parse_args()
+    if args.command == 'generate':
+        generate_log(
+            args.path, args.lines, args.urls, args.error_rate, args.seed
+        )
+        return
+
+    config = prepare_config(args.config)
+    results = []
+    for lines in args.lines:
+        for gz in args.compression:
+            for aggregation in args.aggregation:
+                case = BenchCase(
+                    lines, args.urls, args.error_rate, gz == 'gz',
+                    aggregation, args.workers
+                )
+                log = prepare_log(case, args.data_dir, args.seed)
+                case_config = config._replace(
+                    aggregation=aggregation,
+                    workers=args.workers,
+                    aggregate_cache=False,
+                    history_db=None,
+                )
+                result = run_case_isolated(log, case_config)
+                result = result._replace(name=get_case_name(case))
+                print_result(result)
+                results.append(result)
+
+    if args.save_baseline is not None:
+        save_baseline(results, args.save_baseline)
+        print(f'Saved baseline to `{args.save_baseline}`')
+    if args.baseline is not None:
+        regressions = check_baseline(
+            results, load_baseline(args.baseline), args.max_drop
+        )
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            exit(1)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser('Benchmarks of log analyzer')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='Write synthetic log')
+    generate.add_argument(
+        'path', type=Path,
+        help='Log file to write, compressed if it ends with .gz'
+    )
+    generate.add_argument(
+        '--lines', type=parse_count, default=10 ** 6,
+        help='Number of lines, K, M and G suffixes are allowed'
+    )
+    add_generator_arguments(generate)
+
+    run = commands.add_parser('run', help='Measure report building')
+    run.add_argument(
+        '--lines', type=parse_count, nargs='+', default=[10 ** 6],
+        help='Sizes of logs, e.g. 1M 10M 100M'
+    )
+    add_generator_arguments(run)
+    run.add_argument(
+        '--compression', choices=('plain', 'gz'), nargs='+',
+        default=['plain', 'gz'], help='Formats of logs'
+    )
+    run.add_argument(
+        '--aggregation', nargs='+', default=['exact'],
+        help='Aggregation modes to measure'
+    )
+    run.add_argument(
+        '--workers', type=int, default=1, help='Processes parsing a log'
+    )
+    run.add_argument(
+        '--config', type=Path, default=None,
+        help='Path to json file with script options, defaults if omitted'
+    )
+    run.add_argument(
+        '--data-dir', type=Path, default=Path('data/benchmarks'),
+        help='Directory to keep generated logs in'
+    )
+    run.add_argument(
+        '--baseline', type=Path, default=None,
+        help='Fail if throughput is lower than in this baseline'
+    )
+    run.add_argument(
+        '--max-drop', type=float, default=10,
+        help='Allowed throughput drop against baseline, percent'
+    )
+    run.add_argument(
+        '--save-baseline', type=Path, default=None,
+        help='Save throughput of this run as baseline'
+    )
+    return parser.parse_args()
+
+
+def add_generator_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        '--urls', type=parse_count, default=10000,
+        help='Number of distinct urls'
+    )
+    parser.add_argument(
+        '--error-rate', type=float, default=.01,
+        help='Share of lines analyzer can not parse'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+
+def print_result(result: BenchResult) -> None:
+    stages = ', '.join(
+        f'{stage} {seconds:.2f}s'
+        for stage, seconds in result.stages.items()
+    )
+    print(
+        f'{result.name}: {result.lines} lines in {result.seconds:.2f}s, '
+        f'{result.lines_per_sec:.0f} lines/sec, '
+        f'peak RSS {result.peak_rss_mb:.0f} MB ({stages})'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import json
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+
+from log_analyzer.report import Config
+from log_analyzer.report.batch import collect_log_stat
+from log_analyzer.report.fs import Log, read_log
+from log_analyzer.report.metrics import get_peak_rss_mb
+from log_analyzer.report.report import (
+    parse_line,
+    prepare_report_table,
+    render_table,
+)
+
+from .generator import generate_log, get_log_name
+
+BenchCase = namedtuple('BenchCase', [
+    'lines', 'urls', 'error_rate', 'gz', 'aggregation', 'workers'
+])
+BenchResult = namedtuple('BenchResult', [
+    'name', 'lines', 'seconds', 'lines_per_sec', 'peak_rss_mb', 'stages'
+])
+# Lines `parse_line` is measured on, it is not a part of report building
+PARSE_LINE_SAMPLE = 100000
+LOG_DATE = date(2017, 6, 30)
+
+
+def get_case_name(case: BenchCase) -> str:
+    """Name of case in results and baseline"""
+    return (
+        f'{format_count(case.lines)}-{"gz" if case.gz else "plain"}-'
+        f'{case.aggregation}-w{case.workers}'
+    )
+
+
+def format_count(count: int) -> str:
+    """Shortens count: 1000000 is `1M`"""
+    for suffix, size in (('G', 10 ** 9), ('M', 10 ** 6), ('K', 10 ** 3)):
+        if count >= size and count % size == 0:
+            return f'{count // size}{suffix}'
+    return str(count)
+
+
+def parse_count(value: str) -> int:
+    """Parses count with optional K, M, G suffix: `10M` is 10000000"""
+    sizes = {'K': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9}
+    suffix = value[-1:].upper()
+    if suffix in sizes:
+        return int(value[:-1]) * sizes[suffix]
+    return int(value)
+
+
+def prepare_log(case: BenchCase, data_dir: Path, seed: int = 0) -> Log:
+    """Generates log of the case unless it is generated already
+
+    Logs are kept in subdirectories named by generator settings, so they
+    are reused by the next runs
+    """
+    log_dir = data_dir / (
+        f'{format_count(case.lines)}-u{case.urls}-e{case.error_rate}-s{seed}'
+    )
+    path = log_dir / get_log_name(LOG_DATE, case.gz)
+    if not path.is_file():
+        log_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.tmp{path.suffix}')
+        generate_log(
+            tmp_path, case.lines, case.urls, case.error_rate, seed, LOG_DATE
+        )
+        tmp_path.replace(path)
+    return Log(path, LOG_DATE)
+
+
+def run_case(log: Log, config: Config) -> BenchResult:
+    """Builds report of the log measuring every stage
+
+    Stages are `collect_stat` (reading and parsing log), `prepare_table`
+    and `render_table`. `parse_line` is measured separately on the first
+    lines of the log. Result name is empty
+    """
+    stages = {}
+    start = perf_counter()
+    aggregate = collect_log_stat(log, config)
+    stages['collect_stat'] = perf_counter() - start
+
+    stage_start = perf_counter()
+    table = prepare_report_table(aggregate.urls_stat, config.report_size)
+    stages['prepare_table'] = perf_counter() - stage_start
+
+    stage_start = perf_counter()
+    render_table(table)
+    stages['render_table'] = perf_counter() - stage_start
+    seconds = perf_counter() - start
+
+    sample = list(islice(read_log(log), PARSE_LINE_SAMPLE))
+    stage_start = perf_counter()
+    for line in sample:
+        parse_line(line, config.log_format)
+    stages['parse_line'] = perf_counter() - stage_start
+
+    return BenchResult(
+        name='',
+        lines=aggregate.total_lines,
+        seconds=seconds,
+        lines_per_sec=aggregate.total_lines / seconds,
+        peak_rss_mb=get_peak_rss_mb(),
+        stages=stages,
+    )
+
+
+def run_case_isolated(log: Log, config: Config) -> BenchResult:
+    """Runs case in a new process, so its peak memory is measured alone"""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_case, log, config).result()
+
+
+def load_baseline(path: Path) -> dict[str, float]:
+    """Loads lines per second by case name"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(results: list[BenchResult], path: Path) -> None:
+    """Saves lines per second by case name, other cases are kept"""
+    baseline = load_baseline(path) if path.is_file() else {}
+    baseline.update((r.name, r.lines_per_sec) for r in results)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+
+
+def check_baseline(
+    results: list[BenchResult],
+    baseline: dict[str, float],
+    max_drop_perc: float
+) -> list[str]:
+    """Compares throughput with baseline
+
+    Returns:
+        Descriptions of cases slower than baseline by more than
+          `max_drop_perc` percent. Cases without baseline are skipped
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            continue
+        drop_perc = 100 * (1 - result.lines_per_sec / expected)
+        if drop_perc > max_drop_perc:
+            regressions.append(
+                f'{result.name}: {result.lines_per_sec:.0f} lines/sec, '
+                f'{drop_perc:.1f}% slower than baseline {expected:.0f}'
+            )
+    return regressions
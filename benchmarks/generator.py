@@ -0,0 +1,110 @@
+import gzip
+import random
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+# Urls are built from templates seen in real logs, `{id}` makes them unique
+URL_TEMPLATES = (
+    '/api/v2/banner/{id}',
+    '/api/v2/group/{id}/statistic/sites/?date_type=day&date_from=2017-06-28',
+    '/api/1/photogenic_banners/list/?server_name=WIN7RB{id}',
+    '/api/v2/internal/banner/{id}/info',
+    '/export/appinstall_raw/2017-06-{id}/',
+    '/api/v2/slot/{id}/groups',
+)
+USER_AGENTS = (
+    'Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5',
+    'python-requests/2.13.0',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like '
+    'Gecko) Chrome/58.0.3029.110 Safari/537.36',
+    'Slotovod',
+)
+# Line of default `LOG_FORMAT`
+LOG_LINE = (
+    '{ip} {user}  - [{time_local}] "{method} {url} HTTP/1.1" {status} {size} '
+    '"-" "{agent}" "-" "{request_id}" "{rb_user}" {request_time:.3f}\n'
+)
+# Lines the parser rejects: truncated, garbage and with broken request time
+ERROR_LINES = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/',
+    '\x16\x03\x01\x02\x00\x01\x00\x01\xfc\x03\x03',
+    '{ip} -  - [{time_local}] "GET {url} HTTP/1.1" 499 0 "-" "-" "-" "-" '
+    '"-" -',
+)
+# Skew of url popularity: the larger it is, the more requests go to the
+# first urls
+URL_SKEW = 3
+REMOTE_USERS = ('-', '-', '3b81f63526fa8', 'f032b48fb33e1e692')
+WRITE_LINES = 10000
+
+
+def get_log_name(log_date: date, gz: bool = False) -> str:
+    """File name of nginx log the analyzer finds in `LOG_DIR`"""
+    return f'nginx-access-ui.log-{log_date:%Y%m%d}' + ('.gz' if gz else '')
+
+
+def generate_log(
+    path: Path,
+    lines: int,
+    urls: int = 10000,
+    error_rate: float = .01,
+    seed: int = 0,
+    log_date: date = date(2017, 6, 30)
+) -> None:
+    """Writes synthetic nginx log, compressed if path ends with `.gz`
+
+    Log is the same for the same arguments. Urls are picked from `urls`
+    distinct ones with a few of them taking most of requests, request times
+    are log-normal
+
+    Args:
+        path: log file to write
+        lines: number of lines
+        urls: number of distinct urls
+        error_rate: share of lines the analyzer can not parse
+        seed: seed of random generator
+        log_date: date of timestamps in log
+    """
+    rnd = random.Random(seed)
+    url_pool = [
+        URL_TEMPLATES[i % len(URL_TEMPLATES)].format(id=i)
+        for i in range(urls)
+    ]
+    start = datetime.combine(log_date, time())
+    step = timedelta(days=1) / max(lines, 1)
+    if path.suffix == '.gz':
+        f = gzip.open(path, 'wt', compresslevel=6, encoding='utf-8')
+    else:
+        f = open(path, 'w', encoding='utf-8')
+    with f:
+        batch = []
+        for i in range(lines):
+            url = url_pool[int(urls * rnd.random() ** URL_SKEW)]
+            time_local = (start + step * i).strftime('%d/%b/%Y:%H:%M:%S +0300')
+            ip = '.'.join(str(rnd.randrange(1, 255)) for _ in range(4))
+            if rnd.random() < error_rate:
+                line = rnd.choice(ERROR_LINES).format(
+                    ip=ip, time_local=time_local, url=url
+                ) + '\n'
+            else:
+                line = LOG_LINE.format(
+                    ip=ip,
+                    user=rnd.choice(REMOTE_USERS),
+                    time_local=time_local,
+                    method=rnd.choice(('GET', 'GET', 'GET', 'POST')),
+                    url=url,
+                    status=rnd.choice((200, 200, 200, 204, 302, 404)),
+                    size=rnd.randrange(10, 100000),
+                    agent=rnd.choice(USER_AGENTS),
+                    request_id=(
+                        f'{1498697422 + i}-{rnd.getrandbits(31)}-4708-'
+                        f'{rnd.randrange(10 ** 7)}'
+                    ),
+                    rb_user=f'{rnd.getrandbits(56):x}',
+                    request_time=rnd.lognormvariate(-2, 1.2),
+                )
+            batch.append(line)
+            if len(batch) == WRITE_LINES:
+                f.write(''.join(batch))
+                batch.clear()
+        f.write(''.join(batch))
@@ -6,30 +6,41 @@ Input: nginx log directory
 Output: html report with url request time statistics
 """
 import logging
-from argparse import ArgumentParser
+import socket
+from argparse import ArgumentParser, Namespace
+from datetime import date
 from pathlib import Path
 
 from report import (
     Config,
-    build_report,
+    build_log_report,
+    build_partial_report,
+    build_reports,
+    collect_partial,
     find_log,
+    find_pending_logs,
+    follow_log,
     get_report_path,
     init_logging,
+    is_log_pending,
+    load_partial,
+    merge_partials,
     prepare_config,
-    read_log,
+    save_partial,
+    watch_logs,
 )
 
 
 def main():
     try:
-        config_path = parse_args()
+        args = parse_args()
     except FileNotFoundError as e:
         print(f'Exiting program, reason: {e}')
         exit(1)
     try:
-        config = prepare_config(config_path)
+        config = prepare_config(args.config)
     except Exception as e:
-        print(f'Unable to read `{config_path.absolute()}`: {e}')
+        print(f'Unable to read `{args.config.absolute()}`: {e}')
         exit(1)
 
     init_logging(config)
@@ -37,7 +48,20 @@ def main():
     logger.info('Start')
 
     try:
-        analyze_logs(config)
+        if args.follow is not None:
+            follow_log(args.follow, config)
+        elif args.watch:
+            watch_logs(config)
+        elif args.reduce is not None:
+            reduce_partials(config, args.reduce, args.map)
+        elif args.map is not None:
+            map_log(config, args.map, args.source)
+        elif args.all or args.since is not None:
+            analyze_all_logs(config, args.since)
+        else:
+            analyze_logs(config)
+    except KeyboardInterrupt:
+        logger.info('Interrupted')
     except:
         logger.exception('Error during analyzing logs...')
         exit(1)
@@ -45,12 +69,45 @@ def main():
         logging.getLogger(__name__).info('DONE!')
 
 
-def parse_args() -> Path | None:
+def parse_args() -> Namespace:
     parser = ArgumentParser('Script analyzing nginx logs')
     parser.add_argument(
         '--config', type=Path, default=Path('data/config.json'),
         help='Path to json file with script options: '
-             'REPORT SIZE, REPORT_DIR, LOG_DIR, SCRIPT_LOG_PATH'
+             'REPORT SIZE, WORKERS, REPORT_DIR, LOG_DIR, SCRIPT_LOG_PATH'
+    )
+    parser.add_argument(
+        '--all', action='store_true',
+        help='Build reports for all logs without reports, not the latest only'
+    )
+    parser.add_argument(
+        '--since', type=date.fromisoformat, default=None,
+        help='Build reports for logs of this date (YYYY-MM-DD) and later '
+             'without reports. Implies --all'
+    )
+    parser.add_argument(
+        '--follow', type=Path, default=None,
+        help='Path to live log to tail, report of the current day is '
+             'refreshed every FOLLOW_INTERVAL seconds'
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='Run as daemon building reports of new logs in LOG_DIR '
+             '(or WATCH_DIRS) every WATCH_INTERVAL seconds'
+    )
+    parser.add_argument(
+        '--map', type=Path, default=None,
+        help='Save partial aggregate of the latest log to this path instead '
+             'of report, to merge it with partials of other nodes by --reduce'
+    )
+    parser.add_argument(
+        '--source', default=socket.gethostname(),
+        help='Name of the node logs of --map are of, host name by default'
+    )
+    parser.add_argument(
+        '--reduce', type=Path, nargs='+', default=None,
+        help='Merge partial aggregates of a day and save report of them. '
+             'With --map merged partial is saved instead'
     )
     args = parser.parse_args()
     if args.config is not None and not args.config.is_file():
@@ -58,7 +115,7 @@ def parse_args() -> Path | None:
             f'Cannot find config path: `{args.config.absolute()}`'
         )
 
-    return args.config
+    return args
 
 
 def analyze_logs(config: Config) -> None:
@@ -74,8 +131,58 @@ def analyze_logs(config: Config) -> None:
             log.date, report_path.absolute()
         )
         return
-    build_report(read_log(log), report_path, config)
-    logger.info('Saved to `%s`', report_path.absolute())
+    if not is_log_pending(log, report_path, config):
+        logger.info(
+            'Log `%s` is rejected because of too many errors, it is not '
+            'parsed again until it or its settings are changed', log.path
+        )
+        return
+    if build_log_report(log, report_path, config):
+        logger.info('Saved to `%s`', report_path.absolute())
+
+
+def map_log(config: Config, partial_path: Path, source: str) -> None:
+    logger = logging.getLogger(__name__)
+    log = find_log(config)
+    if log is None:
+        logger.info('There is no logs to report!')
+        return
+    save_partial(collect_partial(log, config, source), partial_path)
+    logger.info('Saved partial aggregate to `%s`', partial_path.absolute())
+
+
+def reduce_partials(
+    config: Config,
+    partial_paths: list[Path],
+    merged_path: Path | None = None
+) -> None:
+    logger = logging.getLogger(__name__)
+    partials = [load_partial(path) for path in partial_paths]
+    if merged_path is not None:
+        save_partial(merge_partials(partials), merged_path)
+        logger.info('Saved merged partial to `%s`', merged_path.absolute())
+        return
+    saved, report_path = build_partial_report(partials, config)
+    if saved:
+        logger.info('Saved to `%s`', report_path.absolute())
+
+
+def analyze_all_logs(config: Config, since: date | None = None) -> None:
+    logger = logging.getLogger(__name__)
+    pending = find_pending_logs(config, since)
+    if not pending:
+        logger.info('There is no logs to report!')
+        return
+    logger.info(
+        'Building %d reports with %d workers',
+        len(pending), config.batch_workers
+    )
+    built, rejected, failed = build_reports(pending, config)
+    logger.info(
+        'Built %d reports, rejected %d, failed %d', built, rejected, failed
+    )
+    if failed:
+        raise RuntimeError(f'Unable to build {failed} reports')
 
 
 if __name__ == '__main__':
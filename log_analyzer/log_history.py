@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Input: history database filled by log_analyzer.py
+Output: url request time statistics over date range
+"""
+from argparse import ArgumentParser, Namespace
+from datetime import date
+from pathlib import Path
+
+from report import (
+    TOP_ORDERS,
+    open_history,
+    prepare_config,
+    query_new_urls,
+    query_top,
+    query_trend,
+)
+
+
+def main():
+    args = parse_args()
+    try:
+        config = prepare_config(args.config)
+    except Exception as e:
+        print(f'Unable to read `{args.config.absolute()}`: {e}')
+        exit(1)
+    if config.history_db is None or not Path(config.history_db).is_file():
+        print(f'Cannot find history database: `{config.history_db}`')
+        exit(1)
+
+    conn = open_history(config.history_db)
+    try:
+        if args.command == 'top':
+            rows = query_top(
+                conn, args.since, args.until, args.limit, args.order_by
+            )
+        elif args.command == 'trend':
+            rows = query_trend(conn, args.url, args.since, args.until)
+        else:
+            rows = query_new_urls(conn, args.since, args.until)
+    finally:
+        conn.close()
+    print_rows(rows)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser('Script querying history of url statistics')
+    parser.add_argument(
+        '--config', type=Path, default=Path('data/config.json'),
+        help='Path to json file with script options, HISTORY_DB is required'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    top = commands.add_parser('top', help='Top urls over date range')
+    top.add_argument(
+        '-n', '--limit', type=int, default=10,
+        help='Number of urls'
+    )
+    top.add_argument(
+        '--order-by', choices=TOP_ORDERS, default='time_sum',
+        help='Statistic to order urls by'
+    )
+
+    trend = commands.add_parser('trend', help='Daily statistics of url')
+    trend.add_argument('url')
+
+    commands.add_parser('new', help='Urls first seen within date range')
+
+    for command in (top, trend, commands.choices['new']):
+        command.add_argument(
+            '--since', type=date.fromisoformat, default=date.min,
+            help='First date of range, YYYY-MM-DD'
+        )
+        command.add_argument(
+            '--until', type=date.fromisoformat, default=date.max,
+            help='Last date of range, YYYY-MM-DD'
+        )
+    return parser.parse_args()
+
+
+def print_rows(rows: list) -> None:
+    if not rows:
+        print('Nothing found')
+        return
+    print('\t'.join(rows[0].keys()))
+    for row in rows:
+        print('\t'.join(
+            f'{value:.3f}' if isinstance(value, float) else str(value)
+            for value in row
+        ))
+
+
+if __name__ == '__main__':
+    main()
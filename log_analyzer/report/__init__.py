@@ -1,11 +1,43 @@
+from .batch import (
+    build_log_report,
+    build_reports,
+    find_pending_logs,
+    is_log_pending,
+)
 from .config import Config, prepare_config
-from .fs import find_log, get_report_path, read_log
+from .follow import follow_log
+from .fs import find_log, find_logs, get_report_path, read_log
+from .history import (
+    TOP_ORDERS,
+    open_history,
+    query_new_urls,
+    query_top,
+    query_trend,
+    save_history,
+)
 from .logger import init_logging
+from .parallel import build_report_parallel
+from .partial import (
+    build_partial_report,
+    collect_partial,
+    load_partial,
+    merge_partials,
+    save_partial,
+)
 from .report import build_report
+from .watch import LogWatcher, watch_logs
 
 __all__ = [
     'prepare_config', 'Config',
-    'find_log', 'get_report_path', 'read_log',
+    'find_log', 'find_logs', 'get_report_path', 'read_log',
     'init_logging',
-    'build_report'
+    'TOP_ORDERS', 'open_history', 'save_history',
+    'query_top', 'query_trend', 'query_new_urls',
+    'build_report', 'build_report_parallel',
+    'build_log_report', 'build_reports', 'find_pending_logs',
+    'is_log_pending',
+    'follow_log',
+    'LogWatcher', 'watch_logs',
+    'collect_partial', 'merge_partials', 'save_partial', 'load_partial',
+    'build_partial_report'
 ]
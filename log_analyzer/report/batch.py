@@ -0,0 +1,321 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from itertools import chain
+from pathlib import Path
+
+from .cache import get_cache_path, load_cached_stat, save_cached_stat
+from .checkpoint import collect_stat_checkpointed
+from .config import Config
+from .fs import (
+    Log,
+    find_logs,
+    get_report_path,
+    read_log_blocks,
+    read_log_windows,
+)
+from .gzindex import GzipIndexError
+from .history import open_history, save_history
+from .manifest import (
+    LOG_BUILT,
+    LOG_FAILED,
+    LOG_REJECTED,
+    find_manifest_pending_logs,
+    record_log,
+)
+from .metrics import Metrics, get_metrics_path, log_metrics, save_metrics
+from .parallel import collect_gzip_stat_parallel, collect_stat_parallel
+from .report import (
+    Aggregate,
+    SpilledStat,
+    collect_stat,
+    save_stat_report,
+    scan_stat,
+)
+from .sampling import is_scanned, sample_lines
+from .spill import collect_stat_spilled
+from .timeline import Timeline, new_timeline
+from .validate import (
+    TooManyErrors,
+    check_log_sample,
+    get_abort_error_lines,
+    get_abort_error_rate,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_log_report(log: Log, report_path: Path, config: Config) -> bool:
+    """Builds report for log
+
+    If `AGGREGATE_CACHE` is on, aggregate of the log is stored next to the
+    report and reused on the next builds instead of parsing the log again.
+    If `HISTORY_DB` is set, url statistics are saved to history database.
+    If `METRICS` is on, time of stages and counters of the run are saved
+    next to the report and summarised in script log. If `MANIFEST` is on,
+    result and time of the build are recorded in manifest of processed logs.
+    If `TIMELINE_BUCKET_MIN` is set, report has timeline of the top urls
+
+    Returns:
+        True if report is saved, False if log has too many errors
+    """
+    if not config.manifest:
+        return _build_log_report(log, report_path, config)
+    started = datetime.now()
+    start = time.perf_counter()
+    status = LOG_FAILED
+    try:
+        saved = _build_log_report(log, report_path, config)
+        status = LOG_BUILT if saved else LOG_REJECTED
+        return saved
+    finally:
+        record_log(
+            log, report_path, config, status, started,
+            time.perf_counter() - start
+        )
+
+
+def _build_log_report(log: Log, report_path: Path, config: Config) -> bool:
+    metrics = Metrics()
+    timeline = new_timeline(config)
+    try:
+        aggregate = load_log_stat(
+            log, report_path, config, metrics, timeline
+        )
+    except TooManyErrors as e:
+        logger.info('Parsing is aborted: %s. Try to check log format', e)
+        aggregate = Aggregate({}, e.total_lines, e.error_lines)
+        saved = False
+    else:
+        saved = save_stat_report(
+            aggregate, report_path, config, metrics, timeline
+        )
+    if saved and config.history_db is not None:
+        with metrics.stage('history'):
+            conn = open_history(config.history_db)
+            try:
+                save_history(
+                    conn, log.date, aggregate, config.history_size,
+                    config.sample_rate
+                )
+            finally:
+                conn.close()
+    if config.metrics:
+        metrics.count('total_lines', aggregate.total_lines)
+        metrics.count('error_lines', aggregate.error_lines)
+        if not isinstance(aggregate.urls_stat, SpilledStat):
+            metrics.count('urls', len(aggregate.urls_stat))
+        result = dict(
+            log=str(log.path), report=str(report_path), saved=saved,
+            **metrics.to_dict()
+        )
+        save_metrics(result, get_metrics_path(report_path))
+        log_metrics(result, log.path.name)
+    return saved
+
+
+def load_log_stat(
+    log: Log,
+    report_path: Path,
+    config: Config,
+    metrics: Metrics,
+    timeline: Timeline | None = None
+) -> Aggregate:
+    """Loads aggregate of log from cache or collects and caches it
+
+    Timeline is not cached, with timeline the log is always parsed
+
+    Raises:
+        TooManyErrors: if parsing is aborted, see `collect_log_stat`
+    """
+    if not config.aggregate_cache:
+        return collect_log_stat(log, config, metrics, timeline)
+    cache_path = get_cache_path(report_path)
+    aggregate = None
+    if timeline is None:
+        with metrics.stage('load_cache'):
+            aggregate = load_cached_stat(log, cache_path, config)
+    if aggregate is None:
+        aggregate = collect_log_stat(log, config, metrics, timeline)
+        # Spilled aggregate keeps the largest urls only, it is not
+        # reusable for other report settings
+        if not isinstance(aggregate.urls_stat, SpilledStat):
+            with metrics.stage('save_cache'):
+                save_cached_stat(aggregate, log, cache_path, config)
+    return aggregate
+
+
+def collect_log_stat(
+    log: Log,
+    config: Config,
+    metrics: Metrics | None = None,
+    timeline: Timeline | None = None
+) -> Aggregate:
+    """Aggregates log, in parallel if it is possible and configured
+
+    With `MEMORY_LIMIT_MB` log is parsed in one process, aggregate over the
+    limit is spilled to disk. With `EARLY_ABORT` sample of log is checked
+    first and parsing is aborted when error lines are over the limit of the
+    whole log, see `get_abort_error_lines`, or over `MAX_ERROR_RATE` for
+    sure when size of the log is unknown, see `get_abort_error_rate`. With
+    `CHECKPOINT_INTERVAL` log parsed in one process is checkpointed and
+    resumed from the checkpoint on the next run. With `MMAP_READ`
+    uncompressed log is scanned memory-mapped, see `scan_stat`. With
+    timeline log is parsed in one process without checkpoints. With
+    `SAMPLE_RATE` lines are sampled before parsing, see `sample_lines`
+
+    Args:
+        log: log to aggregate
+        config: settings
+        metrics: if specified, `read` and `parse` stages are added to it.
+          Reading is not separated from parsing in parallel mode
+        timeline: if specified, request times are added to it too
+
+    Raises:
+        TooManyErrors: if log has too many errors for sure before the end
+          of parsing
+    """
+    if metrics is None:
+        metrics = Metrics()
+    if config.early_abort:
+        with metrics.stage('sample'):
+            check_log_sample(log, config)
+    metrics.count('bytes_read', log.path.stat().st_size)
+    log_reader = sample_lines(
+        chain.from_iterable(metrics.read_blocks(read_log_blocks(log))), config
+    )
+    if config.memory_limit_mb is not None:
+        keep_urls = config.report_size
+        if config.history_db is not None and keep_urls is not None:
+            keep_urls = (
+                None if config.history_size is None
+                else max(keep_urls, config.history_size)
+            )
+        with metrics.stage('parse', exclude='read'):
+            return collect_stat_spilled(
+                log_reader, config, keep_urls, timeline,
+                get_abort_error_lines(log, config),
+                get_abort_error_rate(log, config)
+            )
+    if config.workers > 1 and timeline is None:
+        if log.path.suffix != '.gz':
+            with metrics.stage('parse'):
+                return collect_stat_parallel(log, config)
+        if config.gzip_index:
+            try:
+                with metrics.stage('parse'):
+                    return collect_gzip_stat_parallel(log, config)
+            except GzipIndexError as e:
+                logger.info('Reading `%s` in one process: %s', log.path, e)
+    if config.checkpoint_interval is not None and timeline is None:
+        try:
+            with metrics.stage('parse'):
+                return collect_stat_checkpointed(log, config)
+        except GzipIndexError as e:
+            logger.info('Reading `%s` without checkpoints: %s', log.path, e)
+    if is_scanned(log, config):
+        # Log is read by page faults during scanning
+        with metrics.stage('parse'):
+            return scan_stat(
+                read_log_windows(log), config.log_format, config.aggregation,
+                url_rules=config.url_rules,
+                max_error_lines=get_abort_error_lines(log, config),
+                timeline=timeline
+            )
+    with metrics.stage('parse', exclude='read'):
+        return collect_stat(
+            log_reader, config.log_format, config.aggregation,
+            url_rules=config.url_rules,
+            max_error_lines=get_abort_error_lines(log, config),
+            timeline=timeline,
+            max_error_rate=get_abort_error_rate(log, config)
+        )
+
+
+def find_pending_logs(
+    config: Config,
+    since: date | None = None
+) -> list[tuple[Log, Path]]:
+    """Finds logs without reports
+
+    With `MANIFEST` only new logs are stat-ed and logs rejected because of
+    too many errors are not pending until they are changed
+
+    Returns:
+        List of logs and paths of their reports to build
+    """
+    if config.manifest:
+        return find_manifest_pending_logs(config, since)
+    pending = []
+    for log in find_logs(config, since):
+        report_path = get_report_path(log, config)
+        if not report_path.is_file():
+            pending.append((log, report_path))
+    return pending
+
+
+def is_log_pending(log: Log, report_path: Path, config: Config) -> bool:
+    """Checks if report of log is to be built, the same way as
+    `find_pending_logs` does
+
+    With `MANIFEST` log rejected because of too many errors is not pending
+    until it is changed or it is checked by other settings
+    """
+    if not config.manifest:
+        return not report_path.is_file()
+    return any(
+        pending_log.path.name == log.path.name
+        for pending_log, _ in find_manifest_pending_logs(config, log.date)
+    )
+
+
+def build_reports(
+    pending: list[tuple[Log, Path]],
+    config: Config
+) -> tuple[int, int, int]:
+    """Builds reports for several logs in a process pool
+
+    Logs are scheduled from the largest to the smallest, so a big log does
+    not start last and keep the whole run waiting for it. Every log is parsed
+    by a single process
+
+    Args:
+        pending: logs and paths of their reports, see `find_pending_logs`
+        config: settings object, `BATCH_WORKERS` is the pool size
+
+    Returns:
+        Number of built reports, logs rejected because of too many errors and
+          logs failed with exception
+    """
+    pending = sorted(
+        pending,
+        key=lambda item: item[0].path.stat().st_size,
+        reverse=True
+    )
+    log_config = config._replace(workers=1)
+    built = rejected = failed = 0
+    with ProcessPoolExecutor(max_workers=config.batch_workers) as executor:
+        futures = {
+            executor.submit(build_log_report, log, report_path, log_config):
+                (log, report_path)
+            for log, report_path in pending
+        }
+        for future in as_completed(futures):
+            log, report_path = futures[future]
+            try:
+                saved = future.result()
+            except Exception:
+                failed += 1
+                logger.exception('Unable to build report for `%s`', log.path)
+                continue
+            if not saved:
+                rejected += 1
+                logger.info('Report for `%s` is not built', log.path)
+            else:
+                built += 1
+                logger.info(
+                    'Report for %s saved to `%s`',
+                    log.date, report_path.absolute()
+                )
+    return built, rejected, failed
@@ -0,0 +1,94 @@
+import logging
+import os
+from pathlib import Path
+
+from .config import Config
+from .fs import Log
+from .report import Aggregate, reduce_urls_stat
+from .sampling import get_sample_key
+from .storage import (
+    StorageError,
+    dump_aggregate,
+    get_aggregation,
+    load_aggregate,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_path(report_path: Path) -> Path:
+    """Path of aggregate cache stored next to the report"""
+    return report_path.with_suffix('.stat')
+
+
+def get_cache_key(log: Log, config: Config) -> dict:
+    """Identifies log file and settings the aggregate is collected with
+
+    Report options (`REPORT_SIZE`, `MAX_ERROR_RATE`) are not a part of the key,
+    the cache is valid for any of them. Sampling settings are a part of the
+    key only when sampling is on
+    """
+    stat = log.path.stat()
+    return dict(
+        path=str(log.path.absolute()),
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        log_format=config.log_format,
+        aggregation=config.aggregation,
+        url_rules=config.url_rules and [
+            list(rule) for rule in config.url_rules
+        ],
+        **get_sample_key(config)
+    )
+
+
+def load_cached_stat(
+    log: Log,
+    cache_path: Path,
+    config: Config
+) -> Aggregate | None:
+    """Loads aggregate of log if it is cached and up to date
+
+    Returns:
+        Cached aggregate or None if there is no valid cache
+    """
+    if not cache_path.is_file():
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            aggregate, key = load_aggregate(f)
+    except (IOError, StorageError) as e:
+        logger.info('Ignoring broken cache `%s`: %s', cache_path, e)
+        return None
+    if key != get_cache_key(log, config):
+        logger.info('Ignoring stale cache `%s`', cache_path)
+        return None
+    logger.info('Loaded aggregate of `%s` from cache', log.path)
+    return aggregate
+
+
+def save_cached_stat(
+    aggregate: Aggregate,
+    log: Log,
+    cache_path: Path,
+    config: Config
+) -> None:
+    """Saves aggregate of log, the file is replaced atomically
+
+    Request times of `exact` aggregate are reduced to statistics of every
+    url the report needs, see `reduce_urls_stat`, so the cache takes fixed
+    space per url instead of 8 bytes per line
+    """
+    if get_aggregation(aggregate.urls_stat) == 'exact':
+        aggregate = aggregate._replace(
+            urls_stat=reduce_urls_stat(aggregate.urls_stat)
+        )
+    tmp_path = cache_path.with_name(f'.{cache_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            dump_aggregate(aggregate, f, get_cache_key(log, config))
+        os.replace(tmp_path, cache_path)
+    except IOError as e:
+        tmp_path.unlink(missing_ok=True)
+        # Cache is an optimization, report is built anyway
+        logger.info('Unable to save cache `%s`: %s', cache_path, e)
@@ -0,0 +1,224 @@
+import logging
+import os
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Generator, Iterable, Iterator
+
+from .cache import get_cache_key
+from .config import Config
+from .fs import Log, read_log_range, read_log_windows, split_log
+from .gzindex import (
+    AccessPoint,
+    dump_access_point,
+    iter_gzip_lines,
+    load_access_point,
+)
+from .report import Aggregate, collect_stat, new_urls_stat, scan_stat
+from .sampling import is_scanned, sample_lines
+from .storage import StorageError, dump_aggregate, load_aggregate
+from .validate import TooManyErrors, get_abort_error_lines, get_abort_error_rate
+
+# Uncompressed bytes of plain log between positions checkpoint is saved at
+CHECKPOINT_SPAN = 64 << 20
+logger = logging.getLogger(__name__)
+
+
+def get_checkpoint_path(log: Log, config: Config) -> Path:
+    return Path(config.report_dir) / f'.checkpoint-{log.path.name}.stat'
+
+
+def collect_stat_checkpointed(log: Log, config: Config) -> Aggregate:
+    """Aggregates log in one process saving checkpoints on interval
+
+    Log is split into ranges, see `iter_log_ranges`. Before a range is
+    parsed, aggregate and position of the range are saved if
+    `CHECKPOINT_INTERVAL` seconds passed since the previous checkpoint.
+    Parsing of the same log with the same settings is resumed from the
+    checkpoint, ranges are parsed in the same order, so aggregate is the
+    same as of uninterrupted parsing. Checkpoint is removed when the log is
+    parsed
+
+    Raises:
+        GzipIndexError: if gzip log can not be inflated from access points
+        TooManyErrors: if parsing is aborted, see `collect_stat`
+    """
+    collect = scan_stat if is_scanned(log, config) else collect_stat
+    max_error_lines = get_abort_error_lines(log, config)
+    max_error_rate = get_abort_error_rate(log, config)
+    checkpoint_path = get_checkpoint_path(log, config)
+    aggregate, offset, point = _load_checkpoint(log, checkpoint_path, config)
+    if (
+        aggregate is not None and log.path.suffix != '.gz'
+        and offset not in (start for start, _ in split_log_ranges(log, config))
+    ):
+        logger.info(
+            'Ignoring checkpoint `%s` at unknown offset %d',
+            checkpoint_path, offset
+        )
+        aggregate = None
+    if aggregate is None:
+        aggregate = Aggregate(new_urls_stat(config.aggregation), 0, 0)
+        offset, point = 0, None
+    else:
+        logger.info('Resuming `%s` from offset %d', log.path, offset)
+    saved = time.monotonic()
+    try:
+        ranges = iter_log_ranges(log, config, offset, point)
+        for i, (start, start_point, lines) in enumerate(ranges):
+            if i and time.monotonic() - saved >= config.checkpoint_interval:
+                _save_checkpoint(
+                    aggregate, start, start_point, log, checkpoint_path,
+                    config
+                )
+                saved = time.monotonic()
+            aggregate = collect(
+                sample_lines(lines, config), config.log_format,
+                config.aggregation, aggregate, config.url_rules,
+                max_error_lines, max_error_rate=max_error_rate
+            )
+    except TooManyErrors:
+        checkpoint_path.unlink(missing_ok=True)
+        raise
+    checkpoint_path.unlink(missing_ok=True)
+    return aggregate
+
+
+def iter_log_ranges(
+    log: Log,
+    config: Config,
+    offset: int = 0,
+    point: AccessPoint | None = None
+) -> Iterator[tuple[int, AccessPoint | None, Iterable[bytes]]]:
+    """Iterates over ranges of log checkpoints are saved between
+
+    Plain log is split into ranges of `CHECKPOINT_SPAN` bytes aligned to
+    lines, see `split_log_ranges`. Gzip log is inflated once and split at
+    access points found while it is read, see `iter_gzip_lines`, so it is
+    not indexed before parsing. Range has to be read to the end before the
+    next one is taken
+
+    Args:
+        log: log to split
+        config: settings
+        offset: offset of range of plain log to start from
+        point: access point of gzip log to start from, start of file if
+          None
+
+    Yields:
+        Offset of range in uncompressed data, access point of gzip log it
+          starts at and lines of the range, or windows of uncompressed log
+          with `MMAP_READ`, see `read_log_windows`
+    """
+    if log.path.suffix == '.gz':
+        items = iter_gzip_lines(
+            log.path, config.gzip_index_span_mb << 20, point
+        )
+        while True:
+            start = 0 if point is None else point.out
+            found = []
+            yield start, point, _read_until_point(items, found)
+            if not found:
+                return
+            point = found[0]
+    else:
+        for start, read_range in split_log_ranges(log, config):
+            if start >= offset:
+                yield start, None, read_range()
+
+
+def split_log_ranges(
+    log: Log,
+    config: Config
+) -> list[tuple[int, Callable[[], Iterator[bytes]]]]:
+    """Splits plain log into ranges checkpoints are saved between
+
+    Returns:
+        Offsets of ranges and functions reading their lines, or windows of
+          log with `MMAP_READ`, see `read_log_windows`
+    """
+    size = log.path.stat().st_size
+    parts = max(1, -(-size // CHECKPOINT_SPAN))
+    read = read_log_windows if is_scanned(log, config) else read_log_range
+    return [
+        (start, partial(read, log, start, end))
+        for start, end in split_log(log, parts)
+    ]
+
+
+def _read_until_point(
+    items: Iterator[bytes | AccessPoint],
+    found: list[AccessPoint]
+) -> Generator[bytes, None, None]:
+    """Iterator over lines before the next access point, it is put to found"""
+    for item in items:
+        if isinstance(item, AccessPoint):
+            found.append(item)
+            return
+        yield item
+
+
+def _checkpoint_meta(log: Log, offset: int, config: Config) -> dict:
+    return dict(offset=offset, **get_cache_key(log, config))
+
+
+def _save_checkpoint(
+    aggregate: Aggregate,
+    offset: int,
+    point: AccessPoint | None,
+    log: Log,
+    checkpoint_path: Path,
+    config: Config
+) -> None:
+    """Saves checkpoint, the file is synced to disk and replaced atomically
+
+    Access point of gzip log is saved with it, so reading is resumed
+    without gzip index
+    """
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = checkpoint_path.with_name(
+        f'.{checkpoint_path.name}.{os.getpid()}.tmp'
+    )
+    meta = _checkpoint_meta(log, offset, config)
+    if point is not None:
+        meta['point'] = dump_access_point(point)
+    try:
+        with open(tmp_path, 'wb') as f:
+            dump_aggregate(aggregate, f, meta)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, checkpoint_path)
+    except IOError as e:
+        tmp_path.unlink(missing_ok=True)
+        # Parsing goes on, it is resumed from the previous checkpoint
+        logger.info('Unable to save checkpoint `%s`: %s', checkpoint_path, e)
+    else:
+        logger.info(
+            'Saved checkpoint of `%s` at offset %d', log.path, offset
+        )
+
+
+def _load_checkpoint(
+    log: Log,
+    checkpoint_path: Path,
+    config: Config
+) -> tuple[Aggregate | None, int, AccessPoint | None]:
+    if not checkpoint_path.is_file():
+        return None, 0, None
+    try:
+        with open(checkpoint_path, 'rb') as f:
+            aggregate, meta = load_aggregate(f)
+        point = meta.pop('point', None)
+        if point is not None:
+            point = load_access_point(point)
+    except (IOError, StorageError, ValueError) as e:
+        logger.info('Ignoring broken checkpoint `%s`: %s', checkpoint_path, e)
+        return None, 0, None
+    offset = meta.get('offset')
+    if meta != _checkpoint_meta(log, offset, config) or (
+        log.path.suffix == '.gz'
+        and (point is None or point.out != offset)
+    ):
+        logger.info('Ignoring stale checkpoint `%s`', checkpoint_path)
+        return None, 0, None
+    return aggregate, offset, point
@@ -0,0 +1,161 @@
+from array import array
+
+from .normalize import decode_url
+from .sampling import scale_stats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class URLColumn:
+    """Appends request times of one url to the columns of `ColumnarStat`"""
+    __slots__ = ('id', 'ids', 'times')
+
+    def __init__(self, url_id: int, ids: array, times: array):
+        self.id = url_id
+        self.ids = ids
+        self.times = times
+
+    def append(self, request_time_sec: float) -> None:
+        self.ids.append(self.id)
+        self.times.append(request_time_sec)
+
+
+class ColumnarStat(dict):
+    """Request times of all urls stored in two flat columns
+
+    Maps url to its `URLColumn`, so it is filled like a dict of lists of
+    request times. Url gets integer id in order of the first appearance,
+    every record takes 16 bytes: id and time. Statistics are calculated
+    with NumPy by `prepare_columnar_table`
+    """
+
+    def __init__(self):
+        super().__init__()
+        if np is None:
+            raise RuntimeError(
+                'NumPy is required for `columnar` aggregation, '
+                'install it with `pip install numpy`'
+            )
+        self.ids = array('q')
+        self.times = array('d')
+
+    def __missing__(self, url: str) -> URLColumn:
+        column = self[url] = URLColumn(len(self), self.ids, self.times)
+        return column
+
+    def __reduce__(self):
+        return _restore_columnar_stat, (list(self), self.ids, self.times)
+
+    def merge(self, other: 'ColumnarStat') -> None:
+        """Appends records of other stat, urls are matched by name"""
+        remap = np.array(
+            [self[url].id for url in other],
+            dtype=np.int64
+        )
+        other_ids = np.frombuffer(other.ids, dtype=np.int64)
+        self.ids.frombytes(remap[other_ids].tobytes())
+        self.times.extend(other.times)
+
+
+def _restore_columnar_stat(
+    urls: list[str],
+    ids: array,
+    times: array
+) -> ColumnarStat:
+    stat = ColumnarStat()
+    for url in urls:
+        stat[url]
+    stat.ids = ids
+    stat.times = times
+    for column in stat.values():
+        column.ids = ids
+        column.times = times
+    return stat
+
+
+def prepare_columnar_table(
+    stat: ColumnarStat,
+    report_size: int,
+    percentiles: tuple[int, ...],
+    sample_rate: float | None = None
+) -> list[dict]:
+    """Calculates report table with vectorised group by url id
+
+    Urls are selected with `partition` by total request time, ties are
+    resolved in order of the first appearance like in the stable sort.
+    Max, median and percentiles are calculated for selected urls only.
+    Result has the same fields as `prepare_table` ones, values may differ
+    from them in the last digits because of the summation order
+    """
+    if not stat:
+        return []
+    urls = list(stat)
+    ids = np.frombuffer(stat.ids, dtype=np.int64)
+    times = np.frombuffer(stat.times, dtype=np.float64)
+    counts = np.bincount(ids, minlength=len(urls))
+    sums = np.bincount(ids, weights=times, minlength=len(urls))
+    total_requests = len(times)
+    total_request_time_sec = times.sum()
+
+    size = min(report_size, len(urls))
+    if size <= 0:
+        return []
+    # Partition picks arbitrary urls of the total at the boundary, so all
+    # urls with it are taken before ties are resolved
+    boundary = -np.partition(-sums, size - 1)[size - 1]
+    top = np.flatnonzero(sums >= boundary)
+    top = top[np.lexsort((top, -sums[top]))][:size]
+
+    # Sort records of selected urls by rank of url, then by time, so every
+    # url gets a contiguous sorted segment
+    rank = np.full(len(urls), -1, dtype=np.int64)
+    rank[top] = np.arange(size)
+    record_rank = rank[ids]
+    selected = record_rank >= 0
+    record_rank = record_rank[selected]
+    selected_times = times[selected]
+    sorted_times = selected_times[np.lexsort((selected_times, record_rank))]
+
+    top_counts = counts[top]
+    starts = np.concatenate(([0], np.cumsum(top_counts)[:-1]))
+    ends = starts + top_counts - 1
+    mid = starts + (top_counts - 1) // 2
+    medians = np.where(
+        top_counts % 2 == 1,
+        sorted_times[mid],
+        (sorted_times[mid] + sorted_times[np.minimum(mid + 1, ends)]) / 2
+    )
+    columns = dict(
+        count=top_counts,
+        count_perc=100 * top_counts / total_requests,
+        time_sum=sums[top],
+        time_perc=100 * sums[top] / total_request_time_sec,
+        time_avg=sums[top] / top_counts,
+        time_max=sorted_times[ends],
+        time_med=medians,
+    )
+    for p in percentiles:
+        pos = starts + p / 100 * (top_counts - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, ends)
+        columns[f'time_p{p}'] = (
+            sorted_times[lo]
+            + (sorted_times[hi] - sorted_times[lo]) * (pos - lo)
+        )
+    columns = {name: values.tolist() for name, values in columns.items()}
+    table = [
+        dict(url=decode_url(urls[url_id]), **{
+            name: values[i] for name, values in columns.items()
+        })
+        for i, url_id in enumerate(top.tolist())
+    ]
+    if sample_rate is not None:
+        squares = np.bincount(ids, weights=times * times, minlength=len(urls))
+        for row, square_sum in zip(table, squares[top].tolist()):
+            row.update(scale_stats(
+                row['count'], row['time_sum'], square_sum, sample_rate
+            ))
+    return table
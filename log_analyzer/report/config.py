@@ -2,17 +2,55 @@ import json
 from collections import namedtuple
 from pathlib import Path
 
+from .log_format import DEFAULT_LOG_FORMAT
+
 DEFAULT_CONFIG_DICT = {
     'REPORT_SIZE': 1000,
+    'WORKERS': 1,
+    'BATCH_WORKERS': 1,
+    'GZIP_INDEX': False,
+    'GZIP_INDEX_SPAN_MB': 16,
+    'MMAP_READ': True,
+    'AGGREGATION': 'exact',
+    'AGGREGATE_CACHE': True,
+    'METRICS': True,
+    'MANIFEST': True,
+    'MEMORY_LIMIT_MB': None,
+    'CHECKPOINT_INTERVAL': None,
     'REPORT_DIR': './data/reports',
+    'REPORT_GZIP': False,
+    'REPORT_SHARD_SIZE': None,
     'LOG_DIR': './data/logs',
     'MAX_ERROR_RATE': .05,
+    'EARLY_ABORT': True,
+    'SAMPLE_RATE': None,
+    'SAMPLE_SEED': 0,
+    'LOG_FORMAT': DEFAULT_LOG_FORMAT,
+    'URL_RULES': None,
+    'TIMELINE_BUCKET_MIN': None,
+    'TIMELINE_SIZE': 100,
+    'FOLLOW_INTERVAL': 60,
+    'WATCH_INTERVAL': 60,
+    'WATCH_PORT': None,
+    'WATCH_DIRS': None,
+    'HISTORY_DB': None,
+    'HISTORY_SIZE': 10000,
+    'REGRESSION_DAYS': None,
     'SCRIPT_LOG_PATH': None
 }
 
 Config = namedtuple('Config', [
-    'report_size', 'report_dir', 'log_dir',
-    'max_error_rate', 'script_log_path'
+    'report_size', 'workers', 'batch_workers', 'gzip_index',
+    'gzip_index_span_mb', 'mmap_read', 'aggregation',
+    'aggregate_cache', 'metrics', 'manifest', 'memory_limit_mb',
+    'checkpoint_interval', 'report_dir',
+    'report_gzip', 'report_shard_size', 'log_dir',
+    'max_error_rate', 'early_abort', 'sample_rate', 'sample_seed',
+    'log_format', 'url_rules',
+    'timeline_bucket_min', 'timeline_size',
+    'follow_interval', 'watch_interval', 'watch_port', 'watch_dirs',
+    'history_db', 'history_size', 'regression_days',
+    'script_log_path'
 ])
 
 
@@ -41,8 +79,35 @@ def prepare_config(config_path: Path | None = None) -> Config:
     result_dict.update(user_config_dict)
     return Config(
         report_size=result_dict['REPORT_SIZE'],
+        workers=result_dict['WORKERS'],
+        batch_workers=result_dict['BATCH_WORKERS'],
+        gzip_index=result_dict['GZIP_INDEX'],
+        gzip_index_span_mb=result_dict['GZIP_INDEX_SPAN_MB'],
+        mmap_read=result_dict['MMAP_READ'],
+        aggregation=result_dict['AGGREGATION'],
+        aggregate_cache=result_dict['AGGREGATE_CACHE'],
+        metrics=result_dict['METRICS'],
+        manifest=result_dict['MANIFEST'],
+        memory_limit_mb=result_dict['MEMORY_LIMIT_MB'],
+        checkpoint_interval=result_dict['CHECKPOINT_INTERVAL'],
         report_dir=result_dict['REPORT_DIR'],
+        report_gzip=result_dict['REPORT_GZIP'],
+        report_shard_size=result_dict['REPORT_SHARD_SIZE'],
         log_dir=result_dict['LOG_DIR'],
         max_error_rate=result_dict['MAX_ERROR_RATE'],
+        early_abort=result_dict['EARLY_ABORT'],
+        sample_rate=result_dict['SAMPLE_RATE'],
+        sample_seed=result_dict['SAMPLE_SEED'],
+        log_format=result_dict['LOG_FORMAT'],
+        url_rules=result_dict['URL_RULES'],
+        timeline_bucket_min=result_dict['TIMELINE_BUCKET_MIN'],
+        timeline_size=result_dict['TIMELINE_SIZE'],
+        follow_interval=result_dict['FOLLOW_INTERVAL'],
+        watch_interval=result_dict['WATCH_INTERVAL'],
+        watch_port=result_dict['WATCH_PORT'],
+        watch_dirs=result_dict['WATCH_DIRS'],
+        history_db=result_dict['HISTORY_DB'],
+        history_size=result_dict['HISTORY_SIZE'],
+        regression_days=result_dict['REGRESSION_DAYS'],
         script_log_path=result_dict['SCRIPT_LOG_PATH'],
     )
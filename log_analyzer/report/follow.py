@@ -0,0 +1,313 @@
+import logging
+import os
+import struct
+import time
+from collections import namedtuple
+from datetime import date
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from .config import Config
+from .fs import Log, LogTail, get_report_path
+from .report import (
+    Aggregate,
+    collect_stat,
+    merge_stat,
+    new_urls_stat,
+    save_stat_report,
+)
+from .sampling import get_sample_key, sample_lines
+from .storage import StorageError, dump_aggregate, load_aggregate
+
+# Report is re-rendered when at least this number of times of its last
+# rendering passed since it, so rendering of a big day takes a small share
+# of following whatever `FOLLOW_INTERVAL` is
+FOLLOW_RENDER_RATIO = 10
+
+# Aggregate of the day and aggregates of lines parsed on every refresh
+# after it are appended to checkpoint, sizes of the first one and of the
+# whole checkpoint are kept to compact it, see `_save_checkpoint`.
+# Number of lines and time of the last rendering throttle re-rendering
+FollowState = namedtuple('FollowState', [
+    'day', 'tail', 'aggregate', 'base_size', 'checkpoint_size',
+    'rendered_lines', 'next_render'
+])
+_u64 = struct.Struct('<Q')
+logger = logging.getLogger(__name__)
+
+
+def follow_log(path: Path, config: Config) -> None:
+    """Tails live log and re-renders report of the day on interval
+
+    Lines appended to the log are parsed every `FOLLOW_INTERVAL` seconds.
+    Report of the current day is re-rendered when they are parsed, but not
+    more often than `FOLLOW_RENDER_RATIO` times its rendering time. Read
+    offset and aggregate of new lines are appended to checkpoint, so a
+    restarted follower continues from where it stopped. Log rotation by
+    renaming and truncation are detected, the day is finished on rotation
+    or truncation and a new day starts from a new file or from the start of
+    the truncated one
+    """
+    checkpoint_path = get_follow_checkpoint_path(path, config)
+    state = start_follow(path, checkpoint_path, config)
+    try:
+        while True:
+            state = refresh_follow(state, checkpoint_path, config)
+            time.sleep(config.follow_interval)
+    finally:
+        state.tail.close()
+
+
+def get_follow_checkpoint_path(path: Path, config: Config) -> Path:
+    return Path(config.report_dir) / f'.follow-{path.name}.stat'
+
+
+def start_follow(
+    path: Path,
+    checkpoint_path: Path,
+    config: Config
+) -> FollowState:
+    """Resumes following from checkpoint if it matches the log file"""
+    state = _load_checkpoint(path, checkpoint_path, config)
+    if state is None:
+        state = _new_state(LogTail(path), config)
+    else:
+        logger.info(
+            'Resuming `%s` from offset %d', path, state.tail.offset
+        )
+    return state
+
+
+def refresh_follow(
+    state: FollowState,
+    checkpoint_path: Path,
+    config: Config
+) -> FollowState:
+    """Parses new lines of the log, renders report and saves checkpoint
+
+    Returns:
+        State to continue following with
+    """
+    tail = state.tail
+    if tail.is_truncated():
+        logger.info('`%s` is truncated, starting over', tail.path)
+        # Lines parsed since the throttled rendering are not lost, e.g. on
+        # rotation by copying and truncation
+        _render_report(state, config, force=True)
+        tail.close()
+        tail = LogTail(tail.path)
+        state = _new_state(tail, config)
+    # Rotation is checked before reading, so lines written to the old file
+    # before rotation are read to the end below
+    rotated = tail.is_rotated()
+    new_stat = collect_stat(
+        sample_lines(tail.read_lines(), config), config.log_format,
+        config.aggregation, None, config.url_rules
+    )
+    state = state._replace(aggregate=merge_stat(
+        [new_stat], config.aggregation, state.aggregate
+    ))
+    state = _render_report(state, config, force=rotated)
+    state = _save_checkpoint(state, new_stat, checkpoint_path, config)
+
+    if rotated:
+        if not tail.path.exists():
+            # New file is not created yet, keep reading the old one
+            return state
+        logger.info(
+            '`%s` is rotated, report of %s is finished', tail.path, state.day
+        )
+        tail.close()
+        state = _new_state(LogTail(tail.path), config)
+        state = _save_checkpoint(state, None, checkpoint_path, config)
+    return state
+
+
+def _new_state(tail: LogTail, config: Config) -> FollowState:
+    aggregate = Aggregate(new_urls_stat(config.aggregation), 0, 0)
+    return FollowState(date.today(), tail, aggregate, 0, 0, 0, 0.)
+
+
+def _render_report(
+    state: FollowState,
+    config: Config,
+    force: bool = False
+) -> FollowState:
+    """Renders report of the day if it has new lines and it is time to
+
+    Args:
+        state: following state
+        config: settings
+        force: render report with new lines right away, e.g. the final
+          report of the day
+    """
+    total_lines = state.aggregate.total_lines
+    if not total_lines or total_lines == state.rendered_lines:
+        return state
+    start = time.monotonic()
+    if not force and start < state.next_render:
+        return state
+    report_path = get_report_path(Log(state.tail.path, state.day), config)
+    save_stat_report(state.aggregate, report_path, config)
+    end = time.monotonic()
+    return state._replace(
+        rendered_lines=total_lines,
+        next_render=end + (end - start) * FOLLOW_RENDER_RATIO
+    )
+
+
+def _checkpoint_meta(state: FollowState, config: Config) -> dict:
+    return dict(
+        path=str(state.tail.path.absolute()),
+        inode=state.tail.inode,
+        offset=state.tail.offset,
+        day=state.day.isoformat(),
+        log_format=config.log_format,
+        aggregation=config.aggregation,
+        url_rules=config.url_rules and [
+            list(rule) for rule in config.url_rules
+        ],
+        **get_sample_key(config)
+    )
+
+
+def _save_checkpoint(
+    state: FollowState,
+    new_stat: Aggregate | None,
+    checkpoint_path: Path,
+    config: Config
+) -> FollowState:
+    """Appends aggregate of new lines and read offset to checkpoint
+
+    Checkpoint is a sequence of aggregates with meta. The first one is of
+    the day up to its offset, the next ones are of lines parsed on every
+    refresh after it. When appended aggregates get larger than the first
+    one, checkpoint is replaced with aggregate of the whole day, so saving
+    takes time proportional to new lines only
+
+    Args:
+        state: following state with aggregate of the whole day
+        new_stat: aggregate of lines parsed on refresh, None to replace
+          checkpoint
+        checkpoint_path: path of checkpoint
+        config: settings
+
+    Returns:
+        State with updated sizes of checkpoint, size of the first aggregate
+          is 0 if checkpoint has to be replaced
+    """
+    appended = state.checkpoint_size - state.base_size
+    if (
+        new_stat is not None and state.base_size
+        and appended <= state.base_size
+    ):
+        try:
+            with open(checkpoint_path, 'ab') as f:
+                size = _write_record(
+                    f, new_stat, dict(offset=state.tail.offset)
+                )
+        except IOError as e:
+            logger.info(
+                'Unable to save checkpoint `%s`: %s', checkpoint_path, e
+            )
+            # Checkpoint may end with a partial aggregate, it is replaced
+            return state._replace(base_size=0)
+        return state._replace(checkpoint_size=state.checkpoint_size + size)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = checkpoint_path.with_name(checkpoint_path.name + '.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            size = _write_record(
+                f, state.aggregate, _checkpoint_meta(state, config)
+            )
+        os.replace(tmp_path, checkpoint_path)
+    except IOError as e:
+        logger.info('Unable to save checkpoint `%s`: %s', checkpoint_path, e)
+        return state._replace(base_size=0)
+    return state._replace(base_size=size, checkpoint_size=size)
+
+
+def _load_checkpoint(
+    path: Path,
+    checkpoint_path: Path,
+    config: Config
+) -> FollowState | None:
+    """Merges aggregates of checkpoint, see `_save_checkpoint`
+
+    Aggregate appended to checkpoint partially, e.g. on crash, is dropped
+    with the lines after it, they are parsed again
+    """
+    if not checkpoint_path.is_file():
+        return None
+    records = _read_records(checkpoint_path)
+    try:
+        aggregate, meta, base_size = next(records)
+    except (IOError, StorageError, StopIteration) as e:
+        logger.info('Ignoring broken checkpoint `%s`: %s', checkpoint_path, e)
+        return None
+    offset = meta['offset']
+    checkpoint_size = base_size
+    try:
+        for new_stat, new_meta, size in records:
+            aggregate = merge_stat(
+                [new_stat], config.aggregation, aggregate
+            )
+            offset = new_meta['offset']
+            checkpoint_size += size
+    except (IOError, StorageError) as e:
+        logger.info(
+            'Checkpoint `%s` is resumed from offset %d: %s',
+            checkpoint_path, offset, e
+        )
+        # Broken end of checkpoint is dropped on the next save
+        base_size = 0
+    day = date.fromisoformat(meta['day'])
+    tail = LogTail(path, offset)
+    state = FollowState(day, tail, aggregate, base_size, checkpoint_size, 0, 0.)
+    if (
+        {**meta, 'offset': offset} != _checkpoint_meta(state, config)
+        or tail.is_truncated()
+    ):
+        logger.info('Ignoring stale checkpoint `%s`', checkpoint_path)
+        tail.close()
+        return None
+    return state
+
+
+def _write_record(f: BinaryIO, aggregate: Aggregate, meta: dict) -> int:
+    """Writes length-prefixed aggregate, see `dump_aggregate`
+
+    Returns:
+        Number of bytes written
+    """
+    data = BytesIO()
+    dump_aggregate(aggregate, data, meta)
+    f.write(_u64.pack(len(data.getbuffer())) + data.getbuffer())
+    return _u64.size + len(data.getbuffer())
+
+
+def _read_records(
+    checkpoint_path: Path
+) -> Iterator[tuple[Aggregate, dict, int]]:
+    """Iterates over aggregates written by `_write_record`
+
+    Yields:
+        Aggregate, its meta and number of bytes it takes
+
+    Raises:
+        StorageError: if aggregate is written partially or is corrupt
+    """
+    with open(checkpoint_path, 'rb') as f:
+        while True:
+            head = f.read(_u64.size)
+            if not head:
+                return
+            if len(head) < _u64.size:
+                raise StorageError('incomplete aggregate')
+            (size,) = _u64.unpack(head)
+            data = f.read(size)
+            if len(data) < size:
+                raise StorageError('incomplete aggregate')
+            aggregate, meta = load_aggregate(BytesIO(data))
+            yield aggregate, meta, _u64.size + size
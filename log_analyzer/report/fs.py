@@ -1,15 +1,40 @@
 import gzip
+import io
 import logging
+import mmap
+import os
 import re
+import zlib
 from collections import namedtuple
+from contextlib import contextmanager
 from datetime import date
+from itertools import chain, islice
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Iterable, Iterator, TextIO
 
 from .config import Config
 
 Log = namedtuple('Log', ['path', 'date'])
 log_name_rexp = re.compile(r'^nginx-access-ui\.log-(?P<date>\d{8})(\.gz)?$')
+# Size of uncompressed data split into lines at once
+READ_BLOCK_SIZE = 8 << 20
+# Size of memory-mapped plain log scanned for lines at once
+SCAN_WINDOW_SIZE = 4 << 20
+GZIP_WBITS = zlib.MAX_WBITS | 16
+# Compression ratio of gzip logs is assumed to be below this one
+GZIP_MAX_RATIO = 64
+# Sample of log checked before parsing it: lines at points spread across
+# plain log, the same number of lines from the start of gzip log
+SAMPLE_POINTS = 100
+SAMPLE_POINT_LINES = 10
+# Placeholder of regressions JSON in report templates
+REGRESSIONS_PLACEHOLDER = '$regressions_json'
+# Placeholders of style and script shared by report templates and files
+# they are replaced with
+TEMPLATE_INCLUDES = {
+    '$template_css': 'template.css',
+    '$template_js': 'template.js',
+}
 logger = logging.getLogger(__name__)
 
 
@@ -23,37 +48,57 @@ def find_log(config: Config) -> Log | None:
         Log instance with meta of found log to process. If no log is found None
           is returned
     """
-    last_log = None
-    last_date = None
+    return max(iter_logs(config), key=lambda log: log.date, default=None)
 
+
+def find_logs(config: Config, since: date | None = None) -> list[Log]:
+    """Finds all ui logs to process
+
+    Args:
+        config: settings object. Required option is log directory
+        since: if specified, only logs of this date and later are returned
+
+    Returns:
+        List of found logs sorted by date
+    """
+    return sorted(
+        (
+            log
+            for log in iter_logs(config)
+            if since is None or log.date >= since
+        ),
+        key=lambda log: log.date
+    )
+
+
+def iter_logs(config: Config) -> Generator[Log, None, None]:
+    """Iterator over ui logs in log directory
+
+    Directory is listed with `os.scandir`, names are matched before checking
+    file type, which does not need a `stat` call on most platforms
+    """
     log_path = Path(config.log_dir)
 
     if log_path.is_dir():
-        for f in log_path.iterdir():
-            if f.is_file():
-                match = log_name_rexp.match(f.name)
-                if match is not None:
-                    d = match.group('date')
-                    log_date = date(
-                        year=int(d[:4]),
-                        month=int(d[4:6]),
-                        day=int(d[6:])
-                    )
-                    if last_date is None or log_date > last_date:
-                        last_date = log_date
-                        last_log = f
-    return (
-        None
-        if last_log is None
-        else Log(last_log, last_date)
-    )
+        with os.scandir(log_path) as it:
+            for entry in it:
+                match = log_name_rexp.match(entry.name)
+                if match is not None and entry.is_file():
+                    yield Log(log_path / entry.name, get_log_date(match))
+
+
+def get_log_date(match: re.Match) -> date:
+    """Date of log from match of `log_name_rexp`"""
+    d = match.group('date')
+    return date(year=int(d[:4]), month=int(d[4:6]), day=int(d[6:]))
 
 
 def get_report_path(log: Log, config: Config) -> Path:
     """Calculates output filename based on log date and output directory"""
     report_dir = Path(config.report_dir)
     report_dir.mkdir(parents=True, exist_ok=True)
-    report_path = report_dir / f'report-{log.date:%Y.%m.%d}.html'
+    suffix = '.html.gz' if config.report_gzip else '.html'
+    report_path = report_dir / f'report-{log.date:%Y.%m.%d}{suffix}'
     return report_path
 
 
@@ -70,23 +115,382 @@ def read_log(log: Log) -> Generator[list[str], None, None]:
         raise e
 
 
+def read_log_blocks(
+    log: Log,
+    block_size: int = READ_BLOCK_SIZE
+) -> Generator[list[bytes], None, None]:
+    """Iterator reading log in large blocks, yields batches of lines
+
+    Lines are not decoded and have no line endings. Gzip log is decompressed
+    with zlib block by block instead of line by line text reading
+    """
+    try:
+        if log.path.suffix == '.gz':
+            blocks = _read_gzip_blocks(log.path, block_size)
+        else:
+            blocks = _read_plain_blocks(log.path, 0, None, block_size)
+        yield from _split_blocks(blocks)
+    except IOError as e:
+        # It will be caught further, so no traceback here
+        logger.info('Unable to read `%s`', log.path)
+        raise e
+
+
+def read_log_bytes(log: Log) -> Iterator[bytes]:
+    """Iterator over undecoded lines of log, see `read_log_blocks`"""
+    return chain.from_iterable(read_log_blocks(log))
+
+
+def _split_blocks(
+    blocks: Iterable[bytes]
+) -> Generator[list[bytes], None, None]:
+    tail = b''
+    for block in blocks:
+        lines = (tail + block).split(b'\n')
+        tail = lines.pop()
+        yield lines
+    if tail:
+        yield [tail]
+
+
+def _read_plain_blocks(
+    path: Path,
+    start: int,
+    end: int | None,
+    block_size: int
+) -> Generator[bytes, None, None]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while end is None or pos < end:
+            size = block_size if end is None else min(block_size, end - pos)
+            block = f.read(size)
+            if not block:
+                return
+            pos += len(block)
+            yield block
+
+
+def _read_gzip_blocks(
+    path: Path,
+    block_size: int
+) -> Generator[bytes, None, None]:
+    # Compressed logs shrink about ten times
+    read_size = max(block_size // 8, 1 << 16)
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    # Current member is started but its end is not reached yet
+    pending = False
+    with open(path, 'rb') as f:
+        while data := f.read(read_size):
+            while data:
+                if not pending and not data.strip(b'\x00'):
+                    # Zero padding after the last member is allowed
+                    break
+                pending = True
+                block = decompressor.decompress(data)
+                if block:
+                    yield block
+                if not decompressor.eof:
+                    break
+                # Next member of multi-member archive follows
+                pending = False
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+    if pending:
+        raise EOFError(
+            'Compressed file ended before the end-of-stream marker '
+            'was reached'
+        )
+
+
+def get_uncompressed_size(log: Log) -> int | None:
+    """Size of uncompressed log, None if it is unknown
+
+    Size of gzip log is taken from its trailer, which keeps it modulo 4 GB.
+    It is trusted only if the log is too small to be over 4 GB uncompressed
+    with `GZIP_MAX_RATIO` compression
+    """
+    size = log.path.stat().st_size
+    if log.path.suffix != '.gz':
+        return size
+    if size < 18 or size * GZIP_MAX_RATIO >= 1 << 32:
+        return None
+    with open(log.path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        uncompressed_size = int.from_bytes(f.read(4), 'little')
+    # Trailer of the last member of multi-member archive is smaller
+    return uncompressed_size if uncompressed_size >= size else None
+
+
+def sample_log(
+    log: Log,
+    points: int = SAMPLE_POINTS,
+    point_lines: int = SAMPLE_POINT_LINES
+) -> list[bytes]:
+    """Reads a few lines at evenly spread points of log
+
+    Plain log is read after seeking to every point, gzip log can not be
+    read from the middle, so only its first lines are read. Lines are not
+    decoded and have no line endings
+    """
+    if log.path.suffix == '.gz':
+        lines = read_log_blocks(log, min(READ_BLOCK_SIZE, 1 << 20))
+        return list(islice(chain.from_iterable(lines), points * point_lines))
+    sample = []
+    size = log.path.stat().st_size
+    with open(log.path, 'rb') as f:
+        for i in range(points):
+            offset = size * i // points
+            if offset > f.tell():
+                f.seek(offset)
+                # Skip the rest of the line the point is in
+                f.readline()
+            for _ in range(point_lines):
+                line = f.readline()
+                if not line:
+                    break
+                sample.append(line.rstrip(b'\n'))
+    return sample
+
+
+def split_log(log: Log, parts: int) -> list[tuple[int, int]]:
+    """Splits uncompressed log into byte ranges aligned to line boundaries
+
+    Args:
+        log: log to split, has to be a plain text file
+        parts: desired number of ranges. Less ranges are returned for short
+          logs, so every range contains at least one line
+
+    Returns:
+        List of consecutive `(start, end)` byte ranges covering the whole file
+    """
+    size = log.path.stat().st_size
+    bounds = [0]
+    try:
+        with open(log.path, 'rb') as f:
+            for i in range(1, parts):
+                target = size * i // parts
+                if target <= bounds[-1]:
+                    continue
+                # Step back one byte so a range starting exactly at the
+                # beginning of a line does not skip it
+                f.seek(target - 1)
+                f.readline()
+                pos = f.tell()
+                if pos >= size:
+                    break
+                if pos > bounds[-1]:
+                    bounds.append(pos)
+    except IOError as e:
+        logger.info('Unable to read `%s`', log.path)
+        raise e
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_log_range(
+    log: Log,
+    start: int,
+    end: int
+) -> Iterator[bytes]:
+    """Iterator reading undecoded lines of uncompressed log within byte range
+
+    Range bounds are expected to be aligned to line boundaries, see
+    `split_log`. Lines have no line endings
+    """
+    blocks = _read_plain_blocks(log.path, start, end, READ_BLOCK_SIZE)
+    return chain.from_iterable(_split_blocks(blocks))
+
+
+def read_log_windows(
+    log: Log,
+    start: int = 0,
+    end: int | None = None,
+    window_size: int = SCAN_WINDOW_SIZE
+) -> Generator[memoryview, None, None]:
+    """Iterator over windows of memory-mapped uncompressed log
+
+    Windows are views of the mapping, log is not copied and page cache is
+    the only buffer. Every window but the last one ends with a line ending,
+    so lines are not split between windows. A window is released when the
+    next one is taken, it must not be kept
+
+    Args:
+        log: log to read, has to be a plain text file
+        start: offset of the first window, aligned to line boundary
+        end: end of the last window, the end of file by default
+        window_size: desired size of window, a window is longer if a line
+          does not fit in it
+    """
+    try:
+        with open(log.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end is None else min(end, size)
+            if start >= end:
+                # Empty file can not be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                yield from _split_windows(mm, start, end, window_size)
+    except IOError as e:
+        # It will be caught further, so no traceback here
+        logger.info('Unable to read `%s`', log.path)
+        raise e
+
+
+def _split_windows(
+    mm: mmap.mmap,
+    start: int,
+    end: int,
+    window_size: int
+) -> Generator[memoryview, None, None]:
+    view = memoryview(mm)
+    try:
+        while start < end:
+            window_end = end
+            if start + window_size < end:
+                window_end = mm.rfind(b'\n', start, start + window_size) + 1
+                if not window_end:
+                    # Line is longer than window
+                    window_end = mm.find(b'\n', start + window_size, end) + 1
+                window_end = window_end or end
+            with view[start:window_end] as window:
+                yield window
+            start = window_end
+    finally:
+        view.release()
+
+
+class LogTail:
+    """Reads complete lines appended to a growing log file
+
+    File is kept open, so lines written right before the log is rotated are
+    read from the renamed file. Offset always points to the end of the last
+    complete line read
+    """
+
+    def __init__(self, path: Path, offset: int = 0):
+        self.path = path
+        try:
+            self.file = open(path, 'rb')
+        except IOError as e:
+            logger.info('Unable to read `%s`', path)
+            raise e
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.offset = offset
+        self.file.seek(offset)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def is_rotated(self) -> bool:
+        """Checks if log path points to another file now"""
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def is_truncated(self) -> bool:
+        """Checks if file became shorter than already read part"""
+        return os.fstat(self.file.fileno()).st_size < self.offset
+
+    def read_lines(
+        self,
+        block_size: int = 16 << 20
+    ) -> Generator[bytes, None, None]:
+        """Iterator over complete lines appended since the last call
+
+        Lines are not decoded and have no line endings. Incomplete last line
+        is left to be read when it is finished
+        """
+        while True:
+            data = self.file.read(block_size)
+            if len(data) == block_size and b'\n' not in data:
+                # Line is longer than block
+                data += self.file.readline()
+            end = data.rfind(b'\n') + 1
+            # Incomplete line is read again next time
+            self.file.seek(self.offset + end)
+            if not end:
+                return
+            self.offset += end
+            yield from data[:end].split(b'\n')[:-1]
+
+
 def save_report(report_content: str, report_path: Path) -> None:
     """Saves report content as a file with specified filename"""
+    with open_report(report_path) as f:
+        f.write(report_content)
+
+
+@contextmanager
+def open_report(report_path: Path) -> Generator[TextIO, None, None]:
+    """Opens report for writing text, gzipped if its name ends with `.gz`
+
+    Text is written to a temporary file next to the report. The file is
+    synced to disk and renamed to the report if the block succeeds, so a
+    crash never leaves a partial report behind
+    """
+    tmp_path = report_path.with_name(f'.{report_path.name}.{os.getpid()}.tmp')
     try:
-        with open(report_path, 'w') as f:
-            f.write(report_content)
+        with open(tmp_path, 'wb') as raw:
+            if report_path.suffix == '.gz':
+                # No timestamp, so the same report is the same file
+                binary = gzip.GzipFile(
+                    report_path.name, 'wb', fileobj=raw, mtime=0
+                )
+            else:
+                binary = raw
+            f = io.TextIOWrapper(binary, encoding='utf-8')
+            yield f
+            # Detached wrapper does not close the file before it is synced
+            f.flush()
+            f.detach()
+            if binary is not raw:
+                binary.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, report_path)
+        _sync_dir(report_path.parent)
     except IOError as e:
         logger.info('Unable to save report `%s`', report_path)
         raise e
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 
-def get_report_template() -> str:
-    """Returns string representation of html template for cooking report"""
-    path = Path(__file__).parent / 'template.html'
+def _sync_dir(path: Path) -> None:
+    """Syncs directory entries, so a renamed file survives a crash"""
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def get_report_template(name: str = 'template.html') -> str:
+    """Returns string representation of html template for cooking report
+
+    Style and script shared by templates are included in it, see
+    `TEMPLATE_INCLUDES`
+    """
+    content = _read_template(name)
+    for placeholder, include_name in TEMPLATE_INCLUDES.items():
+        if placeholder in content:
+            content = content.replace(
+                placeholder, _read_template(include_name).rstrip('\n'), 1
+            )
+    return content
+
+
+def _read_template(name: str) -> str:
+    path = Path(__file__).parent / name
     try:
         with open(path, 'r') as f:
-            content = f.read()
+            return f.read()
     except IOError as e:
         logger.info('Unable to load report template `%s`', path)
         raise e
-    return content
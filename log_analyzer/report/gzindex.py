@@ -0,0 +1,567 @@
+import base64
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import zlib
+from collections import namedtuple
+from itertools import chain
+from pathlib import Path
+from typing import BinaryIO, Generator, Iterable, Iterator
+
+from .fs import GZIP_WBITS, READ_BLOCK_SIZE
+
+# Gzip index keeps access points: states the decompression of `.gz` file can
+# be started from in the middle of it, like zran.c from zlib examples does.
+# Access point is a deflate block boundary: offset in uncompressed data,
+# offset in compressed file, number of bits of the previous byte the block
+# starts with and 32 KB of uncompressed data before the point (window)
+AccessPoint = namedtuple('AccessPoint', ['out', 'in_', 'bits', 'window'])
+GzipIndex = namedtuple('GzipIndex', ['size', 'mtime_ns', 'span', 'points'])
+
+INDEX_MAGIC = b'LGGZIDX'
+INDEX_VERSION = 1
+WINDOW_SIZE = 32768
+
+_index_head = struct.Struct('<QQQI')
+_point_head = struct.Struct('<QQBI')
+_u32 = struct.Struct('<I')
+
+logger = logging.getLogger(__name__)
+
+
+class GzipIndexError(RuntimeError):
+    """Gzip index can not be built or used"""
+
+
+def get_index_path(path: Path) -> Path:
+    """Path of index stored next to gzip file"""
+    return path.with_name(path.name + '.idx')
+
+
+def build_gzip_index(path: Path, span: int) -> GzipIndex:
+    """Decompresses gzip file once recording access points
+
+    Args:
+        path: gzip file
+        span: minimal distance between access points in uncompressed bytes
+
+    Raises:
+        GzipIndexError: if zlib library is not found or file is corrupt
+    """
+    stat = path.stat()
+    points = [
+        point for _, point in inflate_gzip_points(path, span)
+        if point is not None
+    ]
+    return GzipIndex(stat.st_size, stat.st_mtime_ns, span, points)
+
+
+def inflate_gzip_points(
+    path: Path,
+    span: int,
+    point: AccessPoint | None = None
+) -> Generator[tuple[bytes, AccessPoint | None], None, None]:
+    """Iterator over uncompressed blocks of gzip file and its access points
+
+    Python `zlib` module does not stop at deflate block boundaries, so zlib
+    library is called directly with ctypes
+
+    Args:
+        path: gzip file
+        span: minimal distance between access points in uncompressed bytes
+        point: access point to start from, start of file if None
+
+    Yields:
+        Uncompressed block and access point at its end, None if the block
+          does not end at access point
+
+    Raises:
+        GzipIndexError: if zlib library is not found or file is corrupt
+    """
+    lib = _load_zlib()
+    strm = _ZStream()
+    # Deflate stream of gzip member is inflated raw from access point
+    ret = lib.inflateInit2_(
+        ctypes.byref(strm), GZIP_WBITS if point is None else -zlib.MAX_WBITS,
+        lib.zlibVersion(), ctypes.sizeof(strm)
+    )
+    if ret != _Z_OK:
+        raise GzipIndexError(f'inflateInit2 failed: {ret}')
+    out_buf = ctypes.create_string_buffer(1 << 18)
+    window = ctypes.create_string_buffer(WINDOW_SIZE)
+    window_size = ctypes.c_uint()
+    total_in = total_out = last = 0
+    raw = point is not None
+    # Trailer of gzip member inflated raw is skipped by hand
+    trailer_left = 0
+    try:
+        with open(path, 'rb') as f:
+            if point is not None:
+                if point.bits:
+                    # Block starts with `bits` high bits of the previous byte
+                    f.seek(point.in_ - 1)
+                    prev = f.read(1)[0]
+                    lib.inflatePrime(
+                        ctypes.byref(strm), point.bits,
+                        prev >> (8 - point.bits)
+                    )
+                else:
+                    f.seek(point.in_)
+                lib.inflateSetDictionary(
+                    ctypes.byref(strm), point.window, len(point.window)
+                )
+                total_in = point.in_
+                total_out = last = point.out
+            # Buffer is kept referenced while zlib reads it
+            in_buf = b''
+            member_done = False
+            while True:
+                if strm.avail_in == 0:
+                    in_buf = f.read(1 << 20)
+                    if not in_buf:
+                        break
+                    strm.next_in = ctypes.cast(
+                        ctypes.c_char_p(in_buf), ctypes.c_void_p
+                    )
+                    strm.avail_in = len(in_buf)
+                if member_done:
+                    # Skipped trailer and zero padding before the next
+                    # member are counted in offsets of the next access points
+                    if trailer_left:
+                        skipped = min(trailer_left, strm.avail_in)
+                        trailer_left -= skipped
+                    else:
+                        rest = ctypes.string_at(strm.next_in, strm.avail_in)
+                        skipped = len(rest) - len(rest.lstrip(b'\x00'))
+                    strm.next_in += skipped
+                    strm.avail_in -= skipped
+                    total_in += skipped
+                    if skipped or not strm.avail_in:
+                        continue
+                    # Next member of multi-member archive
+                    lib.inflateReset2(ctypes.byref(strm), GZIP_WBITS)
+                    member_done = False
+                strm.next_out = ctypes.cast(out_buf, ctypes.c_void_p)
+                strm.avail_out = len(out_buf)
+                avail_in = strm.avail_in
+                ret = lib.inflate(ctypes.byref(strm), _Z_BLOCK)
+                total_in += avail_in - strm.avail_in
+                size = len(out_buf) - strm.avail_out
+                total_out += size
+                block = ctypes.string_at(out_buf, size)
+                if ret == _Z_STREAM_END:
+                    trailer_left = 8 if raw else 0
+                    raw = False
+                    member_done = True
+                    yield block, None
+                    continue
+                if ret not in (_Z_OK, _Z_BUF_ERROR):
+                    raise GzipIndexError(
+                        f'Corrupt gzip file `{path}`: inflate returned {ret}'
+                    )
+                at_block_end = strm.data_type & 128
+                last_block = strm.data_type & 64
+                new_point = None
+                if (
+                    at_block_end and not last_block
+                    and total_out - last >= span
+                ):
+                    lib.inflateGetDictionary(
+                        ctypes.byref(strm), window, ctypes.byref(window_size)
+                    )
+                    # At the start of archive member the previous byte is
+                    # unknown, so the line can not be aligned there
+                    if window_size.value:
+                        new_point = AccessPoint(
+                            out=total_out,
+                            in_=total_in,
+                            bits=strm.data_type & 7,
+                            window=window.raw[:window_size.value]
+                        )
+                        last = total_out
+                if block or new_point is not None:
+                    yield block, new_point
+            if not member_done:
+                raise GzipIndexError(f'Truncated gzip file `{path}`')
+    finally:
+        lib.inflateEnd(ctypes.byref(strm))
+
+
+def save_gzip_index(index: GzipIndex, index_path: Path) -> None:
+    """Saves index, windows are compressed"""
+    tmp_path = index_path.with_name(f'.{index_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            _dump_index(index, f)
+        os.replace(tmp_path, index_path)
+    except IOError as e:
+        tmp_path.unlink(missing_ok=True)
+        logger.info('Unable to save gzip index `%s`', index_path)
+        raise e
+
+
+def load_gzip_index(path: Path, index_path: Path) -> GzipIndex | None:
+    """Loads index of gzip file
+
+    Returns:
+        Index or None if there is no index, it is corrupt or is built for
+          another version of the file
+    """
+    if not index_path.is_file():
+        return None
+    try:
+        with open(index_path, 'rb') as f:
+            index = _load_index(f)
+    except (IOError, ValueError, struct.error, zlib.error) as e:
+        logger.info('Ignoring broken gzip index `%s`: %s', index_path, e)
+        return None
+    stat = path.stat()
+    if (index.size, index.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        logger.info('Ignoring stale gzip index `%s`', index_path)
+        return None
+    return index
+
+
+def ensure_gzip_index(path: Path, span: int) -> GzipIndex:
+    """Loads index of gzip file building it if needed"""
+    index_path = get_index_path(path)
+    index = load_gzip_index(path, index_path)
+    if index is None:
+        logger.info('Building gzip index of `%s`', path)
+        index = build_gzip_index(path, span)
+        try:
+            save_gzip_index(index, index_path)
+        except IOError:
+            # Log directory may be read-only, index is used for this run only
+            return index
+        logger.info(
+            'Saved gzip index `%s` with %d access points',
+            index_path, len(index.points)
+        )
+    return index
+
+
+def read_gzip_from(
+    path: Path,
+    point: AccessPoint | None,
+    block_size: int = READ_BLOCK_SIZE
+) -> Generator[bytes, None, None]:
+    """Iterator over uncompressed blocks of gzip file from access point
+
+    Args:
+        path: gzip file
+        point: access point to start from, start of file if None
+        block_size: approximate size of uncompressed blocks
+    """
+    read_size = max(block_size // 8, 1 << 16)
+    with open(path, 'rb') as f:
+        if point is None:
+            rest = b''
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            trailer_left = 0
+        else:
+            # Rest of the member is inflated from the point, then the
+            # following members are read as usual
+            rest = yield from _inflate_from(f, point, block_size, read_size)
+            decompressor = None
+            trailer_left = 8
+        chunks = chain((rest,), iter(lambda: f.read(read_size), b''))
+        for data in chunks:
+            if trailer_left:
+                skipped = min(trailer_left, len(data))
+                data = data[skipped:]
+                trailer_left -= skipped
+            while data:
+                if decompressor is None:
+                    # Zero padding between and after members is allowed
+                    data = data.lstrip(b'\x00')
+                    if not data:
+                        break
+                    # Next member of multi-member archive
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+                block = decompressor.decompress(data)
+                if block:
+                    yield block
+                if not decompressor.eof:
+                    break
+                data = decompressor.unused_data
+                decompressor = None
+        if decompressor is not None and not decompressor.eof:
+            raise EOFError(
+                'Compressed file ended before the end-of-stream marker '
+                'was reached'
+            )
+
+
+def read_gzip_range(
+    path: Path,
+    point: AccessPoint | None,
+    end: int
+) -> Iterator[bytes]:
+    """Iterator over lines of gzip file starting within uncompressed range
+
+    Range starts at the access point (or at the start of file) and ends at
+    `end` offset in uncompressed data. Line belongs to the range its first
+    byte is in, so consecutive ranges have every line exactly once. Lines
+    are not decoded and have no line endings
+    """
+    start = 0 if point is None else point.out
+    skip_partial = point is not None and not point.window.endswith(b'\n')
+    blocks = read_gzip_from(path, point)
+    return _range_lines(blocks, start, end, skip_partial)
+
+
+def iter_gzip_lines(
+    path: Path,
+    span: int,
+    point: AccessPoint | None = None
+) -> Generator[bytes | AccessPoint, None, None]:
+    """Iterator over lines of gzip file and access points between them
+
+    File is inflated once, access points are found while it is read, see
+    `inflate_gzip_points`. Point is yielded after the last line starting
+    before it, like lines of ranges of `read_gzip_range`. So aggregate of
+    lines before a point and the point are a position to resume reading
+    from. Lines are not decoded and have no line endings
+
+    Args:
+        path: gzip file
+        span: minimal distance between access points in uncompressed bytes
+        point: access point to start from, start of file if None
+    """
+    skip_partial = point is not None and not point.window.endswith(b'\n')
+    tail = b''
+    # Access point the incomplete last line crosses
+    crossed = None
+    for block, block_point in inflate_gzip_points(path, span, point):
+        lines = (tail + block).split(b'\n')
+        tail = lines.pop()
+        if skip_partial and lines:
+            del lines[0]
+            skip_partial = False
+        if crossed is not None and lines:
+            yield lines[0]
+            yield crossed
+            crossed = None
+            del lines[0]
+        yield from lines
+        if block_point is not None and crossed is None:
+            # Line skipped at the start crosses the point too, it is skipped
+            # when reading is resumed from the point
+            if tail and not skip_partial:
+                crossed = block_point
+            else:
+                yield block_point
+    if tail and not skip_partial:
+        yield tail
+
+
+def dump_access_point(point: AccessPoint) -> dict:
+    """Converts access point to json-serializable data, window is compressed"""
+    return dict(
+        out=point.out, in_=point.in_, bits=point.bits,
+        window=base64.b64encode(zlib.compress(point.window)).decode()
+    )
+
+
+def load_access_point(data: dict) -> AccessPoint:
+    """Reads access point written by `dump_access_point`
+
+    Raises:
+        ValueError: if data is corrupt
+    """
+    try:
+        return AccessPoint(
+            data['out'], data['in_'], data['bits'],
+            zlib.decompress(base64.b64decode(data['window']))
+        )
+    except (KeyError, TypeError, zlib.error) as e:
+        raise ValueError(f'Corrupt access point: {e}') from e
+
+
+def _range_lines(
+    blocks: Iterable[bytes],
+    start: int,
+    end: int,
+    skip_partial: bool
+) -> Generator[bytes, None, None]:
+    pos = start
+    tail = b''
+    for block in blocks:
+        data = tail + block
+        lines = data.split(b'\n')
+        tail = lines.pop()
+        if skip_partial and lines:
+            pos += len(lines[0]) + 1
+            del lines[0]
+            skip_partial = False
+        for line in lines:
+            if pos >= end:
+                return
+            yield line
+            pos += len(line) + 1
+        if pos >= end:
+            return
+    if tail and not skip_partial and pos < end:
+        yield tail
+
+
+def _inflate_from(
+    f: BinaryIO,
+    point: AccessPoint,
+    block_size: int,
+    read_size: int
+) -> Generator[bytes, None, bytes]:
+    """Inflates deflate stream of gzip member from access point
+
+    Python `zlib` module can not start at a bit offset, so zlib library is
+    called directly like in `build_gzip_index`
+
+    Returns:
+        Data read from the file after the deflate stream
+    """
+    lib = _load_zlib()
+    strm = _ZStream()
+    ret = lib.inflateInit2_(
+        ctypes.byref(strm), -zlib.MAX_WBITS, lib.zlibVersion(),
+        ctypes.sizeof(strm)
+    )
+    if ret != _Z_OK:
+        raise GzipIndexError(f'inflateInit2 failed: {ret}')
+    out_buf = ctypes.create_string_buffer(block_size)
+    try:
+        if point.bits:
+            # Block starts with `bits` high bits of the previous byte
+            f.seek(point.in_ - 1)
+            prev = f.read(1)[0]
+            lib.inflatePrime(
+                ctypes.byref(strm), point.bits, prev >> (8 - point.bits)
+            )
+        else:
+            f.seek(point.in_)
+        lib.inflateSetDictionary(
+            ctypes.byref(strm), point.window, len(point.window)
+        )
+        # Buffer is kept referenced while zlib reads it
+        in_buf = b''
+        while True:
+            if strm.avail_in == 0:
+                in_buf = f.read(read_size)
+                if not in_buf:
+                    raise EOFError(
+                        'Compressed file ended before the end-of-stream '
+                        'marker was reached'
+                    )
+                strm.next_in = ctypes.cast(
+                    ctypes.c_char_p(in_buf), ctypes.c_void_p
+                )
+                strm.avail_in = len(in_buf)
+            strm.next_out = ctypes.cast(out_buf, ctypes.c_void_p)
+            strm.avail_out = len(out_buf)
+            ret = lib.inflate(ctypes.byref(strm), _Z_NO_FLUSH)
+            size = len(out_buf) - strm.avail_out
+            if size:
+                yield ctypes.string_at(out_buf, size)
+            if ret == _Z_STREAM_END:
+                return ctypes.string_at(strm.next_in, strm.avail_in)
+            if ret not in (_Z_OK, _Z_BUF_ERROR):
+                raise GzipIndexError(
+                    f'Corrupt gzip file `{f.name}`: inflate returned {ret}'
+                )
+    finally:
+        lib.inflateEnd(ctypes.byref(strm))
+
+
+def _dump_index(index: GzipIndex, f: BinaryIO) -> None:
+    f.write(INDEX_MAGIC)
+    f.write(_u32.pack(INDEX_VERSION))
+    f.write(_index_head.pack(
+        index.size, index.mtime_ns, index.span, len(index.points)
+    ))
+    for point in index.points:
+        window = zlib.compress(point.window)
+        f.write(_point_head.pack(point.out, point.in_, point.bits, len(window)))
+        f.write(window)
+
+
+def _load_index(f: BinaryIO) -> GzipIndex:
+    data = f.read()
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError('Not a gzip index')
+    pos = len(INDEX_MAGIC)
+    (version,) = _u32.unpack_from(data, pos)
+    if version != INDEX_VERSION:
+        raise ValueError(f'Unsupported version {version}')
+    pos += _u32.size
+    size, mtime_ns, span, count = _index_head.unpack_from(data, pos)
+    pos += _index_head.size
+    points = []
+    for _ in range(count):
+        out, in_, bits, window_size = _point_head.unpack_from(data, pos)
+        pos += _point_head.size
+        window = zlib.decompress(data[pos:pos + window_size])
+        pos += window_size
+        points.append(AccessPoint(out, in_, bits, window))
+    if pos != len(data):
+        raise ValueError('Unexpected data after index')
+    return GzipIndex(size, mtime_ns, span, points)
+
+
+# Minimal zlib binding for `inflate_gzip_points` and `_inflate_from`
+
+_Z_NO_FLUSH = 0
+_Z_OK = 0
+_Z_STREAM_END = 1
+_Z_BUF_ERROR = -5
+_Z_BLOCK = 5
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong),
+    ]
+
+
+_zlib = None
+
+
+def _load_zlib() -> ctypes.CDLL:
+    global _zlib
+    if _zlib is None:
+        name = ctypes.util.find_library('z')
+        if name is None:
+            raise GzipIndexError('zlib library is not found')
+        lib = ctypes.CDLL(name)
+        lib.zlibVersion.restype = ctypes.c_char_p
+        lib.inflateInit2_.argtypes = [
+            ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int
+        ]
+        lib.inflate.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.inflateReset2.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.inflateEnd.argtypes = [ctypes.c_void_p]
+        lib.inflatePrime.argtypes = [
+            ctypes.c_void_p, ctypes.c_int, ctypes.c_int
+        ]
+        lib.inflateSetDictionary.argtypes = [
+            ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint
+        ]
+        lib.inflateGetDictionary.argtypes = [
+            ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p
+        ]
+        _zlib = lib
+    return _zlib
@@ -0,0 +1,168 @@
+import logging
+import sqlite3
+from datetime import date
+from pathlib import Path
+
+from .report import PERCENTILES, Aggregate, prepare_report_table
+
+logger = logging.getLogger(__name__)
+
+STAT_COLUMNS = (
+    'count', 'count_perc', 'time_sum', 'time_perc',
+    'time_avg', 'time_max', 'time_med',
+    *(f'time_p{p}' for p in PERCENTILES)
+)
+# Columns urls can be ordered by in `query_top`
+TOP_ORDERS = ('time_sum', 'count', 'time_max')
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS days (
+    day TEXT PRIMARY KEY,
+    total_lines INTEGER NOT NULL,
+    error_lines INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS url_stats (
+    day TEXT NOT NULL,
+    url TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    {", ".join(f"{c} REAL NOT NULL" for c in STAT_COLUMNS[1:])},
+    PRIMARY KEY (day, url)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS url_stats_url ON url_stats (url, day);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    first_day TEXT NOT NULL,
+    last_day TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS urls_first_day ON urls (first_day);
+'''
+
+
+def open_history(path: str | Path) -> sqlite3.Connection:
+    """Opens history database creating its schema if needed"""
+    # Reports of several logs may be saved at the same time in batch mode
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def save_history(
+    conn: sqlite3.Connection,
+    day: date,
+    aggregate: Aggregate,
+    history_size: int | None = None,
+    sample_rate: float | None = None
+) -> None:
+    """Stores url statistics of the day replacing previously stored ones
+
+    The first and the last days of urls of the day saved before and now
+    are recomputed, so saving a day again does not leave stale ones
+
+    Args:
+        conn: history database, see `open_history`
+        day: date of the log
+        aggregate: aggregated log
+        history_size: number of urls with the largest total request time to
+          store, all urls if None
+        sample_rate: share of sampled lines, counts and sums are scaled by
+          it, see `prepare_report_table`
+    """
+    table = prepare_report_table(
+        aggregate.urls_stat, history_size, sample_rate
+    )
+    day = day.isoformat()
+    with conn:
+        conn.execute(
+            'INSERT INTO days (day, total_lines, error_lines) '
+            'VALUES (?, ?, ?) '
+            'ON CONFLICT (day) DO UPDATE SET '
+            'total_lines = excluded.total_lines, '
+            'error_lines = excluded.error_lines',
+            (day, aggregate.total_lines, aggregate.error_lines)
+        )
+        # Urls of the day saved before and now, their days are recomputed
+        urls = {
+            row['url'] for row in conn.execute(
+                'SELECT url FROM url_stats WHERE day = ?', (day,)
+            )
+        }
+        urls.update(row['url'] for row in table)
+        conn.execute('DELETE FROM url_stats WHERE day = ?', (day,))
+        conn.executemany(
+            f'INSERT INTO url_stats (day, url, {", ".join(STAT_COLUMNS)}) '
+            f'VALUES (?, ?, {", ".join("?" * len(STAT_COLUMNS))})',
+            (
+                (day, row['url'], *(row[c] for c in STAT_COLUMNS))
+                for row in table
+            )
+        )
+        conn.executemany(
+            'DELETE FROM urls WHERE url = ?', ((url,) for url in urls)
+        )
+        # Url not saved on any day anymore gets no row
+        conn.executemany(
+            'INSERT INTO urls (url, first_day, last_day) '
+            'SELECT url, min(day), max(day) FROM url_stats '
+            'WHERE url = ? GROUP BY url',
+            ((url,) for url in urls)
+        )
+    logger.info('Saved %d urls of %s to history', len(table), day)
+
+
+def query_top(
+    conn: sqlite3.Connection,
+    since: date,
+    until: date,
+    limit: int = 10,
+    order_by: str = 'time_sum'
+) -> list[sqlite3.Row]:
+    """Urls with the largest total of `order_by` column over date range"""
+    if order_by not in TOP_ORDERS:
+        raise ValueError(
+            f'Unable to order by `{order_by}`, '
+            f'expected one of: {", ".join(TOP_ORDERS)}'
+        )
+    aggregate = 'max' if order_by == 'time_max' else 'sum'
+    return conn.execute(
+        'SELECT url, count(*) AS days, sum(count) AS count, '
+        'sum(time_sum) AS time_sum, sum(time_sum) / sum(count) AS time_avg, '
+        'max(time_max) AS time_max '
+        'FROM url_stats WHERE day BETWEEN ? AND ? '
+        f'GROUP BY url ORDER BY {aggregate}({order_by}) DESC LIMIT ?',
+        (since.isoformat(), until.isoformat(), limit)
+    ).fetchall()
+
+
+def query_trend(
+    conn: sqlite3.Connection,
+    url: str,
+    since: date | None = None,
+    until: date | None = None
+) -> list[sqlite3.Row]:
+    """Daily statistics of url"""
+    return conn.execute(
+        f'SELECT day, {", ".join(STAT_COLUMNS)} FROM url_stats '
+        'WHERE url = ? AND day BETWEEN ? AND ? ORDER BY day',
+        (
+            url,
+            (since or date.min).isoformat(),
+            (until or date.max).isoformat()
+        )
+    ).fetchall()
+
+
+def query_new_urls(
+    conn: sqlite3.Connection,
+    since: date,
+    until: date
+) -> list[sqlite3.Row]:
+    """Urls first seen within date range with their first day statistics"""
+    return conn.execute(
+        'SELECT urls.url, urls.first_day, s.count, s.time_sum, s.time_avg '
+        'FROM urls JOIN url_stats AS s '
+        'ON s.url = urls.url AND s.day = urls.first_day '
+        'WHERE urls.first_day BETWEEN ? AND ? '
+        'ORDER BY s.time_sum DESC',
+        (since.isoformat(), until.isoformat())
+    ).fetchall()
@@ -0,0 +1,104 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+DEFAULT_LOG_FORMAT = (
+    '$remote_addr $remote_user  $http_x_real_ip [$time_local] "$request" '
+    '$status $body_bytes_sent "$http_referer" '
+    '"$http_user_agent" "$http_x_forwarded_for" "$http_X_REQUEST_ID" '
+    '"$http_X_RB_USER" $request_time'
+)
+
+# Variables the report is built from. Url may be taken either from the whole
+# request line or from the variables holding the url only
+URL_VARIABLES = ('request', 'request_uri', 'uri')
+TIME_VARIABLE = 'request_time'
+# Time of request the timeline of urls is built from, optional
+LOCAL_TIME_VARIABLE = 'time_local'
+
+LineParser = namedtuple('LineParser', [
+    'pattern', 'bytes_pattern', 'scan_pattern', 'url_group', 'time_group',
+    'local_time_group'
+])
+variable_rexp = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
+
+
+@lru_cache(maxsize=None)
+def compile_log_format(log_format: str) -> LineParser:
+    """Compiles nginx `log_format` string into parser of report fields
+
+    Only url, request time and local time are captured. Every other variable
+    is matched with a character class stopping at the literal that follows
+    it, so a line is scanned once without backtracking
+
+    Args:
+        log_format: nginx `log_format` directive value, e.g.
+          `$remote_addr [$time_local] "$request" $request_time`
+
+    Returns:
+        LineParser with compiled patterns for str and bytes lines, pattern
+          finding lines in bytes of several lines and numbers of url,
+          request time and local time groups in them. Local time group is
+          None if format has no `$time_local`
+
+    Raises:
+        ValueError: if format has no url or request time variable
+    """
+    parts = []
+    groups = []
+    pos = 0
+    tokens = list(variable_rexp.finditer(log_format))
+    for i, token in enumerate(tokens):
+        parts.append(re.escape(log_format[pos:token.start()]))
+        pos = token.end()
+        name = token.group(1) or token.group(2)
+        if i + 1 < len(tokens):
+            value = _value_pattern(log_format[pos:tokens[i + 1].start()])
+        else:
+            value = _value_pattern(log_format[pos:], last=True)
+        if name == 'request':
+            # Request line is `METHOD URL PROTOCOL`, url is captured only
+            value = r'[^ \n]+ ([^ \n]+) ' + value
+            groups.append('url')
+        elif name in URL_VARIABLES:
+            value = f'({value})'
+            groups.append('url')
+        elif name == TIME_VARIABLE:
+            value = f'({value})'
+            groups.append('time')
+        elif name == LOCAL_TIME_VARIABLE and 'local_time' not in groups:
+            value = f'({value})'
+            groups.append('local_time')
+        parts.append(value)
+    parts.append(re.escape(log_format[pos:]))
+
+    if groups.count('url') != 1 or groups.count('time') != 1:
+        raise ValueError(
+            f'Log format has to contain exactly one of '
+            f'{", ".join("$" + v for v in URL_VARIABLES)} '
+            f'and ${TIME_VARIABLE} variables: `{log_format}`'
+        )
+    pattern = '^' + ''.join(parts) + r'\s*$'
+    # Trailing spaces of a line only, a match never spans line endings
+    scan_pattern = '^' + ''.join(parts) + r'[^\S\n]*$'
+    return LineParser(
+        pattern=re.compile(pattern),
+        bytes_pattern=re.compile(pattern.encode()),
+        scan_pattern=re.compile(scan_pattern.encode(), re.MULTILINE),
+        url_group=groups.index('url') + 1,
+        time_group=groups.index('time') + 1,
+        local_time_group=(
+            groups.index('local_time') + 1 if 'local_time' in groups
+            else None
+        ),
+    )
+
+
+def _value_pattern(next_literal: str, last: bool = False) -> str:
+    """Pattern of variable value ending right before the next literal"""
+    if next_literal:
+        return f'[^{re.escape(next_literal[0])}\\n]*'
+    if last:
+        return r'\S*'
+    # Variables glued together can only be split lazily
+    return r'[^\n]*?'
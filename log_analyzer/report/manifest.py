@@ -0,0 +1,234 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import namedtuple
+from datetime import date, datetime
+from pathlib import Path
+
+from .config import Config
+from .fs import Log, get_log_date, get_report_path, log_name_rexp
+
+ManifestEntry = namedtuple('ManifestEntry', [
+    'name', 'day', 'size', 'mtime_ns', 'fingerprint', 'status', 'started',
+    'seconds', 'max_error_rate', 'log_format'
+])
+# Statuses of logs in manifest
+LOG_NEW = 'new'
+LOG_BUILT = 'built'
+LOG_REJECTED = 'rejected'
+LOG_FAILED = 'failed'
+# Bytes of the start and the end of log its fingerprint is calculated from
+FINGERPRINT_SIZE = 64 << 10
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    log_dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    day TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started TEXT,
+    seconds REAL,
+    max_error_rate REAL,
+    log_format TEXT,
+    PRIMARY KEY (log_dir, name)
+) WITHOUT ROWID;
+'''
+# Columns added to manifests created before them
+_ADDED_COLUMNS = (('max_error_rate', 'REAL'), ('log_format', 'TEXT'))
+_INSERT = (
+    f'INSERT OR REPLACE INTO logs '
+    f'VALUES ({", ".join("?" * (len(ManifestEntry._fields) + 1))})'
+)
+
+
+def get_manifest_path(report_dir: Path) -> Path:
+    """Path of manifest of processed logs stored in report directory"""
+    return Path(report_dir) / '.manifest.sqlite'
+
+
+def open_manifest(report_dir: Path) -> sqlite3.Connection:
+    """Opens manifest of report directory creating its schema if needed"""
+    path = get_manifest_path(report_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Logs are recorded by several processes at the same time in batch mode
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(logs)')}
+    with conn:
+        for name, column_type in _ADDED_COLUMNS:
+            if name not in columns:
+                conn.execute(
+                    f'ALTER TABLE logs ADD COLUMN {name} {column_type}'
+                )
+    return conn
+
+
+def scan_manifest(
+    conn: sqlite3.Connection,
+    config: Config
+) -> dict[str, ManifestEntry]:
+    """Updates manifest with logs of log directory
+
+    Directory is listed with `os.scandir`, so entries are not stat-ed to
+    find files. Only new logs and logs which were not built are stat-ed,
+    rotated logs are not changed after their reports are built. A log is
+    new again if its fingerprint is changed. Logs removed from the directory
+    are removed from manifest
+
+    Returns:
+        Entries of the logs by file name
+    """
+    log_dir = _get_log_dir_key(config)
+    known = {
+        row['name']: _to_entry(row)
+        for row in conn.execute(
+            'SELECT * FROM logs WHERE log_dir = ?', (log_dir,)
+        )
+    }
+    entries = {}
+    try:
+        with os.scandir(config.log_dir) as it:
+            for dir_entry in it:
+                if log_name_rexp.match(dir_entry.name) is None:
+                    continue
+                if not dir_entry.is_file():
+                    continue
+                entry = known.get(dir_entry.name)
+                if entry is None or entry.status != LOG_BUILT:
+                    st = dir_entry.stat()
+                    if entry is None or (entry.size, entry.mtime_ns) != (
+                        st.st_size, st.st_mtime_ns
+                    ):
+                        new_entry = _new_entry(Path(dir_entry.path), st)
+                        # Touched log keeps its status
+                        if (
+                            entry is None
+                            or entry.fingerprint != new_entry.fingerprint
+                        ):
+                            entry = new_entry
+                        else:
+                            entry = entry._replace(mtime_ns=st.st_mtime_ns)
+                entries[dir_entry.name] = entry
+    except FileNotFoundError:
+        pass
+    with conn:
+        conn.executemany(
+            'DELETE FROM logs WHERE log_dir = ? AND name = ?',
+            ((log_dir, name) for name in known if name not in entries)
+        )
+        conn.executemany(
+            _INSERT,
+            (
+                (log_dir, *entry)
+                for name, entry in entries.items()
+                if known.get(name) != entry
+            )
+        )
+    return entries
+
+
+def find_manifest_pending_logs(
+    config: Config,
+    since: date | None = None
+) -> list[tuple[Log, Path]]:
+    """Finds logs without reports using manifest, see `find_pending_logs`
+
+    A log has no report if its report is not in report directory. A
+    rejected log is not pending until it is changed or `MAX_ERROR_RATE` or
+    `LOG_FORMAT` it was rejected with are changed
+    """
+    conn = open_manifest(config.report_dir)
+    try:
+        entries = scan_manifest(conn, config)
+    finally:
+        conn.close()
+    log_dir = Path(config.log_dir)
+    with os.scandir(Path(config.report_dir)) as it:
+        reports = {dir_entry.name for dir_entry in it}
+    pending = []
+    for entry in entries.values():
+        log = Log(log_dir / entry.name, date.fromisoformat(entry.day))
+        if since is not None and log.date < since:
+            continue
+        if entry.status == LOG_REJECTED and (
+            entry.max_error_rate, entry.log_format
+        ) == (config.max_error_rate, config.log_format):
+            continue
+        report_path = get_report_path(log, config)
+        if report_path.name not in reports:
+            pending.append((log, report_path))
+    return sorted(pending, key=lambda item: item[0].date)
+
+
+def record_log(
+    log: Log,
+    report_path: Path,
+    config: Config,
+    status: str,
+    started: datetime,
+    seconds: float
+) -> None:
+    """Records result of report building of log in manifest
+
+    Manifest of the directory the report is saved to is used, so it is the
+    one `find_manifest_pending_logs` reads for `REPORT_DIR`. Settings the
+    log is rejected by are recorded with its status
+    """
+    try:
+        entry = _new_entry(log.path, log.path.stat())._replace(
+            status=status, started=started.isoformat(), seconds=seconds,
+            max_error_rate=config.max_error_rate, log_format=config.log_format
+        )
+        conn = open_manifest(report_path.parent)
+        try:
+            with conn:
+                conn.execute(_INSERT, (_get_log_dir_key(config), *entry))
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        # Manifest is an optimization, report is built anyway
+        logger.info('Unable to record `%s` in manifest: %s', log.path, e)
+
+
+def get_log_fingerprint(path: Path, size: int) -> str:
+    """Hash of size and the first and the last bytes of log
+
+    Rotated logs are not changed, so the hash tells a log replaced with
+    another one with the same name without reading the whole log
+    """
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        h.update(f.read(FINGERPRINT_SIZE))
+        if size > 2 * FINGERPRINT_SIZE:
+            f.seek(-FINGERPRINT_SIZE, os.SEEK_END)
+        h.update(f.read(FINGERPRINT_SIZE))
+    return h.hexdigest()
+
+
+def _get_log_dir_key(config: Config) -> str:
+    return str(Path(config.log_dir).resolve())
+
+
+def _new_entry(path: Path, st: os.stat_result) -> ManifestEntry:
+    return ManifestEntry(
+        name=path.name,
+        day=get_log_date(log_name_rexp.match(path.name)).isoformat(),
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        fingerprint=get_log_fingerprint(path, st.st_size),
+        status=LOG_NEW,
+        started=None,
+        seconds=None,
+        max_error_rate=None,
+        log_format=None,
+    )
+
+
+def _to_entry(row: sqlite3.Row) -> ManifestEntry:
+    return ManifestEntry(*(row[field] for field in ManifestEntry._fields))
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import Generator, Iterable
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Wall and CPU time of pipeline stages and counters of a run
+
+    CPU time includes finished child processes, so stages run in a process
+    pool are measured too. Counters are added per block of lines, the per
+    line loop is not touched
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._wall = perf_counter()
+        self._cpu = get_cpu_time()
+
+    @contextmanager
+    def stage(
+        self,
+        name: str,
+        exclude: str | None = None
+    ) -> Generator[None, None, None]:
+        """Measures time of the block as a stage
+
+        Args:
+            name: stage name, time of the same stage is summed
+            exclude: stage measured inside the block, its time is not added
+              to this stage
+        """
+        excluded = self._get_time(exclude)
+        wall = perf_counter()
+        cpu = get_cpu_time()
+        try:
+            yield
+        finally:
+            excluded_wall, excluded_cpu = (
+                a - b for a, b in zip(self._get_time(exclude), excluded)
+            )
+            self.add_time(
+                name,
+                perf_counter() - wall - excluded_wall,
+                get_cpu_time() - cpu - excluded_cpu
+            )
+
+    def add_time(self, name: str, wall: float, cpu: float) -> None:
+        stage = self.stages.setdefault(name, dict(wall=0., cpu=0.))
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def read_blocks(
+        self,
+        blocks: Iterable[list[bytes]]
+    ) -> Generator[list[bytes], None, None]:
+        """Measures reading of blocks of lines as `read` stage
+
+        Counts lines and uncompressed bytes read, see `read_log_blocks`
+        """
+        blocks = iter(blocks)
+        while True:
+            with self.stage('read'):
+                block = next(blocks, None)
+            if block is None:
+                return
+            self.count('bytes_uncompressed', sum(map(len, block)) + len(block))
+            yield block
+
+    def to_dict(self) -> dict:
+        """Totals, counters and stages of the run so far"""
+        wall = perf_counter() - self._wall
+        lines = self.counters.get('total_lines', 0)
+        return dict(
+            wall=wall,
+            cpu=get_cpu_time() - self._cpu,
+            lines_per_sec=lines / wall if wall > 0 else None,
+            peak_rss_mb=get_peak_rss_mb(),
+            **self.counters,
+            stages=self.stages,
+        )
+
+    def _get_time(self, name: str | None) -> tuple[float, float]:
+        stage = self.stages.get(name)
+        if stage is None:
+            return 0., 0.
+        return stage['wall'], stage['cpu']
+
+
+def get_cpu_time() -> float:
+    """CPU time of the process and its finished children, seconds"""
+    times = os.times()
+    return (
+        times.user + times.system
+        + times.children_user + times.children_system
+    )
+
+
+def get_peak_rss_mb() -> float | None:
+    """Peak resident memory of the process and its finished children
+
+    Returns:
+        Megabytes or None if platform does not report it
+    """
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak / (1 << 20)
+    return peak / (1 << 10)
+
+
+def get_metrics_path(report_path: Path) -> Path:
+    """Path of metrics stored next to the report"""
+    return report_path.with_suffix('.metrics.json')
+
+
+def save_metrics(metrics: dict, metrics_path: Path) -> None:
+    try:
+        metrics_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(metrics_path, 'w') as f:
+            json.dump(metrics, f, indent=4)
+    except IOError as e:
+        logger.info('Unable to save metrics `%s`: %s', metrics_path, e)
+
+
+def log_metrics(metrics: dict, name: str) -> None:
+    """Summarises metrics in one line of script log"""
+    stages = ', '.join(
+        f'{stage} {times["wall"]:.2f}s'
+        for stage, times in metrics['stages'].items()
+    )
+    logger.info(
+        'Metrics of %s: %.2fs wall, %.2fs CPU, %d lines, %s lines/sec, '
+        '%s urls, peak RSS %s MB (%s)',
+        name, metrics['wall'], metrics['cpu'],
+        metrics.get('total_lines', 0),
+        _format_number(metrics['lines_per_sec']),
+        metrics.get('urls', '-'),
+        _format_number(metrics['peak_rss_mb']),
+        stages
+    )
+
+
+def _format_number(value: float | None) -> str:
+    return '-' if value is None else f'{value:.0f}'
@@ -0,0 +1,101 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterable
+
+# Rules replacing high-cardinality path segments with placeholders. Pattern
+# has to match the whole segment between slashes
+DEFAULT_URL_RULES = (
+    (r'\d+', '{id}'),
+    (
+        r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+        r'[0-9a-fA-F]{4}-[0-9a-fA-F]{12}',
+        '{uuid}'
+    ),
+    (r'[0-9a-fA-F]{32,}', '{hash}'),
+)
+QUERY_PLACEHOLDER = '?{query}'
+# Normalized urls cache is cleared when it gets this number of urls
+URL_CACHE_SIZE = 1 << 17
+
+URLRules = namedtuple('URLRules', [
+    'pattern', 'bytes_pattern', 'placeholders'
+])
+
+
+@lru_cache(maxsize=None)
+def compile_url_rules(rules: tuple[tuple[str, str], ...]) -> URLRules:
+    """Compiles normalization rules into a single pattern
+
+    Every rule becomes an alternative of the pattern matching a whole path
+    segment, query string is matched by the last alternative. So url is
+    scanned once whatever the number of rules is
+
+    Args:
+        rules: pairs of segment regular expression and its placeholder
+
+    Returns:
+        URLRules with compiled patterns for str and bytes urls and
+          placeholders by the names of alternatives
+
+    Raises:
+        ValueError: if a rule is not a valid regular expression
+    """
+    alternatives = []
+    placeholders = {'query': QUERY_PLACEHOLDER}
+    for i, (rule, placeholder) in enumerate(rules):
+        try:
+            re.compile(rule)
+        except re.error as e:
+            raise ValueError(f'Invalid url rule `{rule}`: {e}')
+        alternatives.append(f'(?P<r{i}>{rule})')
+        placeholders[f'r{i}'] = placeholder
+    pattern = r'(?P<query>\?.*)'
+    if alternatives:
+        pattern = (
+            f'(?<=/)(?:{"|".join(alternatives)})(?=[/?;]|$)|' + pattern
+        )
+    return URLRules(
+        pattern=re.compile(pattern, re.DOTALL),
+        bytes_pattern=re.compile(pattern.encode(), re.DOTALL),
+        placeholders=placeholders,
+    )
+
+
+class URLNormalizer(dict):
+    """Cache of normalized urls, missing urls are normalized with rules
+
+    So a repeated url costs a single dict lookup. Works for both str and
+    bytes urls
+    """
+
+    def __init__(self, rules: Iterable[Iterable[str]]):
+        super().__init__()
+        url_rules = compile_url_rules(tuple(map(tuple, rules)))
+        self._pattern = url_rules.pattern
+        self._bytes_pattern = url_rules.bytes_pattern
+        self._placeholders = url_rules.placeholders
+        self._bytes_placeholders = {
+            name: placeholder.encode()
+            for name, placeholder in url_rules.placeholders.items()
+        }
+
+    def __missing__(self, url: str | bytes) -> str | bytes:
+        if len(self) >= URL_CACHE_SIZE:
+            self.clear()
+        if isinstance(url, bytes):
+            placeholders = self._bytes_placeholders
+            pattern = self._bytes_pattern
+        else:
+            placeholders = self._placeholders
+            pattern = self._pattern
+        normalized = pattern.sub(lambda m: placeholders[m.lastgroup], url)
+        self[url] = normalized
+        return normalized
+
+
+def decode_url(url: str | bytes) -> str:
+    """Decodes url of lines read as bytes, see `collect_stat`"""
+    if isinstance(url, bytes):
+        return url.decode(errors='replace')
+    return url
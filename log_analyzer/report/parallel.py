@@ -0,0 +1,155 @@
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .config import Config
+from .fs import Log, read_log_range, read_log_windows, split_log
+from .gzindex import AccessPoint, ensure_gzip_index, read_gzip_range
+from .report import (
+    Aggregate,
+    collect_stat,
+    log_rejected,
+    merge_stat,
+    save_stat_report,
+    scan_stat,
+)
+from .sampling import is_scanned, sample_lines
+from .validate import TooManyErrors, get_abort_error_lines, get_abort_error_rate
+
+logger = logging.getLogger(__name__)
+
+
+def build_report_parallel(
+    log: Log,
+    report_path: Path,
+    config: Config
+) -> bool:
+    """Builds report parsing parts of log in a process pool
+
+    Result is the same as for `build_report` reading the log line by line
+    """
+    try:
+        if log.path.suffix == '.gz':
+            aggregate = collect_gzip_stat_parallel(log, config)
+        else:
+            aggregate = collect_stat_parallel(log, config)
+    except TooManyErrors as e:
+        log_rejected(e.error_lines, e.total_lines)
+        return False
+    return save_stat_report(aggregate, report_path, config)
+
+
+def collect_stat_parallel(log: Log, config: Config) -> Aggregate:
+    """Aggregates log in byte ranges, one range per worker
+
+    Every range is aborted when error lines of the range alone are over
+    the limit of the whole log, see `get_abort_error_lines`
+    """
+    workers = config.workers
+    max_error_lines = get_abort_error_lines(log, config)
+    ranges = split_log(log, workers)
+    logger.info(
+        'Parsing `%s` in %d parts with %d workers',
+        log.path, len(ranges), workers
+    )
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # `map` keeps the order of ranges, so merged request times and urls
+        # go in the same order as in the log
+        aggregates = executor.map(
+            collect_range_stat,
+            [log] * len(ranges), starts, ends, [config] * len(ranges),
+            [max_error_lines] * len(ranges)
+        )
+        return merge_stat(aggregates, config.aggregation)
+
+
+def collect_range_stat(
+    log: Log,
+    start: int,
+    end: int,
+    config: Config,
+    max_error_lines: int | None = None
+) -> Aggregate:
+    if is_scanned(log, config):
+        return scan_stat(
+            read_log_windows(log, start, end), config.log_format,
+            config.aggregation, url_rules=config.url_rules,
+            max_error_lines=max_error_lines
+        )
+    return collect_stat(
+        sample_lines(read_log_range(log, start, end), config),
+        config.log_format, config.aggregation, url_rules=config.url_rules,
+        max_error_lines=max_error_lines
+    )
+
+
+def collect_gzip_stat_parallel(log: Log, config: Config) -> Aggregate:
+    """Aggregates gzip log in ranges between access points of its index
+
+    Raises:
+        GzipIndexError: if index can not be built
+    """
+    workers = config.workers
+    index = ensure_gzip_index(log.path, config.gzip_index_span_mb << 20)
+    points = split_gzip_index(index.points, workers)
+    max_error_lines = get_abort_error_lines(log, config)
+    max_error_rate = get_abort_error_rate(log, config)
+    logger.info(
+        'Parsing `%s` in %d parts with %d workers',
+        log.path, len(points), workers
+    )
+    # Range ends where the next one starts, the last one at the end of file
+    ends = [point.out for point in points[1:]] + [math.inf]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        aggregates = executor.map(
+            collect_gzip_range_stat,
+            [log] * len(points), points, ends, [config] * len(points),
+            [max_error_lines] * len(points), [max_error_rate] * len(points)
+        )
+        return merge_stat(aggregates, config.aggregation)
+
+
+def split_gzip_index(
+    points: list[AccessPoint],
+    parts: int
+) -> list[AccessPoint | None]:
+    """Chooses access points splitting uncompressed data into even parts
+
+    Returns:
+        Starts of parts, None is the start of file
+    """
+    if not points:
+        return [None]
+    # Size of uncompressed data is unknown, it is at least one span more
+    # than the last point
+    size = points[-1].out + points[0].out
+    starts = [None]
+    i = 0
+    for part in range(1, parts):
+        target = size * part // parts
+        while i < len(points) - 1 and points[i + 1].out <= target:
+            i += 1
+        start = points[i]
+        if start.out > target:
+            continue
+        if start is not starts[-1]:
+            starts.append(start)
+    return starts
+
+
+def collect_gzip_range_stat(
+    log: Log,
+    point: AccessPoint | None,
+    end: float,
+    config: Config,
+    max_error_lines: int | None = None,
+    max_error_rate: float | None = None
+) -> Aggregate:
+    return collect_stat(
+        sample_lines(read_gzip_range(log.path, point, end), config),
+        config.log_format, config.aggregation, url_rules=config.url_rules,
+        max_error_lines=max_error_lines, max_error_rate=max_error_rate
+    )
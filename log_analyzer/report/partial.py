@@ -0,0 +1,168 @@
+import logging
+import os
+from collections import namedtuple
+from datetime import date
+from pathlib import Path
+from typing import Iterable
+
+from .batch import collect_log_stat
+from .config import Config
+from .fs import Log, get_report_path
+from .report import (
+    Aggregate,
+    SpilledStat,
+    merge_stat,
+    new_urls_stat,
+    save_stat_report,
+)
+from .storage import (
+    StorageError,
+    dump_aggregate,
+    get_aggregation,
+    load_aggregate,
+)
+
+# Partial aggregate is aggregate of logs of some sources (nodes) of a day.
+# Every url has the position it is first seen at: index of source in sorted
+# `sources` and rank of url among urls of that source in order of their
+# first appearance. Urls are kept in order of the positions, so merged
+# partials have urls in the same order as aggregate of logs of all sources
+# concatenated in order of source names, whatever order they are merged in
+Partial = namedtuple('Partial', ['day', 'sources', 'aggregate', 'first_seen'])
+PARTIAL_VERSION = 1
+PARTIAL_AGGREGATIONS = ('exact', 'sketch')
+logger = logging.getLogger(__name__)
+
+
+class PartialError(ValueError):
+    """Partial aggregates can not be stored or merged"""
+
+
+def collect_partial(log: Log, config: Config, source: str) -> Partial:
+    """Aggregates log of a source, see `collect_log_stat`
+
+    Raises:
+        PartialError: if aggregation is not mergeable
+        TooManyErrors: if parsing is aborted
+    """
+    if config.aggregation not in PARTIAL_AGGREGATIONS:
+        raise PartialError(
+            f'Unable to merge `{config.aggregation}` aggregates, expected '
+            f'one of: {", ".join(PARTIAL_AGGREGATIONS)}'
+        )
+    aggregate = collect_log_stat(log, config)
+    if isinstance(aggregate.urls_stat, SpilledStat):
+        raise PartialError(
+            'Unable to merge aggregate spilled over MEMORY_LIMIT_MB'
+        )
+    first_seen = [(0, rank) for rank in range(len(aggregate.urls_stat))]
+    return Partial(log.date, [source], aggregate, first_seen)
+
+
+def merge_partials(partials: Iterable[Partial]) -> Partial:
+    """Merges partial aggregates of the same day and disjoint sources
+
+    Merging is associative and commutative: partials merged in any order
+    or by groups have the same urls in the same order, the same counters
+    and request times. Request times of url are concatenated in the order
+    of merging, report statistics do not depend on it
+
+    Raises:
+        PartialError: if partials are of different days, aggregations or
+          have common sources
+    """
+    partials = list(partials)
+    if not partials:
+        raise PartialError('Nothing to merge')
+    days = {p.day for p in partials}
+    aggregations = {get_aggregation(p.aggregate.urls_stat) for p in partials}
+    if len(days) > 1 or len(aggregations) > 1:
+        raise PartialError(
+            f'Unable to merge partials of days {sorted(map(str, days))} '
+            f'and aggregations {sorted(aggregations)}'
+        )
+    sources = sorted(s for p in partials for s in p.sources)
+    if len(set(sources)) != len(sources):
+        raise PartialError(f'Sources are merged twice: {sources}')
+    source_index = {s: i for i, s in enumerate(sources)}
+    aggregation = aggregations.pop()
+    merged = merge_stat((p.aggregate for p in partials), aggregation)
+    positions = {}
+    for p in partials:
+        for url, (source, rank) in zip(p.aggregate.urls_stat, p.first_seen):
+            position = source_index[p.sources[source]], rank
+            if url not in positions or position < positions[url]:
+                positions[url] = position
+    urls_stat = new_urls_stat(aggregation)
+    first_seen = []
+    for url in sorted(positions, key=positions.get):
+        urls_stat[url] = merged.urls_stat[url]
+        first_seen.append(positions[url])
+    aggregate = Aggregate(urls_stat, merged.total_lines, merged.error_lines)
+    return Partial(days.pop(), sources, aggregate, first_seen)
+
+
+def save_partial(partial: Partial, path: Path) -> None:
+    """Saves partial aggregate, the file is replaced atomically"""
+    meta = dict(
+        partial_version=PARTIAL_VERSION,
+        day=partial.day.isoformat(),
+        sources=partial.sources,
+        first_source=[source for source, _ in partial.first_seen],
+        first_rank=[rank for _, rank in partial.first_seen],
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            dump_aggregate(partial.aggregate, f, meta)
+        os.replace(tmp_path, path)
+    except IOError as e:
+        tmp_path.unlink(missing_ok=True)
+        logger.info('Unable to save partial aggregate `%s`', path)
+        raise e
+
+
+def load_partial(path: Path) -> Partial:
+    """Loads partial aggregate saved by `save_partial`
+
+    Raises:
+        PartialError: if file is not a partial aggregate of supported version
+    """
+    try:
+        with open(path, 'rb') as f:
+            aggregate, meta = load_aggregate(f)
+    except StorageError as e:
+        raise PartialError(f'Invalid partial aggregate `{path}`: {e}')
+    if meta.get('partial_version') != PARTIAL_VERSION:
+        raise PartialError(
+            f'Unsupported partial aggregate `{path}`: '
+            f'version {meta.get("partial_version")}'
+        )
+    first_seen = list(zip(meta['first_source'], meta['first_rank']))
+    if len(first_seen) != len(aggregate.urls_stat):
+        raise PartialError(f'Invalid partial aggregate `{path}`: positions')
+    return Partial(
+        date.fromisoformat(meta['day']), meta['sources'], aggregate,
+        first_seen
+    )
+
+
+def build_partial_report(
+    partials: Iterable[Partial],
+    config: Config
+) -> tuple[bool, Path]:
+    """Merges partial aggregates and saves report of the day to `REPORT_DIR`
+
+    Returns:
+        True if report is saved, False if logs have too many errors, and
+          report path
+    """
+    partial = merge_partials(partials)
+    logger.info(
+        'Merged %d lines of %s from %d sources',
+        partial.aggregate.total_lines, partial.day, len(partial.sources)
+    )
+    report_path = get_report_path(Log(None, partial.day), config)
+    saved = save_stat_report(partial.aggregate, report_path, config)
+    return saved, report_path
@@ -0,0 +1,232 @@
+import gzip
+import json
+import logging
+import os
+import re
+import statistics
+from pathlib import Path
+
+from .shards import get_shards_dir
+
+# Statistics of url compared with the previous reports
+REGRESSION_COLUMNS = ('time_med', 'time_avg', 'time_sum')
+# Url is tested if it is in at least this number of the previous reports
+REGRESSION_MIN_DAYS = 3
+# Value is a regression if it is this number of robust standard deviations
+# over the median of the previous days and at least `REGRESSION_MIN_CHANGE`
+# relatively over it
+REGRESSION_Z = 3.5
+REGRESSION_MIN_CHANGE = .2
+# Deviation of the previous days is at least this share of their median, so
+# a url with the same value every day is not flagged for any tiny change
+REGRESSION_MIN_DEVIATION = .05
+# Parsed tables of the previous reports are cached in report directory
+REGRESSION_CACHE_NAME = '.regression-cache.json'
+# Number of regressions listed in script log
+REGRESSION_LOG_SIZE = 5
+# Scale of median absolute deviation estimating standard deviation
+_MAD_SCALE = 1.4826
+_TABLE_START = 'var table = '
+report_name_rexp = re.compile(
+    r'^report-(?P<date>\d{4}\.\d\d\.\d\d)\.html(\.gz)?$'
+)
+logger = logging.getLogger(__name__)
+
+
+def get_regressions_path(report_path: Path) -> Path:
+    """Path of regressions summary stored next to the report"""
+    return report_path.with_suffix('.regressions.json')
+
+
+def find_regressions(
+    table: list[dict],
+    report_path: Path,
+    days: int
+) -> dict:
+    """Compares table of the report with tables of the previous reports
+
+    Tables of the previous `days` reports in directory of the report are
+    loaded, see `load_previous_tables`, and joined with the table by url.
+    Every statistic of `REGRESSION_COLUMNS` of url found in at least
+    `REGRESSION_MIN_DAYS` of them is compared with median of its previous
+    values. Spread of the previous values is estimated by median absolute
+    deviation, which is not inflated by a single bad day. Value is flagged
+    if it is over `REGRESSION_Z` deviations and `REGRESSION_MIN_CHANGE`
+    relatively over the median
+
+    Returns:
+        Summary with names of the previous `reports` and `regressions` in
+          order of the table, every one has `url`, `column`, today's
+          `value`, `baseline` median, relative `change`, `z` score and
+          number of `days` url is compared over
+    """
+    reports = find_previous_reports(report_path, days)
+    tables = load_previous_tables(reports)
+    regressions = []
+    for row in table:
+        url = row['url']
+        history = [t[url] for t in tables if url in t]
+        if len(history) < REGRESSION_MIN_DAYS:
+            continue
+        for i, column in enumerate(REGRESSION_COLUMNS):
+            values = [stats[i] for stats in history]
+            baseline = statistics.median(values)
+            if baseline <= 0:
+                continue
+            deviation = max(
+                _MAD_SCALE * statistics.median(
+                    abs(value - baseline) for value in values
+                ),
+                REGRESSION_MIN_DEVIATION * baseline
+            )
+            value = row[column]
+            z = (value - baseline) / deviation
+            change = value / baseline - 1
+            if z > REGRESSION_Z and change >= REGRESSION_MIN_CHANGE:
+                regressions.append(dict(
+                    url=url, column=column, value=value, baseline=baseline,
+                    change=change, z=z, days=len(values)
+                ))
+    return dict(
+        reports=[path.name for path in reports],
+        regressions=regressions,
+    )
+
+
+def save_regressions(summary: dict, regressions_path: Path) -> None:
+    try:
+        with open(regressions_path, 'w') as f:
+            json.dump(summary, f, indent=4)
+    except IOError as e:
+        logger.info(
+            'Unable to save regressions `%s`: %s', regressions_path, e
+        )
+
+
+def log_regressions(summary: dict, name: str) -> None:
+    """Summarises regressions in script log, the largest urls first"""
+    regressions = summary['regressions']
+    logger.info(
+        '%d regressions in %s against %d previous reports%s',
+        len(regressions), name, len(summary['reports']),
+        ''.join(
+            f', {r["url"]} {r["column"]} {r["change"]:+.0%}'
+            for r in regressions[:REGRESSION_LOG_SIZE]
+        )
+    )
+
+
+def find_previous_reports(report_path: Path, days: int) -> list[Path]:
+    """Finds the latest `days` reports of dates before the report
+
+    Returns:
+        Paths of reports, the latest first
+    """
+    match = report_name_rexp.match(report_path.name)
+    if match is None:
+        return []
+    reports = {}
+    with os.scandir(report_path.parent) as entries:
+        for entry in entries:
+            other = report_name_rexp.match(entry.name)
+            if other is None or other['date'] >= match['date']:
+                continue
+            # Plain and gzipped reports of the same date are the same
+            reports.setdefault(other['date'], report_path.parent / entry.name)
+    return [reports[day] for day in sorted(reports, reverse=True)[:days]]
+
+
+def load_previous_tables(
+    reports: list[Path]
+) -> list[dict[str, list[float]]]:
+    """Loads statistics of urls of reports, parsed tables are cached
+
+    Statistics of `REGRESSION_COLUMNS` of every report are cached in
+    `REGRESSION_CACHE_NAME` file of report directory with size and mtime of
+    the report, a report is parsed again only if it is changed. Reports
+    which can not be loaded are skipped
+
+    Returns:
+        Statistics of `REGRESSION_COLUMNS` by url of every report
+    """
+    if not reports:
+        return []
+    cache_path = reports[0].parent / REGRESSION_CACHE_NAME
+    cache = _load_cache(cache_path)
+    updated = {}
+    tables = []
+    for path in reports:
+        try:
+            stat = path.stat()
+            key = [stat.st_size, stat.st_mtime_ns]
+            entry = cache.get(path.name)
+            if entry is None or entry['key'] != key:
+                entry = dict(key=key, urls={
+                    row['url']: [row[c] for c in REGRESSION_COLUMNS]
+                    for row in load_report_table(path)
+                })
+        except (IOError, ValueError, KeyError) as e:
+            logger.info('Unable to load table of `%s`: %s', path, e)
+            continue
+        updated[path.name] = entry
+        tables.append(entry['urls'])
+    if updated != cache:
+        _save_cache(updated, cache_path)
+    return tables
+
+
+def load_report_table(report_path: Path) -> list[dict]:
+    """Loads table embedded in report page or saved in its shards
+
+    Raises:
+        ValueError: if the report has no table
+    """
+    opener = gzip.open if report_path.suffix == '.gz' else open
+    with opener(report_path, 'rt', encoding='utf-8') as f:
+        content = f.read()
+    start = content.find(_TABLE_START)
+    if start >= 0:
+        start += len(_TABLE_START)
+        return json.loads(content[start:content.index(';\n', start)])
+    return _load_shards_table(get_shards_dir(report_path))
+
+
+def _load_shards_table(shards_dir: Path) -> list[dict]:
+    """Loads rows of sharded report from its shards sorted by `time_sum`"""
+    if not shards_dir.is_dir():
+        raise ValueError('no table in report')
+    table = []
+    number = 0
+    while True:
+        path = shards_dir / f'time_sum-{number}.js'
+        if not path.is_file():
+            return table
+        content = path.read_text(encoding='utf-8')
+        start = content.index('[\n')
+        table += json.loads(content[start:content.rindex(']') + 1])
+        number += 1
+
+
+def _load_cache(cache_path: Path) -> dict:
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (IOError, ValueError) as e:
+        logger.info('Ignoring regression cache `%s`: %s', cache_path, e)
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_cache(cache: dict, cache_path: Path) -> None:
+    """Saves cache, the file is replaced atomically"""
+    tmp_path = cache_path.with_name(f'.{cache_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except IOError as e:
+        tmp_path.unlink(missing_ok=True)
+        # Cache is an optimization, regressions are found anyway
+        logger.info('Unable to save regression cache `%s`: %s', cache_path, e)
@@ -1,31 +1,63 @@
+import io
 import json
 import logging
-import re
+import math
 import statistics
 from collections import defaultdict, namedtuple
+from itertools import chain, islice
 from pathlib import Path
-from string import Template
-from typing import Generator
+from typing import Generator, Iterable, TextIO
 
+from .columnar import ColumnarStat, prepare_columnar_table
 from .config import Config
-from .fs import get_report_template, save_report
+from .fs import REGRESSIONS_PLACEHOLDER, get_report_template, open_report
+from .log_format import DEFAULT_LOG_FORMAT, LineParser, compile_log_format
+from .metrics import Metrics
+from .normalize import URLNormalizer, decode_url
+from .regression import (
+    find_regressions,
+    get_regressions_path,
+    log_regressions,
+    save_regressions,
+)
+from .sampling import sample_lines, scale_stats
+from .shards import save_sharded_report
+from .sketch import TimeSketch
+from .timeline import Timeline, add_timeline
+from .validate import MONITOR_LINES, TooManyErrors, is_error_rate_exceeded
 
 URLStat = namedtuple('URLStat', ['url', 'request_time_sec'])
-log_record_fmt = re.compile(
-    r'^(?P<remote_addr>.+?) '
-    r'(?P<remote_user>.+?) '
-    r'(?P<http_x_real_ip>.+?) '
-    r'\[(?P<time_local>.+?)\] '
-    r'"(?P<request>(?P<method>.+?) (?P<url>.+?) (?P<http>.+?))"'
-    r'(?P<status>.+?) '
-    r'(?P<body_bytes_sent>.+?) '
-    r'"(?P<http_referer>.+?)" '
-    r'"(?P<http_user_agent>.+?)" '
-    r'"(?P<http_x_forwarded_for>.+?)" '
-    r'"(?P<http_X_REQUEST_ID>.+?)" '
-    r'"(?P<http_X_RB_USER>.+?)" '
-    r'(?P<request_time>.+?)$'
+Aggregate = namedtuple('Aggregate', ['urls_stat', 'total_lines', 'error_lines'])
+# Statistics of url not depending on other urls, see `reduce_stats`
+ReducedStat = namedtuple(
+    'ReducedStat', ['count', 'time_sum', 'time_square_sum', 'quantiles']
 )
+# Containers of request times by url. Exact mode keeps every time, sketch
+# mode keeps bounded-memory summary with approximate quantiles, columnar
+# mode keeps every time in flat arrays processed with NumPy
+AGGREGATIONS = {
+    'exact': lambda: defaultdict(list),
+    'sketch': lambda: defaultdict(TimeSketch),
+    'columnar': ColumnarStat,
+}
+PERCENTILES = (90, 95, 99)
+# Placeholder of table JSON in report template
+TABLE_PLACEHOLDER = '$table_json'
+
+
+class SpilledStat(dict):
+    """Statistics of the urls with the largest total request time
+
+    Result of aggregation spilled to disk, see `collect_stat_spilled`, or
+    of reducing all urls, see `reduce_urls_stat`. Request times of every
+    url are reduced to `ReducedStat`. Urls are in order of the first
+    appearance, totals are of all urls of the log
+    """
+
+    def __init__(self, total_requests: int, total_request_time_sec: float):
+        super().__init__()
+        self.total_requests = total_requests
+        self.total_request_time_sec = total_request_time_sec
 
 
 logger = logging.getLogger(__name__)
@@ -34,93 +66,574 @@ logger = logging.getLogger(__name__)
 def build_report(
     log_reader: Generator[str, None, None],
     report_path: Path,
-    config: Config
-) -> None:
-    """Builds report based on log file and output options"""
-    urls_stat = defaultdict(list)
-    error_lines = 0
-    total_lines = 0
-    for line in log_reader:
-        total_lines += 1
-        stat = parse_line(line)
-        if stat is not None:
-            urls_stat[stat.url].append(stat.request_time_sec)
+    config: Config,
+    metrics: Metrics | None = None
+) -> bool:
+    """Builds report based on log file and output options
+
+    Args:
+        log_reader: lines of the log
+        report_path: path to save report to
+        config: settings
+        metrics: if specified, time of stages is added to it
+
+    Returns:
+        True if report is saved, False if log has too many errors
+    """
+    if metrics is None:
+        metrics = Metrics()
+    # Size of the log is unknown, so its error rate is checked at the end
+    with metrics.stage('parse'):
+        aggregate = collect_stat(
+            sample_lines(log_reader, config), config.log_format,
+            config.aggregation, url_rules=config.url_rules
+        )
+    return save_stat_report(aggregate, report_path, config, metrics)
+
+
+def collect_stat(
+    log_reader: Iterable[str] | Iterable[bytes],
+    log_format: str = DEFAULT_LOG_FORMAT,
+    aggregation: str = 'exact',
+    aggregate: Aggregate | None = None,
+    url_rules: Iterable[Iterable[str]] | None = None,
+    max_error_lines: int | None = None,
+    timeline: Timeline | None = None,
+    max_error_rate: float | None = None
+) -> Aggregate:
+    """Groups request times by url for every parsed line of the log
+
+    Args:
+        log_reader: lines of the log. If lines are bytes, urls are kept
+          undecoded, only urls in report are decoded
+        log_format: nginx `log_format` of the lines
+        aggregation: mode of keeping request times, see `AGGREGATIONS`
+        aggregate: if specified, lines are added to this aggregate. Its
+          request times container is updated in place
+        url_rules: if specified, urls are normalized with these rules before
+          grouping, see `DEFAULT_URL_RULES`
+        max_error_lines: if specified, parsing is aborted when there are
+          more error lines, they are counted every `MONITOR_LINES` lines,
+          see `get_abort_error_lines`
+        timeline: if specified, request times are added to it by
+          `$time_local` too
+        max_error_rate: if specified, parsing is aborted when error rate
+          of the lines parsed so far is over it for sure, it is checked
+          every `MONITOR_LINES` lines, see `get_abort_error_rate`
+
+    Raises:
+        TooManyErrors: if there are over `max_error_lines` error lines or
+          error rate is over `max_error_rate`
+        ValueError: if timeline is specified and log format has no
+          `$time_local`
+    """
+    parser = get_parser(log_format, timeline)
+    monitored = max_error_lines is not None or max_error_rate is not None
+    log_reader = iter(log_reader)
+    first_line = next(log_reader, None)
+    if isinstance(first_line, bytes):
+        match = parser.bytes_pattern.match
+    else:
+        match = parser.pattern.match
+    if first_line is not None:
+        log_reader = chain((first_line,), log_reader)
+    url_group = parser.url_group
+    time_group = parser.time_group
+    local_time_group = parser.local_time_group
+    isfinite = math.isfinite
+    normalized = None if url_rules is None else URLNormalizer(url_rules)
+    if aggregate is None:
+        urls_stat = new_urls_stat(aggregation)
+        error_lines = 0
+        total_lines = 0
+    else:
+        urls_stat, total_lines, error_lines = aggregate
+    while True:
+        if not monitored:
+            lines = log_reader
         else:
-            error_lines += 1
+            lines = islice(log_reader, MONITOR_LINES)
+        checked_lines = total_lines
+        # Hot loop: fields are taken right from the match without building
+        # intermediate records
+        for line in lines:
+            total_lines += 1
+            m = match(line)
+            if m is None:
+                error_lines += 1
+                continue
+            try:
+                request_time_sec = float(m[time_group])
+            except ValueError:
+                error_lines += 1
+                continue
+            # `nan` and `inf` are parsed by float too
+            if not isfinite(request_time_sec):
+                error_lines += 1
+                continue
+            url = m[url_group]
+            if normalized is not None:
+                url = normalized[url]
+            urls_stat[url].append(request_time_sec)
+            if timeline is not None:
+                timeline.add(url, m[local_time_group], request_time_sec)
+        if not monitored or total_lines == checked_lines:
+            break
+        if _is_abort_needed(
+            error_lines, total_lines, max_error_lines, max_error_rate
+        ):
+            raise TooManyErrors(total_lines, error_lines)
+    return Aggregate(urls_stat, total_lines, error_lines)
+
+
+def scan_stat(
+    windows: Iterable[memoryview] | Iterable[bytes],
+    log_format: str = DEFAULT_LOG_FORMAT,
+    aggregation: str = 'exact',
+    aggregate: Aggregate | None = None,
+    url_rules: Iterable[Iterable[str]] | None = None,
+    max_error_lines: int | None = None,
+    timeline: Timeline | None = None,
+    max_error_rate: float | None = None
+) -> Aggregate:
+    """Groups request times by url scanning windows of several lines
 
-    error_rate = error_lines / total_lines
-    if error_rate > config.max_error_rate:
-        logger.info(
-            'Too many errors during reading log. '
-            'Try to check log format'
+    Lines are found with one `finditer` call per window instead of one
+    `match` call per line, only urls and request times are copied out of the
+    window. Every match is a parsed line, lines between the matches are
+    errors, so they are counted without splitting the window into lines.
+    Aggregate is the same as of `collect_stat` over the lines of the windows
+
+    Args:
+        windows: bytes of the log, every window but the last one ends with
+          a line ending, see `read_log_windows`
+        log_format: nginx `log_format` of the lines
+        aggregation: mode of keeping request times, see `AGGREGATIONS`
+        aggregate: if specified, lines are added to this aggregate
+        url_rules: if specified, urls are normalized with these rules
+        max_error_lines: if specified, parsing is aborted when there are
+          more error lines, they are counted after every window, see
+          `get_abort_error_lines`
+        timeline: if specified, request times are added to it by
+          `$time_local` too
+        max_error_rate: if specified, parsing is aborted when error rate
+          of the lines parsed so far is over it for sure, it is checked
+          after every window, see `get_abort_error_rate`
+
+    Raises:
+        TooManyErrors: if there are over `max_error_lines` error lines or
+          error rate is over `max_error_rate`
+        ValueError: if timeline is specified and log format has no
+          `$time_local`
+    """
+    parser = get_parser(log_format, timeline)
+    finditer = parser.scan_pattern.finditer
+    url_group = parser.url_group
+    time_group = parser.time_group
+    local_time_group = parser.local_time_group
+    isfinite = math.isfinite
+    normalized = None if url_rules is None else URLNormalizer(url_rules)
+    if aggregate is None:
+        urls_stat = new_urls_stat(aggregation)
+        error_lines = 0
+        total_lines = 0
+    else:
+        urls_stat, total_lines, error_lines = aggregate
+    for window in windows:
+        # Start of the line after the last match
+        pos = 0
+        for m in finditer(window):
+            start = m.start()
+            if start != pos:
+                # Whole lines ending with line endings are skipped
+                skipped = bytes(window[pos:start]).count(b'\n')
+                total_lines += skipped
+                error_lines += skipped
+            pos = m.end() + 1
+            total_lines += 1
+            try:
+                request_time_sec = float(m[time_group])
+            except ValueError:
+                error_lines += 1
+                continue
+            # `nan` and `inf` are parsed by float too
+            if not isfinite(request_time_sec):
+                error_lines += 1
+                continue
+            url = m[url_group]
+            if normalized is not None:
+                url = normalized[url]
+            urls_stat[url].append(request_time_sec)
+            if timeline is not None:
+                timeline.add(url, m[local_time_group], request_time_sec)
+        if pos < len(window):
+            tail = bytes(window[pos:])
+            skipped = tail.count(b'\n') + (not tail.endswith(b'\n'))
+            total_lines += skipped
+            error_lines += skipped
+        if _is_abort_needed(
+            error_lines, total_lines, max_error_lines, max_error_rate
+        ):
+            raise TooManyErrors(total_lines, error_lines)
+    return Aggregate(urls_stat, total_lines, error_lines)
+
+
+def get_parser(log_format: str, timeline: Timeline | None) -> LineParser:
+    """Compiles log format checking it has fields needed for timeline"""
+    parser = compile_log_format(log_format)
+    if timeline is not None and parser.local_time_group is None:
+        raise ValueError(
+            f'Log format has to contain $time_local variable for timeline: '
+            f'`{log_format}`'
         )
-        return
-    total_requests = sum(
-        len(records)
-        for url, records in urls_stat.items()
-    )
-    total_request_time_sec = sum(
-        sum(records)
-        for url, records in urls_stat.items()
+    return parser
+
+
+def merge_stat(
+    aggregates: Iterable[Aggregate],
+    aggregation: str = 'exact',
+    aggregate: Aggregate | None = None
+) -> Aggregate:
+    """Merges aggregates of consecutive log parts into a single one
+
+    Aggregates are expected in the order of the log parts, so request times
+    and the order of urls are the same as for the whole log read at once
+
+    Args:
+        aggregates: aggregates of log parts
+        aggregation: aggregation mode of them
+        aggregate: if specified, aggregates of the next log parts are merged
+          into it in place
+    """
+    if aggregate is None:
+        aggregate = Aggregate(new_urls_stat(aggregation), 0, 0)
+    urls_stat, total_lines, error_lines = aggregate
+    for part in aggregates:
+        if isinstance(urls_stat, ColumnarStat):
+            urls_stat.merge(part.urls_stat)
+        else:
+            for url, time_stat in part.urls_stat.items():
+                urls_stat[url].extend(time_stat)
+        total_lines += part.total_lines
+        error_lines += part.error_lines
+    return Aggregate(urls_stat, total_lines, error_lines)
+
+
+def new_urls_stat(aggregation: str) -> dict:
+    """Creates empty container of request times by url"""
+    factory = AGGREGATIONS.get(aggregation)
+    if factory is None:
+        raise ValueError(
+            f'Unknown aggregation `{aggregation}`, '
+            f'expected one of: {", ".join(AGGREGATIONS)}'
+        )
+    return factory()
+
+
+def save_stat_report(
+    aggregate: Aggregate,
+    report_path: Path,
+    config: Config,
+    metrics: Metrics | None = None,
+    timeline: Timeline | None = None
+) -> bool:
+    """Renders aggregated url statistics and saves it as a report
+
+    With `REGRESSION_DAYS` table is compared with the previous reports in
+    directory of the report, regressions are shown in the report and saved
+    next to it, see `find_regressions`
+
+    Args:
+        aggregate: aggregated log
+        report_path: path to save report to
+        config: settings
+        metrics: if specified, `prepare_table`, `regressions` and `write`
+          stages are added to it, rendering is a part of writing
+        timeline: if specified, rows of tracked urls get their series, see
+          `add_timeline`
+
+    Returns:
+        True if report is saved, False if log has too many errors
+    """
+    if metrics is None:
+        metrics = Metrics()
+    urls_stat = aggregate.urls_stat
+    # Empty log has no errors, its report is empty
+    if aggregate.total_lines and (
+        aggregate.error_lines / aggregate.total_lines > config.max_error_rate
+    ):
+        log_rejected(aggregate.error_lines, aggregate.total_lines)
+        return False
+    with metrics.stage('prepare_table'):
+        table = prepare_report_table(
+            urls_stat, config.report_size, config.sample_rate
+        )
+        if timeline is not None:
+            add_timeline(table, timeline)
+    summary = None
+    if config.regression_days is not None:
+        with metrics.stage('regressions'):
+            summary = find_regressions(
+                table, report_path, config.regression_days
+            )
+    regressions = None if summary is None else summary['regressions']
+    with metrics.stage('write'):
+        if config.report_shard_size is not None:
+            save_sharded_report(
+                table, report_path, config.report_shard_size, regressions
+            )
+        else:
+            with open_report(report_path) as f:
+                write_table(table, f, regressions)
+        if summary is not None:
+            save_regressions(summary, get_regressions_path(report_path))
+    if summary is not None:
+        log_regressions(summary, report_path.name)
+    return True
+
+
+def log_rejected(error_lines: int, total_lines: int) -> None:
+    logger.info(
+        'Too many errors during reading log: %d of %d lines are not parsed. '
+        'Try to check log format', error_lines, total_lines
     )
+
+
+def prepare_report_table(
+    urls_stat: dict,
+    report_size: int | None,
+    sample_rate: float | None = None
+) -> list[dict]:
+    """Calculates statistics of urls with the largest total request time
+
+    Args:
+        urls_stat: request times by url
+        report_size: number of urls in table, all urls if None
+        sample_rate: share of sampled lines, if specified counts and sums
+          are scaled to the whole log and get confidence intervals, see
+          `scale_stats`
+    """
+    if isinstance(urls_stat, ColumnarStat):
+        return prepare_columnar_table(
+            urls_stat,
+            len(urls_stat) if report_size is None else report_size,
+            PERCENTILES,
+            sample_rate
+        )
+    if isinstance(urls_stat, SpilledStat):
+        total_requests = urls_stat.total_requests
+        total_request_time_sec = urls_stat.total_request_time_sec
+    else:
+        total_requests = sum(
+            len(records)
+            for url, records in urls_stat.items()
+        )
+        # Correctly rounded sum does not depend on the order of urls
+        total_request_time_sec = math.fsum(
+            get_time_sum(records)
+            for url, records in urls_stat.items()
+        )
     filtered_stat = sorted(
         urls_stat.items(),
-        key=lambda x: sum(x[1]),
+        key=lambda x: get_time_sum(x[1]),
         reverse=True
-    )[:config.report_size]
-    table = prepare_table(
-        filtered_stat, total_requests, total_request_time_sec
+    )[:report_size]
+    return prepare_table(
+        filtered_stat, total_requests, total_request_time_sec, sample_rate
     )
-    report_content = render_table(table)
-    save_report(report_content, report_path)
 
 
-def parse_line(line: str) -> URLStat | None:
+def parse_line(
+    line: str,
+    log_format: str = DEFAULT_LOG_FORMAT
+) -> URLStat | None:
     result = None
-    match = log_record_fmt.match(line)
+    parser = compile_log_format(log_format)
+    match = parser.pattern.match(line)
     if match is not None:
-        result = URLStat(
-            url=match.group('url'),
-            request_time_sec=float(match.group('request_time'))
-        )
+        try:
+            request_time_sec = float(match[parser.time_group])
+        except ValueError:
+            pass
+        else:
+            if math.isfinite(request_time_sec):
+                result = URLStat(
+                    url=match[parser.url_group],
+                    request_time_sec=request_time_sec
+                )
     return result
 
 
 def prepare_table(
     filtered_stat: list[tuple[str, list]],
     total_requests: int,
-    total_request_time_sec: float
+    total_request_time_sec: float,
+    sample_rate: float | None = None
 ) -> list[dict]:
     result = []
     for url, time_stat in filtered_stat:
         result.append(dict(
-            url=url,
+            url=decode_url(url),
             **prepare_stats(
-                time_stat, total_requests, total_request_time_sec
+                time_stat, total_requests, total_request_time_sec,
+                sample_rate
             )
         ))
     return result
 
 
 def prepare_stats(
-    time_stat: list[float],
+    time_stat: list[float] | TimeSketch | ReducedStat,
     total_requests: int,
-    total_request_time_sec: float
+    total_request_time_sec: float,
+    sample_rate: float | None = None
 ) -> dict:
-    url_requests = len(time_stat)
-    url_time = sum(time_stat)
-    return dict(
+    """Calculates url statistics from its request times
+
+    Statistics of `TimeSketch` are approximate: `time_med` and percentiles
+    are within `SKETCH_ACCURACY` relative error, count, sum, average and max
+    are exact. Statistics of sampled requests are scaled with `scale_stats`,
+    percentages, average and quantiles are of the sample. Request times
+    reduced by `reduce_stats` are not reduced again
+    """
+    if not isinstance(time_stat, ReducedStat):
+        time_stat = reduce_stats(time_stat)
+    url_requests = time_stat.count
+    url_time = time_stat.time_sum
+    result = dict(
         count=url_requests,
         count_perc=100 * url_requests / total_requests,
         time_sum=url_time,
         time_perc=100 * url_time / total_request_time_sec,
-        time_avg=statistics.mean(time_stat),
-        time_max=max(time_stat),
-        time_med=statistics.median(time_stat),
+        **time_stat.quantiles
+    )
+    if sample_rate is not None:
+        result.update(scale_stats(
+            url_requests, url_time, time_stat.time_square_sum, sample_rate
+        ))
+    return result
+
+
+def reduce_stats(time_stat: list[float] | TimeSketch) -> ReducedStat:
+    """Calculates statistics of url which do not depend on other urls
+
+    Reduced statistics take fixed memory whatever the number of request
+    times is, percentages of totals are calculated by `prepare_stats`
+    """
+    url_requests = len(time_stat)
+    url_time = get_time_sum(time_stat)
+    if isinstance(time_stat, TimeSketch):
+        time_avg = url_time / url_requests
+        time_max = time_stat.max
+        time_med = time_stat.quantile(.5)
+        percentiles = {
+            f'time_p{p}': time_stat.quantile(p / 100)
+            for p in PERCENTILES
+        }
+    else:
+        sorted_stat = sorted(time_stat)
+        time_avg = statistics.mean(time_stat)
+        time_max = sorted_stat[-1]
+        time_med = statistics.median(sorted_stat)
+        percentiles = {
+            f'time_p{p}': get_percentile(sorted_stat, p / 100)
+            for p in PERCENTILES
+        }
+    return ReducedStat(
+        url_requests, url_time, get_time_square_sum(time_stat),
+        dict(
+            time_avg=time_avg, time_max=time_max, time_med=time_med,
+            **percentiles
+        )
+    )
+
+
+def reduce_urls_stat(urls_stat: dict) -> SpilledStat:
+    """Reduces request times of every url, see `reduce_stats`
+
+    Reduced statistics of all urls take fixed memory per url and are enough
+    to build report of any size. Urls keep their order, totals are the same
+    as of request times
+    """
+    total_requests = sum(len(records) for records in urls_stat.values())
+    # Correctly rounded sum does not depend on the order of urls
+    total_request_time_sec = math.fsum(
+        get_time_sum(records) for records in urls_stat.values()
     )
+    reduced = SpilledStat(total_requests, total_request_time_sec)
+    for url, time_stat in urls_stat.items():
+        reduced[url] = reduce_stats(time_stat)
+    return reduced
+
+
+def get_time_sum(
+    time_stat: list[float] | TimeSketch | ReducedStat
+) -> float:
+    if isinstance(time_stat, TimeSketch):
+        return time_stat.total
+    if isinstance(time_stat, ReducedStat):
+        return time_stat.time_sum
+    # Correctly rounded sum does not depend on the order of request times,
+    # which is the order of merging for merged partial aggregates
+    return math.fsum(time_stat)
+
+
+def get_time_square_sum(time_stat: list[float] | TimeSketch) -> float:
+    if isinstance(time_stat, TimeSketch):
+        return time_stat.square_sum()
+    return math.fsum(t * t for t in time_stat)
+
 
+def get_percentile(sorted_stat: list[float], q: float) -> float:
+    """Linearly interpolated q-quantile of sorted values, `0 <= q <= 1`"""
+    pos = q * (len(sorted_stat) - 1)
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(sorted_stat) - 1)
+    return sorted_stat[lo] + (sorted_stat[hi] - sorted_stat[lo]) * (pos - lo)
 
-def render_table(table: list[dict]) -> str:
-    content = get_report_template()
-    t = Template(content)
-    return t.safe_substitute(table_json=json.dumps(table))
+
+def render_table(
+    table: list[dict],
+    regressions: list[dict] | None = None
+) -> str:
+    f = io.StringIO()
+    write_table(table, f, regressions)
+    return f.getvalue()
+
+
+def write_table(
+    table: list[dict],
+    f: TextIO,
+    regressions: list[dict] | None = None
+) -> None:
+    """Renders report of the table to a text file
+
+    Table is written row by row between parts of the template, so neither
+    the whole report nor JSON of the whole table is kept in memory.
+    Regressions are shown above the table, see `find_regressions`
+    """
+    prefix, suffix = get_report_template().split(TABLE_PLACEHOLDER, 1)
+    suffix = suffix.replace(
+        REGRESSIONS_PLACEHOLDER, json.dumps(regressions or [])
+    )
+    f.write(prefix)
+    f.write('[')
+    for i, row in enumerate(table):
+        if i:
+            f.write(', ')
+        f.write(json.dumps(row))
+    f.write(']')
+    f.write(suffix)
+
+
+def _is_abort_needed(
+    error_lines: int,
+    total_lines: int,
+    max_error_lines: int | None,
+    max_error_rate: float | None
+) -> bool:
+    if max_error_lines is not None and error_lines > max_error_lines:
+        return True
+    return max_error_rate is not None and is_error_rate_exceeded(
+        error_lines, total_lines, max_error_rate
+    )
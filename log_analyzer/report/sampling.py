@@ -0,0 +1,87 @@
+import math
+from typing import Iterable, Iterator
+from zlib import crc32
+
+from .config import Config
+from .fs import Log
+
+# Normal quantile of two-sided 95% confidence intervals of sampled stats
+SAMPLE_Z = 1.96
+
+
+def sample_lines(
+    lines: Iterable[str] | Iterable[bytes],
+    config: Config
+) -> Iterator[str] | Iterator[bytes]:
+    """Keeps `SAMPLE_RATE` share of lines chosen by their hash
+
+    A line is kept if its CRC32 seeded with `SAMPLE_SEED` is in the first
+    `SAMPLE_RATE` share of the hash range, so the same lines are chosen on
+    every run and in every part of a log parsed in parallel. Lines are
+    dropped before they are matched with log format, dropped lines are not
+    counted in total and error lines. Lines have to be unique, e.g. have
+    request id or time, identical lines are kept or dropped together
+    """
+    if config.sample_rate is None:
+        return iter(lines)
+    threshold = math.ceil(config.sample_rate * (1 << 32))
+    seed = config.sample_seed & 0xffffffff
+    return (
+        line for line in lines
+        if crc32(
+            line if isinstance(line, bytes) else line.encode(), seed
+        ) < threshold
+    )
+
+
+def is_scanned(log: Log, config: Config) -> bool:
+    """Whether log is scanned memory-mapped, see `scan_stat`
+
+    Scanning matches log format in windows of the log, lines are not split
+    before parsing, so sampled log is read line by line
+    """
+    return (
+        config.mmap_read
+        and config.sample_rate is None
+        and log.path.suffix != '.gz'
+    )
+
+
+def get_sample_key(config: Config) -> dict:
+    """Settings of sampling identifying aggregate of sampled log, if any"""
+    if config.sample_rate is None:
+        return {}
+    return dict(sample=[config.sample_rate, config.sample_seed])
+
+
+def scale_stats(
+    count: int,
+    time_sum: float,
+    square_sum: float,
+    sample_rate: float
+) -> dict:
+    """Estimates url statistics of the whole log from its sampled requests
+
+    Every request is sampled independently with probability `sample_rate`,
+    count and sum are scaled by its inverse. Half-widths of confidence
+    intervals are of normal approximation of the estimates
+
+    Args:
+        count: number of sampled requests of url
+        time_sum: sum of their request times
+        square_sum: sum of squares of their request times
+        sample_rate: share of sampled lines
+
+    Returns:
+        Scaled `count` and `time_sum`, intervals `count_ci`, `time_sum_ci`
+          and `time_avg_ci`
+    """
+    dropped = 1 - sample_rate
+    variance = max(square_sum / count - (time_sum / count) ** 2, 0.)
+    return dict(
+        count=round(count / sample_rate),
+        count_ci=SAMPLE_Z * math.sqrt(count * dropped) / sample_rate,
+        time_sum=time_sum / sample_rate,
+        time_sum_ci=SAMPLE_Z * math.sqrt(square_sum * dropped) / sample_rate,
+        time_avg_ci=SAMPLE_Z * math.sqrt(variance * dropped / count),
+    )
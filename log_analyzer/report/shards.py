@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import TextIO
+
+from .fs import REGRESSIONS_PLACEHOLDER, get_report_template, open_report
+
+# Columns the table is presorted by, every one has its own copy of shards.
+# Rows are in descending order, ties are in order of `time_sum`
+SHARD_INDEXES = ('time_sum', 'count', 'time_avg', 'time_med')
+SHARDED_TEMPLATE = 'template_sharded.html'
+# Placeholder of shards directory in sharded report template
+SHARDS_PLACEHOLDER = '$shards_dir'
+logger = logging.getLogger(__name__)
+
+
+def get_shards_dir(report_path: Path) -> Path:
+    """Directory of report shards: `report-YYYY.MM.DD` next to the report"""
+    name = report_path.name.split('.html')[0]
+    return report_path.with_name(name)
+
+
+def save_sharded_report(
+    table: list[dict],
+    report_path: Path,
+    shard_size: int,
+    regressions: list[dict] | None = None
+) -> None:
+    """Saves report loading its table by shards when they are shown
+
+    Table is written as JavaScript files calling callbacks of the report
+    page, so the report is opened from a local directory without a web
+    server. `manifest.js` has number of rows and values of index columns
+    at the bounds of every shard, `<index>-<number>.js` has rows of a shard.
+    Shards are replaced as a whole directory before the report page is
+    saved, so the page never refers to missing shards
+
+    Args:
+        table: rows of report in order of `time_sum`
+        report_path: path to save report page to
+        shard_size: number of rows in shard
+        regressions: regressions shown above the table, see
+          `find_regressions`
+    """
+    shards_dir = get_shards_dir(report_path)
+    tmp_dir = shards_dir.with_name(f'.{shards_dir.name}.{os.getpid()}.tmp')
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        manifest = dict(
+            rows=len(table),
+            shard_size=shard_size,
+            columns=list(table[0]) if table else [],
+            indexes={},
+        )
+        for index in SHARD_INDEXES:
+            order = sorted(
+                range(len(table)), key=lambda i: table[i][index], reverse=True
+            )
+            manifest['indexes'][index] = write_shards(
+                [table[i] for i in order], index, tmp_dir, shard_size
+            )
+        with open(tmp_dir / 'manifest.js', 'w', encoding='utf-8') as f:
+            f.write(f'reportManifest({json.dumps(manifest)});\n')
+        _replace_dir(tmp_dir, shards_dir)
+    except IOError as e:
+        logger.info('Unable to save report shards `%s`', shards_dir)
+        raise e
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    prefix, suffix = get_report_template(SHARDED_TEMPLATE).split(
+        SHARDS_PLACEHOLDER, 1
+    )
+    suffix = suffix.replace(
+        REGRESSIONS_PLACEHOLDER, json.dumps(regressions or [])
+    )
+    with open_report(report_path) as f:
+        f.write(prefix)
+        f.write(json.dumps(shards_dir.name))
+        f.write(suffix)
+
+
+def write_shards(
+    rows: list[dict],
+    index: str,
+    shards_dir: Path,
+    shard_size: int
+) -> list[tuple[float, float]]:
+    """Writes rows sorted by index column as shards
+
+    Returns:
+        Values of index column in the first and the last row of every shard
+    """
+    bounds = []
+    for start in range(0, len(rows), shard_size):
+        shard = rows[start:start + shard_size]
+        path = shards_dir / f'{index}-{len(bounds)}.js'
+        with open(path, 'w', encoding='utf-8') as f:
+            write_shard(shard, index, len(bounds), f)
+        bounds.append((shard[0][index], shard[-1][index]))
+    return bounds
+
+
+def write_shard(rows: list[dict], index: str, number: int, f: TextIO) -> None:
+    f.write(f'reportShard({json.dumps(index)}, {number}, [\n')
+    for i, row in enumerate(rows):
+        if i:
+            f.write(',\n')
+        f.write(json.dumps(row))
+    f.write('\n]);\n')
+
+
+def _replace_dir(src: Path, dst: Path) -> None:
+    """Replaces directory, the old one is renamed away and removed"""
+    old_dir = dst.with_name(f'.{dst.name}.{os.getpid()}.old')
+    if dst.exists():
+        os.replace(dst, old_dir)
+    os.replace(src, dst)
+    shutil.rmtree(old_dir, ignore_errors=True)
@@ -0,0 +1,124 @@
+import math
+
+# Relative accuracy of quantiles estimated by sketch: estimated value differs
+# from the true value of the same rank by no more than 1%
+SKETCH_ACCURACY = .01
+# Request times below this value are counted as zero
+SKETCH_MIN_TIME = 1e-6
+# Request times added to sum of sketch are kept until there are this number
+# of them, then they are replaced with exact partial sums
+SKETCH_PARTIALS = 32
+
+_gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_log_gamma = math.log(_gamma)
+# Request times are logged with millisecond resolution, so there are few
+# distinct values and bucket index is cheaper to look up than to compute
+_bucket_index_cache = {}
+_bucket_index_cache_size = 1 << 16
+
+
+class TimeSketch:
+    """Bounded-memory mergeable summary of request times
+
+    Keeps exact count, sum and max. Sum is kept as exact partial sums, see
+    `_exact_partials`, so it is correctly rounded and does not depend on
+    the order of request times and merging. Quantiles are estimated from a
+    histogram with logarithmic buckets: every bucket covers values within
+    `SKETCH_ACCURACY` relative error from its representative value. Times
+    from `SKETCH_MIN_TIME` to days fit in less than 2000 buckets whatever
+    the number of requests is.
+
+    Sketch supports `append`, `extend` and `len` like a list of request times
+    it replaces
+    """
+    __slots__ = ('count', 'partials', 'max', 'zeros', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.partials = []
+        self.max = 0.
+        self.zeros = 0
+        self.buckets = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def total(self) -> float:
+        return math.fsum(self.partials)
+
+    def append(self, request_time_sec: float) -> None:
+        self.count += 1
+        partials = self.partials
+        partials.append(request_time_sec)
+        if len(partials) > SKETCH_PARTIALS:
+            self.partials = _exact_partials(partials)
+        if request_time_sec > self.max:
+            self.max = request_time_sec
+        if request_time_sec < SKETCH_MIN_TIME:
+            self.zeros += 1
+            return
+        index = _bucket_index_cache.get(request_time_sec)
+        if index is None:
+            index = _bucket_index(request_time_sec)
+        buckets = self.buckets
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def extend(self, other: 'TimeSketch') -> None:
+        """Merges other sketch into this one"""
+        self.count += other.count
+        self.partials = _exact_partials(self.partials + other.partials)
+        if other.max > self.max:
+            self.max = other.max
+        self.zeros += other.zeros
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> float:
+        """Estimates q-quantile of request times, `0 <= q <= 1`"""
+        if not self.count:
+            raise ValueError('Quantile of empty sketch')
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                value = 2 * _gamma ** index / (_gamma + 1)
+                return min(value, self.max)
+        return self.max
+
+    def square_sum(self) -> float:
+        """Estimates sum of squares of request times, zeros are skipped"""
+        return math.fsum(
+            count * (2 * _gamma ** index / (_gamma + 1)) ** 2
+            for index, count in self.buckets.items()
+        )
+
+
+def _exact_partials(values: list[float]) -> list[float]:
+    """Non-overlapping partial sums of values without rounding
+
+    Every partial sum is the correctly rounded rest of the exact sum of
+    values not covered by the previous ones, so `math.fsum` of partial sums
+    is the correctly rounded sum of values. Rest of the exact sum shrinks
+    by about 2**-53 with every partial sum, usually two or three of them
+    are needed
+    """
+    rest = list(values)
+    partials = []
+    while True:
+        partial = math.fsum(rest)
+        if not partial:
+            return partials
+        partials.append(partial)
+        rest.append(-partial)
+
+
+def _bucket_index(request_time_sec: float) -> int:
+    index = math.ceil(math.log(request_time_sec) / _log_gamma)
+    if len(_bucket_index_cache) < _bucket_index_cache_size:
+        _bucket_index_cache[request_time_sec] = index
+    return index
@@ -0,0 +1,477 @@
+import heapq
+import logging
+import math
+import struct
+import tempfile
+from array import array
+from fractions import Fraction
+from io import BytesIO
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
+
+from .config import Config
+from .report import (
+    PERCENTILES,
+    Aggregate,
+    ReducedStat,
+    SpilledStat,
+    collect_stat,
+    get_percentile,
+    new_urls_stat,
+    reduce_stats,
+)
+from .sketch import TimeSketch
+from .storage import dump_aggregate, load_aggregate
+from .timeline import Timeline
+
+# Approximate memory taken by url and by request time in aggregate, bytes.
+# Sketch keeps bounded number of buckets per url whatever the number of
+# request times is
+URL_SIZE = {'exact': 200, 'sketch': 500}
+RECORD_SIZE = {'exact': 32, 'sketch': 0}
+# Max number of lines parsed between checks of memory used by aggregate.
+# With small limits lines are checked often enough to stay within a quarter
+# of the limit over it
+SPILL_CHECK_LINES = 1 << 16
+SPILL_PARTITIONS = 64
+# Partition is split again if its file times this ratio, an estimate of
+# memory taken by loaded partition, is over the limit
+SPILL_EXPANSION = 4
+# Partition still over the limit at this depth has a few urls with too many
+# request times, they are sorted externally while it is merged, see
+# `_merge_partition`
+MAX_SPILL_DEPTH = 3
+# Number of request times read at once from every sorted run of url
+RUN_READ_RECORDS = 1 << 13
+
+_u64 = struct.Struct('<Q')
+
+logger = logging.getLogger(__name__)
+
+
+def collect_stat_spilled(
+    log_reader: Iterable[bytes],
+    config: Config,
+    keep_urls: int | None,
+    timeline: Timeline | None = None,
+    max_error_lines: int | None = None,
+    max_error_rate: float | None = None
+) -> Aggregate:
+    """Groups request times by url keeping memory within `MEMORY_LIMIT_MB`
+
+    When aggregate gets over the limit, urls are hash-partitioned and
+    spilled to temporary files. In the end partitions are merged one at a
+    time, only `keep_urls` urls with the largest total request time are
+    kept. Statistics of kept urls and totals are the same as for aggregate
+    collected in memory
+
+    Args:
+        log_reader: lines of the log
+        config: settings with log format, aggregation and memory limit
+        keep_urls: number of urls to keep, all urls if None
+        timeline: if specified, request times are added to it too
+        max_error_lines: if specified, parsing is aborted when there are
+          more error lines, see `get_abort_error_lines`
+        max_error_rate: if specified, parsing is aborted when error rate is
+          over it for sure, see `get_abort_error_rate`
+
+    Returns:
+        Aggregate collected in memory if it fits the limit, otherwise
+          aggregate with `SpilledStat`
+
+    Raises:
+        ValueError: if aggregation mode can not be spilled
+    """
+    if config.aggregation not in URL_SIZE:
+        raise ValueError(
+            f'`MEMORY_LIMIT_MB` is not supported with `{config.aggregation}` '
+            f'aggregation, expected one of: {", ".join(URL_SIZE)}'
+        )
+    limit = config.memory_limit_mb << 20
+    url_size = URL_SIZE[config.aggregation]
+    record_size = RECORD_SIZE[config.aggregation]
+    check_lines = min(
+        max(limit // (4 * (url_size + record_size)), 1), SPILL_CHECK_LINES
+    )
+    log_reader = iter(log_reader)
+    aggregate = Aggregate(new_urls_stat(config.aggregation), 0, 0)
+    # Records of request times spilled so far
+    spilled = 0
+    with tempfile.TemporaryDirectory(prefix='log_analyzer-') as spill_dir:
+        spill = None
+        while True:
+            total_lines = aggregate.total_lines
+            aggregate = collect_stat(
+                islice(log_reader, check_lines), config.log_format,
+                config.aggregation, aggregate, config.url_rules,
+                max_error_lines, timeline, max_error_rate
+            )
+            if aggregate.total_lines == total_lines:
+                break
+            urls_stat = aggregate.urls_stat
+            records = (
+                aggregate.total_lines - aggregate.error_lines - spilled
+            )
+            if len(urls_stat) * url_size + records * record_size < limit:
+                continue
+            if spill is None:
+                logger.info(
+                    'Aggregate is over %d MB, spilling it to `%s`',
+                    config.memory_limit_mb, spill_dir
+                )
+                spill = SpillPartitions(
+                    Path(spill_dir), 'spill', config.aggregation
+                )
+            spill.write(urls_stat)
+            spilled += records
+            aggregate = aggregate._replace(
+                urls_stat=new_urls_stat(config.aggregation)
+            )
+        if spill is None:
+            return aggregate
+        spill.write(aggregate.urls_stat)
+        spill.close()
+        urls_stat = merge_partitions(spill, limit, keep_urls)
+    return aggregate._replace(urls_stat=urls_stat)
+
+
+class SpillPartitions:
+    """Request times of urls split by hash of url into files
+
+    Every write is a chunk of the log, chunks are numbered in order. Chunk
+    of partition is a length-prefixed aggregate in `storage` format
+    followed by positions of its urls in the whole chunk. So the order of
+    the first appearance of urls is known after merging
+    """
+
+    def __init__(
+        self,
+        spill_dir: Path,
+        name: str,
+        aggregation: str,
+        partitions: int = SPILL_PARTITIONS,
+        salt: int = 0
+    ):
+        self.aggregation = aggregation
+        self.paths = [
+            spill_dir / f'{name}-{i}.bin' for i in range(partitions)
+        ]
+        self.files = [open(path, 'wb') for path in self.paths]
+        self.salt = salt
+        self.chunks = 0
+
+    def write(
+        self,
+        urls_stat: dict,
+        chunk: int | None = None,
+        positions: Iterable[int] | None = None
+    ) -> None:
+        """Writes chunk of request times to partitions
+
+        Args:
+            urls_stat: request times by url
+            chunk: number of chunk, next one if None
+            positions: positions of urls in the chunk, if urls_stat is
+              a part of it
+        """
+        if chunk is None:
+            chunk = self.chunks
+        self.chunks = max(self.chunks, chunk + 1)
+        count = len(self.files)
+        parts = [new_urls_stat(self.aggregation) for _ in range(count)]
+        parts_positions = [array('Q') for _ in range(count)]
+        if positions is None:
+            positions = range(len(urls_stat))
+        for position, (url, time_stat) in zip(positions, urls_stat.items()):
+            i = hash((self.salt, url)) % count
+            parts[i][url] = time_stat
+            parts_positions[i].append(position)
+        for f, part, part_positions in zip(
+            self.files, parts, parts_positions
+        ):
+            if part:
+                _write_chunk(f, chunk, part, part_positions)
+
+    def close(self) -> None:
+        for f in self.files:
+            f.close()
+
+
+def merge_partitions(
+    spill: SpillPartitions,
+    limit: int,
+    keep_urls: int | None
+) -> SpilledStat:
+    """Merges partitions one at a time selecting urls to keep
+
+    Request times of every merged url are reduced to its statistics, see
+    `reduce_stats`, so kept urls take fixed memory whatever the number of
+    their request times is
+
+    Args:
+        spill: closed spill files
+        limit: memory limit in bytes, larger partitions are split again
+        keep_urls: number of urls with the largest total request time to
+          keep, all urls if None
+    """
+    total_requests = 0
+    # Exact partial sums of total request time, see `_add_exact`
+    partials = []
+    # Min-heap of (time sum, negated first appearance, url, statistics),
+    # its top is the first url to drop
+    kept = []
+    for url, rank, time_stat in _iter_partitions(spill, limit, 0):
+        if isinstance(time_stat, ReducedStat):
+            stats = time_stat
+        else:
+            stats = reduce_stats(time_stat)
+        total_requests += stats.count
+        _add_exact(partials, stats.time_sum)
+        item = (stats.time_sum, tuple(-i for i in rank), url, stats)
+        if keep_urls is None or len(kept) < keep_urls:
+            heapq.heappush(kept, item)
+        elif item[:2] > kept[0][:2]:
+            heapq.heapreplace(kept, item)
+    urls_stat = SpilledStat(total_requests, math.fsum(partials))
+    # Urls in order of the first appearance, so stable sort by total
+    # request time resolves ties like for aggregate kept in memory
+    for _, _, url, stats in sorted(kept, key=lambda x: x[1], reverse=True):
+        urls_stat[url] = stats
+    return urls_stat
+
+
+def _iter_partitions(
+    spill: SpillPartitions,
+    limit: int,
+    depth: int
+) -> Iterator[
+    tuple[bytes | str, tuple[int, int], list | TimeSketch | ReducedStat]
+]:
+    """Iterates over merged request times of spilled urls
+
+    Chunks of partition are merged one at a time. Request times of
+    partition over the limit at `MAX_SPILL_DEPTH` are sorted externally
+    and reduced, see `_merge_partition`
+
+    Yields:
+        Url, position of its first appearance (number of chunk, position in
+          chunk) and its request times or their statistics
+    """
+    for path in spill.paths:
+        size = path.stat().st_size
+        if not size:
+            path.unlink()
+            continue
+        if size * SPILL_EXPANSION > limit and depth < MAX_SPILL_DEPTH:
+            # Partition does not fit memory, it is split with another hash
+            sub_spill = SpillPartitions(
+                path.parent, path.stem, spill.aggregation, salt=depth + 1
+            )
+            with open(path, 'rb') as f:
+                for chunk, aggregate, positions in _read_chunks(f):
+                    sub_spill.write(aggregate.urls_stat, chunk, positions)
+            sub_spill.close()
+            path.unlink()
+            yield from _iter_partitions(sub_spill, limit, depth + 1)
+            continue
+        urls_stat, ranks = _merge_partition(path, spill.aggregation, limit)
+        path.unlink()
+        for url, time_stat in urls_stat.items():
+            yield url, ranks[url], time_stat
+
+
+def _merge_partition(
+    path: Path,
+    aggregation: str,
+    limit: int
+) -> tuple[dict, dict]:
+    """Merges chunks of partition file reading one chunk at a time
+
+    When request times kept in `exact` mode get over the limit, they are
+    sorted by url and written to a run file next to the partition. In the
+    end sorted runs of every url are merged reading a few request times of
+    every run at once, so merging stays within the limit and statistics of
+    the urls are exact, see `_reduce_sorted`
+
+    Returns:
+        Merged request times or their statistics by url and positions of
+          the first appearance of urls
+    """
+    urls_stat = new_urls_stat(aggregation)
+    ranks = {}
+    url_size = URL_SIZE[aggregation]
+    record_size = RECORD_SIZE[aggregation]
+    records = 0
+    runs = []
+    with open(path, 'rb') as f:
+        for chunk, aggregate, positions in _read_chunks(f):
+            for (url, time_stat), position in zip(
+                aggregate.urls_stat.items(), positions
+            ):
+                ranks.setdefault(url, (chunk, position))
+                urls_stat[url].extend(time_stat)
+                records += len(time_stat)
+            if (
+                record_size
+                and len(urls_stat) * url_size + records * record_size > limit
+            ):
+                if not runs:
+                    logger.info(
+                        'Spilled partition `%s` is over the limit, request '
+                        'times of its urls are sorted externally', path.name
+                    )
+                runs.append(_write_run(path, len(runs), urls_stat))
+                urls_stat = new_urls_stat(aggregation)
+                records = 0
+    if not runs:
+        return urls_stat, ranks
+    runs.append(_write_run(path, len(runs), urls_stat))
+    del urls_stat
+    reduced = {}
+    files = [open(run_path, 'rb') for run_path, _ in runs]
+    try:
+        for url in ranks:
+            segments = [
+                (f, index[url])
+                for f, (_, index) in zip(files, runs) if url in index
+            ]
+            reduced[url] = _reduce_sorted(
+                heapq.merge(*(
+                    _read_run(f, offset, count)
+                    for f, (offset, count) in segments
+                )),
+                sum(count for _, (_, count) in segments)
+            )
+    finally:
+        for f, (run_path, _) in zip(files, runs):
+            f.close()
+            run_path.unlink()
+    return reduced, ranks
+
+
+def _write_run(
+    path: Path,
+    number: int,
+    urls_stat: dict
+) -> tuple[Path, dict]:
+    """Writes sorted request times of every url to a run file
+
+    Returns:
+        Path of the run and offset and number of request times of every url
+          in it
+    """
+    run_path = path.with_name(f'{path.stem}-run{number}.bin')
+    index = {}
+    with open(run_path, 'wb') as f:
+        for url, time_stat in urls_stat.items():
+            index[url] = (f.tell(), len(time_stat))
+            array('d', sorted(time_stat)).tofile(f)
+    return run_path, index
+
+
+def _read_run(f: BinaryIO, offset: int, count: int) -> Iterator[float]:
+    """Iterates over request times of url in run file, see `_write_run`"""
+    while count:
+        times = array('d')
+        f.seek(offset)
+        times.fromfile(f, min(count, RUN_READ_RECORDS))
+        offset += len(times) * times.itemsize
+        count -= len(times)
+        yield from times
+
+
+class _SortedPositions:
+    """Sorted request times at some positions, indexed like all of them"""
+
+    def __init__(self, values: dict[int, float], count: int):
+        self.values = values
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, position: int) -> float:
+        return self.values[position % self.count]
+
+
+def _reduce_sorted(sorted_times: Iterable[float], count: int) -> ReducedStat:
+    """Reduces request times in ascending order, see `reduce_stats`
+
+    Request times are iterated once, only the ones at positions of
+    quantiles are kept. Statistics are the same as of `reduce_stats`
+    """
+    positions = {(count - 1) // 2, count // 2, count - 1}
+    for p in PERCENTILES:
+        lo = math.floor(p / 100 * (count - 1))
+        positions.update((lo, min(lo + 1, count - 1)))
+    values = {}
+    # Exact partial sums of request times and their squares
+    partials = []
+    square_partials = []
+    for position, request_time_sec in enumerate(sorted_times):
+        _add_exact(partials, request_time_sec)
+        _add_exact(square_partials, request_time_sec * request_time_sec)
+        if position in positions:
+            values[position] = request_time_sec
+    sorted_stat = _SortedPositions(values, count)
+    if count % 2:
+        time_med = sorted_stat[count // 2]
+    else:
+        time_med = (sorted_stat[count // 2 - 1] + sorted_stat[count // 2]) / 2
+    # Mean is correctly rounded like `statistics.mean`
+    time_avg = float(sum(map(Fraction, partials), Fraction()) / count)
+    return ReducedStat(
+        count, math.fsum(partials), math.fsum(square_partials),
+        dict(
+            time_avg=time_avg, time_max=sorted_stat[-1], time_med=time_med,
+            **{
+                f'time_p{p}': get_percentile(sorted_stat, p / 100)
+                for p in PERCENTILES
+            }
+        )
+    )
+
+
+def _write_chunk(
+    f: BinaryIO,
+    chunk: int,
+    urls_stat: dict,
+    positions: array
+) -> None:
+    data = BytesIO()
+    dump_aggregate(Aggregate(urls_stat, 0, 0), data, dict(chunk=chunk))
+    f.write(_u64.pack(len(data.getbuffer())))
+    f.write(data.getbuffer())
+    f.write(positions.tobytes())
+
+
+def _read_chunks(f: BinaryIO) -> Iterator[tuple[int, Aggregate, array]]:
+    while True:
+        head = f.read(_u64.size)
+        if not head:
+            return
+        (size,) = _u64.unpack(head)
+        aggregate, meta = load_aggregate(BytesIO(f.read(size)))
+        positions = array('Q')
+        positions.fromfile(f, len(aggregate.urls_stat))
+        yield meta['chunk'], aggregate, positions
+
+
+def _add_exact(partials: list[float], x: float) -> None:
+    """Adds x to non-overlapping partial sums without rounding
+
+    `math.fsum(partials)` is the correctly rounded sum of all added values,
+    the same as `math.fsum` of them at once
+    """
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x + y
+        lo = y - (hi - x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
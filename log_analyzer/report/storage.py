@@ -0,0 +1,303 @@
+import json
+import struct
+import zlib
+from array import array
+from collections import defaultdict
+from typing import BinaryIO
+
+from .columnar import ColumnarStat
+from .report import Aggregate, ReducedStat, SpilledStat, new_urls_stat
+from .sketch import TimeSketch
+
+# Binary format of aggregate:
+#   magic, u32 header length, json header, body, u32 crc32 of all before it
+# Header has format version, aggregation mode, line counters, number of urls,
+# whether urls are undecoded bytes and free-form meta. Body layout depends on
+# aggregation mode, see `_dump_<mode>` functions. Numbers are little-endian
+MAGIC = b'LGAGGR'
+VERSION = 3
+
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+_sketch_head = struct.Struct('<QdQII')
+_reduced_head = struct.Struct('<QdI')
+_reduced_stat = struct.Struct('<Qdd')
+
+
+class StorageError(ValueError):
+    """Stored aggregate is corrupt or has unsupported format"""
+
+
+def get_aggregation(urls_stat: dict) -> str:
+    """Returns aggregation mode of request times container"""
+    if isinstance(urls_stat, SpilledStat):
+        return 'reduced'
+    if isinstance(urls_stat, ColumnarStat):
+        return 'columnar'
+    if getattr(urls_stat, 'default_factory', None) is TimeSketch:
+        return 'sketch'
+    return 'exact'
+
+
+def dump_aggregate(
+    aggregate: Aggregate,
+    f: BinaryIO,
+    meta: dict | None = None
+) -> None:
+    """Writes aggregate to binary file
+
+    Args:
+        aggregate: aggregated request times and line counters
+        f: file opened for binary writing
+        meta: json-serializable data to store along with aggregate
+    """
+    aggregation = get_aggregation(aggregate.urls_stat)
+    first_url = next(iter(aggregate.urls_stat), None)
+    header = json.dumps(dict(
+        version=VERSION,
+        aggregation=aggregation,
+        binary_urls=isinstance(first_url, bytes),
+        total_lines=aggregate.total_lines,
+        error_lines=aggregate.error_lines,
+        urls=len(aggregate.urls_stat),
+        meta=meta or {},
+    )).encode()
+    chunks = [MAGIC, _u32.pack(len(header)), header]
+    _DUMPERS[aggregation](aggregate.urls_stat, chunks)
+    crc = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        f.write(chunk)
+    f.write(_u32.pack(crc))
+
+
+def load_aggregate(f: BinaryIO) -> tuple[Aggregate, dict]:
+    """Reads aggregate written by `dump_aggregate`
+
+    Returns:
+        Aggregate and meta stored with it
+
+    Raises:
+        StorageError: if file is corrupt or has unsupported format
+    """
+    data = f.read()
+    if len(data) < len(MAGIC) + 2 * _u32.size or not data.startswith(MAGIC):
+        raise StorageError('Not an aggregate file')
+    (crc,) = _u32.unpack_from(data, len(data) - _u32.size)
+    body = memoryview(data)[:len(data) - _u32.size]
+    if zlib.crc32(body) != crc:
+        raise StorageError('Checksum mismatch')
+    pos = len(MAGIC)
+    (header_size,) = _u32.unpack_from(body, pos)
+    pos += _u32.size
+    try:
+        header = json.loads(bytes(body[pos:pos + header_size]))
+        version = header['version']
+        aggregation = header['aggregation']
+        binary_urls = header['binary_urls']
+    except (ValueError, KeyError, TypeError) as e:
+        raise StorageError(f'Invalid header: {e}')
+    if version != VERSION or aggregation not in _LOADERS:
+        raise StorageError(
+            f'Unsupported format: version {version}, {aggregation}'
+        )
+    pos += header_size
+    try:
+        urls_stat, pos = _LOADERS[aggregation](
+            body, pos, header['urls'], binary_urls
+        )
+    except (struct.error, ValueError, IndexError) as e:
+        raise StorageError(f'Invalid body: {e}')
+    if pos != len(body):
+        raise StorageError('Unexpected data after aggregate')
+    aggregate = Aggregate(
+        urls_stat, header['total_lines'], header['error_lines']
+    )
+    return aggregate, header['meta']
+
+
+def _dump_url(url: str | bytes, chunks: list[bytes]) -> None:
+    if isinstance(url, str):
+        url = url.encode('utf-8', 'surrogateescape')
+    chunks.append(_u32.pack(len(url)))
+    chunks.append(url)
+
+
+def _load_url(
+    data: memoryview,
+    pos: int,
+    binary: bool
+) -> tuple[str | bytes, int]:
+    (size,) = _u32.unpack_from(data, pos)
+    pos += _u32.size
+    url = bytes(data[pos:pos + size])
+    if len(url) != size:
+        raise ValueError('Truncated url')
+    if not binary:
+        url = url.decode('utf-8', 'surrogateescape')
+    return url, pos + size
+
+
+def _load_array(
+    data: memoryview,
+    pos: int,
+    typecode: str,
+    size: int
+) -> tuple[array, int]:
+    values = array(typecode)
+    end = pos + size * values.itemsize
+    if end > len(data):
+        raise ValueError('Truncated array')
+    values.frombytes(data[pos:end])
+    return values, end
+
+
+def _dump_exact(urls_stat: dict, chunks: list[bytes]) -> None:
+    # url, u32 number of times, f64 times
+    for url, time_stat in urls_stat.items():
+        _dump_url(url, chunks)
+        chunks.append(_u32.pack(len(time_stat)))
+        chunks.append(array('d', time_stat).tobytes())
+
+
+def _load_exact(
+    data: memoryview,
+    pos: int,
+    urls: int,
+    binary: bool
+) -> tuple[dict, int]:
+    urls_stat = defaultdict(list)
+    for _ in range(urls):
+        url, pos = _load_url(data, pos, binary)
+        (size,) = _u32.unpack_from(data, pos)
+        times, pos = _load_array(data, pos + _u32.size, 'd', size)
+        urls_stat[url] = times.tolist()
+    return urls_stat, pos
+
+
+def _dump_sketch(urls_stat: dict, chunks: list[bytes]) -> None:
+    # url, u64 count, f64 max, u64 zeros, u32 number of partial sums,
+    # u32 number of buckets, f64 partial sums, i32 bucket indexes, u64
+    # bucket counts
+    for url, sketch in urls_stat.items():
+        _dump_url(url, chunks)
+        chunks.append(_sketch_head.pack(
+            sketch.count, sketch.max, sketch.zeros, len(sketch.partials),
+            len(sketch.buckets)
+        ))
+        chunks.append(array('d', sketch.partials).tobytes())
+        chunks.append(array('i', sketch.buckets.keys()).tobytes())
+        chunks.append(array('Q', sketch.buckets.values()).tobytes())
+
+
+def _load_sketch(
+    data: memoryview,
+    pos: int,
+    urls: int,
+    binary: bool
+) -> tuple[dict, int]:
+    urls_stat = defaultdict(TimeSketch)
+    for _ in range(urls):
+        url, pos = _load_url(data, pos, binary)
+        sketch = urls_stat[url]
+        (
+            sketch.count, sketch.max, sketch.zeros, partials, size
+        ) = _sketch_head.unpack_from(data, pos)
+        partials, pos = _load_array(
+            data, pos + _sketch_head.size, 'd', partials
+        )
+        sketch.partials = partials.tolist()
+        indexes, pos = _load_array(data, pos, 'i', size)
+        counts, pos = _load_array(data, pos, 'Q', size)
+        sketch.buckets = dict(zip(indexes, counts))
+    return urls_stat, pos
+
+
+def _dump_reduced(urls_stat: SpilledStat, chunks: list[bytes]) -> None:
+    # u64 total requests, f64 total request time, u32 number of quantiles,
+    # quantile names, then url, u64 count, f64 time sum, f64 time square
+    # sum and f64 quantiles in order of names for every url
+    first_stat = next(iter(urls_stat.values()), None)
+    names = [] if first_stat is None else list(first_stat.quantiles)
+    chunks.append(_reduced_head.pack(
+        urls_stat.total_requests, urls_stat.total_request_time_sec,
+        len(names)
+    ))
+    for name in names:
+        _dump_url(name, chunks)
+    for url, stats in urls_stat.items():
+        _dump_url(url, chunks)
+        chunks.append(_reduced_stat.pack(
+            stats.count, stats.time_sum, stats.time_square_sum
+        ))
+        chunks.append(array(
+            'd', (stats.quantiles[name] for name in names)
+        ).tobytes())
+
+
+def _load_reduced(
+    data: memoryview,
+    pos: int,
+    urls: int,
+    binary: bool
+) -> tuple[SpilledStat, int]:
+    total_requests, total_time, size = _reduced_head.unpack_from(data, pos)
+    pos += _reduced_head.size
+    urls_stat = SpilledStat(total_requests, total_time)
+    names = []
+    for _ in range(size):
+        name, pos = _load_url(data, pos, False)
+        names.append(name)
+    for _ in range(urls):
+        url, pos = _load_url(data, pos, binary)
+        count, time_sum, time_square_sum = _reduced_stat.unpack_from(
+            data, pos
+        )
+        quantiles, pos = _load_array(
+            data, pos + _reduced_stat.size, 'd', size
+        )
+        urls_stat[url] = ReducedStat(
+            count, time_sum, time_square_sum, dict(zip(names, quantiles))
+        )
+    return urls_stat, pos
+
+
+def _dump_columnar(urls_stat: ColumnarStat, chunks: list[bytes]) -> None:
+    # urls in order of ids, u64 number of records, i64 ids, f64 times
+    for url in urls_stat:
+        _dump_url(url, chunks)
+    chunks.append(_u64.pack(len(urls_stat.times)))
+    chunks.append(urls_stat.ids.tobytes())
+    chunks.append(urls_stat.times.tobytes())
+
+
+def _load_columnar(
+    data: memoryview,
+    pos: int,
+    urls: int,
+    binary: bool
+) -> tuple[ColumnarStat, int]:
+    urls_stat = new_urls_stat('columnar')
+    for _ in range(urls):
+        url, pos = _load_url(data, pos, binary)
+        urls_stat[url]
+    (size,) = _u64.unpack_from(data, pos)
+    ids, pos = _load_array(data, pos + _u64.size, 'q', size)
+    times, pos = _load_array(data, pos, 'd', size)
+    urls_stat.ids.extend(ids)
+    urls_stat.times.extend(times)
+    return urls_stat, pos
+
+
+_DUMPERS = {
+    'exact': _dump_exact,
+    'sketch': _dump_sketch,
+    'columnar': _dump_columnar,
+    'reduced': _dump_reduced,
+}
+_LOADERS = {
+    'exact': _load_exact,
+    'sketch': _load_sketch,
+    'columnar': _load_columnar,
+    'reduced': _load_reduced,
+}
@@ -0,0 +1,102 @@
+    // Confidence intervals are shown in cells of their values
+    function isColumn(name) {
+      return !/_ci$/.test(name);
+    }
+
+    // Statistics of urls significantly over their median of the previous
+    // reports, see `find_regressions`
+    function drawRegressions() {
+      if (!regressions.length) {
+        return;
+      }
+      var $regressions = $(".report-regressions");
+      var $list = $("<table></table>");
+      var $head = $("<tr></tr>");
+      var names = ["url", "column", "baseline", "value", "change"];
+      for (var i = 0; i < names.length; i++) {
+        $head.append($("<th></th>").text(names[i]));
+      }
+      $list.append($head);
+      for (var i = 0; i < regressions.length; i++) {
+        var regression = regressions[i];
+        $list.append($("<tr></tr>").append(
+          $("<td></td>").addClass("report-table-body-cell-url").text(regression.url),
+          $("<td></td>").text(regression.column),
+          $("<td></td>").text(regression.baseline.toPrecision(3)),
+          $("<td></td>").text(regression.value.toPrecision(3)),
+          $("<td></td>").addClass("alert").text("+" + (100 * regression.change).toFixed(0) + "%")
+        ));
+      }
+      $regressions.append($("<h3></h3>").text("Regressions"), $list);
+    }
+
+    // Row of report table with links of urls, timelines and confidence
+    // intervals of values
+    function drawRow(row) {
+      var $row = $("<tr></tr>").addClass("report-table-body-row");
+      for (var j = 0; j < columns.length; j++) {
+        var columnName = columns[j];
+        var $cell = $("<td></td>").addClass("report-table-body-cell");
+        if (columnName == "url") {
+          var url = "https://rb.mail.ru" + row[columnName];
+          var $link = $("<a></a>").attr("href", url)
+                                  .attr("title", url)
+                                  .attr("target", "_blank")
+                                  .addClass("clipped")
+                                  .addClass("url")
+                                  .text(row[columnName]);
+          $cell.addClass("report-table-body-cell-url");
+          $cell.append($link);
+        }
+        else if (columnName == "timeline") {
+          $cell.append(drawTimeline(row[columnName]));
+        }
+        else {
+          $cell.text(row[columnName]);
+          if (columnName == "time_avg" && row[columnName] > 0.9) {
+            $cell.addClass("alert");
+          }
+          // Confidence interval of value estimated from sampled lines
+          if (row[columnName + "_ci"] !== undefined) {
+            $cell.append($("<span></span>").addClass("ci")
+                                           .text(" \u00b1 " + row[columnName + "_ci"].toPrecision(2)));
+          }
+        }
+        $row.append($cell);
+      }
+      return $row;
+    }
+
+    // Sparkline of 95th percentile of request times by time bucket, gaps
+    // are buckets without requests or before the url is tracked
+    function drawTimeline(timeline) {
+      var $timeline = $("<span></span>").addClass("timeline");
+      if (!timeline) {
+        return $timeline;
+      }
+      var values = timeline.p95;
+      var width = 150, height = 24;
+      var max = 0, maxIndex = 0;
+      for (var i = 0; i < values.length; i++) {
+        if (values[i] !== null && values[i] > max) {
+          max = values[i];
+          maxIndex = i;
+        }
+      }
+      var step = values.length > 1 ? width / (values.length - 1) : 0;
+      var path = "", pen = "M";
+      for (var i = 0; i < values.length; i++) {
+        if (values[i] === null) {
+          pen = "M";
+          continue;
+        }
+        var y = max > 0 ? (height - 2) * (1 - values[i] / max) + 1 : height - 1;
+        path += pen + (i * step).toFixed(1) + "," + y.toFixed(1) + " ";
+        pen = "L";
+      }
+      var time = new Date((timeline.start + maxIndex * timeline.step) * 1000);
+      $timeline.attr("title", "p95 up to " + max.toFixed(3) + "s at " + time.toISOString().substr(11, 5))
+               .html('<svg width="' + width + '" height="' + height + '"><path d="' + path + '"/></svg>');
+      return $timeline;
+    }
+
@@ -0,0 +1,275 @@
+import calendar
+import heapq
+import math
+from array import array
+from datetime import datetime
+
+from .config import Config
+from .normalize import decode_url
+
+# Latency bins of histograms: bin 0 is below `TIMELINE_MIN_TIME`, every next
+# bin is `2 ** (1 / TIMELINE_BINS_PER_OCTAVE)` times wider, the last one is
+# open-ended (over 32 seconds)
+TIMELINE_BINS = 32
+TIMELINE_BINS_PER_OCTAVE = 2
+TIMELINE_MIN_TIME = .001
+# Quantile of request times shown by sparkline of every time bucket
+TIMELINE_QUANTILE = .95
+# Format of `$time_local` up to minutes, e.g. `29/Jun/2017:03:50`
+LOCAL_MINUTE_FORMAT = '%d/%b/%Y:%H:%M'
+
+# Request times are logged with millisecond resolution, so there are few
+# distinct values and bin is cheaper to look up than to compute
+_bin_cache = {}
+_bin_cache_size = 1 << 16
+# Timestamps have second resolution, a day of log has 86400 of them. Only
+# the minutes are parsed with `strptime`, there are 1440 of them a day
+_bucket_cache_size = 1 << 17
+_minute_cache = {}
+_empty_counts = bytes(array('I', [0]).itemsize * TIMELINE_BINS)
+
+
+class Timeline:
+    """Latency histograms of urls by time bucket of a day
+
+    Every url with a large total request time keeps a log-scaled histogram
+    of request times per time bucket of `$time_local`. Memory is bounded:
+    at most twice `size` urls are tracked at once. When there is no room
+    for a url whose total request time grows over the smallest total of
+    tracked urls, tracked urls are chosen again by total request time and
+    the rest are dropped. Url tracked later has no histograms of the
+    buckets before it, they are shown as gaps
+
+    Total request times of urls not tracked are counted with space-saving
+    algorithm in twice `size` counters: a new url replaces the url with the
+    smallest total and starts from its total, so total of url is an upper
+    bound and a url with a large total is never missed
+
+    Args:
+        bucket_sec: length of time bucket, seconds
+        size: number of urls kept at full resolution, urls of report
+    """
+
+    def __init__(self, bucket_sec: int, size: int):
+        self.bucket_sec = bucket_sec
+        self.size = size
+        self.first = None
+        self.last = None
+        # Histograms by bucket of tracked urls and buckets they are
+        # complete since
+        self.histograms = {}
+        self.since = {}
+        # Total request time of tracked and counted urls
+        self.totals = {}
+        # Total request time of url to be tracked
+        self.threshold = 0.
+        # The largest total of urls which are not counted any more, None
+        # until the first one is replaced
+        self.floor = None
+        # Min-heap of totals of counted urls, totals only grow, so outdated
+        # entries are updated when they are popped
+        self._counted = []
+        self._buckets = {}
+
+    def add(
+        self,
+        url: str | bytes,
+        local_time: str | bytes,
+        request_time_sec: float
+    ) -> None:
+        """Counts request time of url in bucket of its `$time_local`"""
+        bucket = self._buckets.get(local_time)
+        if bucket is None:
+            bucket = self._parse_bucket(local_time)
+            if bucket is None:
+                return
+        histograms = self.histograms.get(url)
+        if histograms is None:
+            total = self.totals.get(url)
+            if total is None:
+                # Url may be seen before it was replaced
+                since = self.first if self.floor is None else bucket
+                total = self._count(url)
+            else:
+                # Requests of url seen before are not counted in its
+                # histograms
+                since = bucket
+            total = self.totals[url] = total + request_time_sec
+            if total < self.threshold:
+                return
+            histograms = self._track(url, since)
+            if histograms is None:
+                return
+        else:
+            self.totals[url] += request_time_sec
+        counts = histograms.get(bucket)
+        if counts is None:
+            counts = histograms[bucket] = array('I', _empty_counts)
+        index = _bin_cache.get(request_time_sec)
+        if index is None:
+            index = _bin_index(request_time_sec)
+        counts[index] += 1
+
+    def get_row(self, url: str | bytes) -> dict | None:
+        """Series of the url for report table, None if url is not tracked
+
+        Returns:
+            `start` of the first bucket as seconds since epoch of local time
+              of log, bucket length `step`, requests `count` and
+              `TIMELINE_QUANTILE` of request times `p95` in every bucket.
+              Values of buckets before the url is tracked are None
+        """
+        histograms = self.histograms.get(url)
+        if histograms is None:
+            return None
+        since = self.since[url]
+        count = []
+        quantiles = []
+        for bucket in range(self.first, self.last + 1):
+            counts = histograms.get(bucket)
+            if counts is None:
+                count.append(None if bucket < since else 0)
+                quantiles.append(None)
+                continue
+            count.append(sum(counts))
+            quantiles.append(get_bin_quantile(counts, TIMELINE_QUANTILE))
+        return dict(
+            start=self.first * self.bucket_sec,
+            step=self.bucket_sec,
+            count=count,
+            p95=quantiles,
+        )
+
+    def _parse_bucket(self, local_time: str | bytes) -> int | None:
+        text = local_time
+        if isinstance(text, bytes):
+            text = text.decode('ascii', errors='replace')
+        minute = _minute_cache.get(text[:17])
+        try:
+            if minute is None:
+                # Zone is not needed, buckets are of local time of the log
+                dt = datetime.strptime(text[:17], LOCAL_MINUTE_FORMAT)
+                minute = calendar.timegm(dt.timetuple())
+                if len(_minute_cache) >= _bucket_cache_size:
+                    _minute_cache.clear()
+                _minute_cache[text[:17]] = minute
+            seconds = int(text[18:20]) if text[17:18] == ':' else -1
+        except ValueError:
+            return None
+        if not 0 <= seconds < 60:
+            return None
+        bucket = (minute + seconds) // self.bucket_sec
+        if len(self._buckets) >= _bucket_cache_size:
+            self._buckets.clear()
+        self._buckets[local_time] = bucket
+        if self.first is None or bucket < self.first:
+            self.first = bucket
+        if self.last is None or bucket > self.last:
+            self.last = bucket
+        return bucket
+
+    def _track(self, url: str | bytes, since: int) -> dict | None:
+        """Starts tracking url, other urls may be dropped to make room
+
+        Returns:
+            Histograms of url, None if it is not among tracked urls
+        """
+        if len(self.histograms) < 2 * self.size:
+            self.since[url] = since
+            histograms = self.histograms[url] = {}
+            return histograms
+        # A quarter of room is left for urls growing later
+        keep = max(1, 3 * self.size // 2)
+        tracked = heapq.nlargest(keep, self.totals, key=self.totals.get)
+        # Urls tracked again miss requests of the current bucket and before
+        current = self.last + 1
+        self.since = {
+            u: since if u == url else self.since.get(u, current)
+            for u in tracked
+        }
+        self.histograms = {u: self.histograms.get(u, {}) for u in tracked}
+        self.threshold = self.totals[tracked[-1]]
+        # Dropped urls are counted again
+        self._counted = [
+            (total, u) for u, total in self.totals.items()
+            if u not in self.histograms
+        ]
+        heapq.heapify(self._counted)
+        while len(self.totals) - len(self.histograms) > 2 * self.size:
+            self._replace()
+        return self.histograms.get(url)
+
+    def _count(self, url: str | bytes) -> float:
+        """Starts counting total request time of url which is not tracked
+
+        Returns:
+            Total url starts from, the largest total of urls which are not
+              counted any more
+        """
+        if len(self.totals) - len(self.histograms) >= 2 * self.size:
+            self._replace()
+        total = self.floor or 0.
+        heapq.heappush(self._counted, (total, url))
+        return total
+
+    def _replace(self) -> None:
+        """Stops counting url with the smallest total of urls not tracked"""
+        while True:
+            total, url = heapq.heappop(self._counted)
+            current = self.totals.get(url)
+            if current is None or url in self.histograms:
+                continue
+            if current != total:
+                heapq.heappush(self._counted, (current, url))
+                continue
+            del self.totals[url]
+            self.floor = total
+            return
+
+
+def new_timeline(config: Config) -> Timeline | None:
+    """Creates timeline if `TIMELINE_BUCKET_MIN` is set"""
+    if config.timeline_bucket_min is None:
+        return None
+    return Timeline(config.timeline_bucket_min * 60, config.timeline_size)
+
+
+def add_timeline(table: list[dict], timeline: Timeline) -> None:
+    """Adds series of tracked urls to rows of report table as `timeline`"""
+    rows = {
+        decode_url(url): url for url in timeline.histograms
+    }
+    for row in table:
+        url = rows.get(row['url'])
+        row['timeline'] = None if url is None else timeline.get_row(url)
+
+
+def get_bin_quantile(counts: array, q: float) -> float | None:
+    """Estimates q-quantile of request times as upper bound of its bin"""
+    rank = q * (sum(counts) - 1)
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if rank < seen:
+            return get_bin_bound(index)
+    return None
+
+
+def get_bin_bound(index: int) -> float:
+    """Upper bound of request times of bin, the last one has lower bound"""
+    index = min(index, TIMELINE_BINS - 2)
+    return TIMELINE_MIN_TIME * 2 ** (index / TIMELINE_BINS_PER_OCTAVE)
+
+
+def _bin_index(request_time_sec: float) -> int:
+    if request_time_sec < TIMELINE_MIN_TIME:
+        index = 0
+    else:
+        index = 1 + math.floor(
+            math.log2(request_time_sec / TIMELINE_MIN_TIME)
+            * TIMELINE_BINS_PER_OCTAVE
+        )
+        index = min(index, TIMELINE_BINS - 1)
+    if len(_bin_cache) < _bin_cache_size:
+        _bin_cache[request_time_sec] = index
+    return index
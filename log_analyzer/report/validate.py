@@ -0,0 +1,176 @@
+import math
+
+from .config import Config
+from .fs import Log, get_uncompressed_size, sample_log
+from .log_format import compile_log_format, variable_rexp
+
+# Sample of plain log is rejected when the lower bound of confidence
+# interval of its error rate is over the limit. Interval is wide, so valid
+# logs are not rejected by chance or by a few broken lines next to each other
+ERROR_RATE_Z = 5
+# Lines parsed between checks of error lines during parsing
+MONITOR_LINES = 1 << 14
+
+
+class TooManyErrors(ValueError):
+    """Log has too many lines not matching log format"""
+
+    def __init__(
+        self,
+        total_lines: int,
+        error_lines: int,
+        sample: bool = False
+    ):
+        lines = 'sampled lines' if sample else 'lines'
+        super().__init__(
+            f'{error_lines} of {total_lines} {lines} are not parsed'
+        )
+        self.total_lines = total_lines
+        self.error_lines = error_lines
+        self.sample = sample
+
+    def __reduce__(self):
+        # Error is raised in worker processes of parallel parsing too
+        return type(self), (self.total_lines, self.error_lines, self.sample)
+
+
+def get_abort_error_lines(
+    log: Log,
+    config: Config,
+    sample: list[bytes] | None = None
+) -> int | None:
+    """Number of error lines parsing of the log is aborted after
+
+    Errors come in bursts, so lines parsed so far are not a sample of the
+    log. Parsing is aborted only when error lines found so far are over
+    `MAX_ERROR_RATE` of all lines of the log. Number of lines is estimated
+    from uncompressed size of the log and the shortest parsed line of its
+    sample, it is the largest number of valid lines fitting the log. Error
+    lines are counted on top of it
+
+    Args:
+        log: log to parse
+        config: settings
+        sample: lines of the log sample if they are read already, see
+          `sample_log`
+
+    Returns:
+        Number of error lines, None if `EARLY_ABORT` is off or size of the
+          log is unknown
+    """
+    if not config.early_abort or config.max_error_rate >= 1:
+        return None
+    size = get_uncompressed_size(log)
+    if size is None:
+        return None
+    if sample is None:
+        sample = sample_log(log)
+    _, shortest_line = _parse_sample(sample, config.log_format)
+    if shortest_line is None:
+        # Line is at least as long as literals of log format
+        shortest_line = len(variable_rexp.sub('', config.log_format))
+    valid_lines = size / (shortest_line + 1)
+    if config.sample_rate is not None:
+        valid_lines *= config.sample_rate
+    # Error rate is over the limit whatever the rest of lines are when
+    # error_lines / (error_lines + valid_lines) > max_error_rate
+    return math.floor(
+        config.max_error_rate * valid_lines / (1 - config.max_error_rate)
+    )
+
+
+def get_abort_error_rate(log: Log, config: Config) -> float | None:
+    """Error rate of lines parsed so far parsing of the log is aborted over
+
+    Number of lines of the log can not be estimated when its size is
+    unknown, e.g. of gzip log of 64 MB and over, see
+    `get_abort_error_lines`. Then lines parsed so far are taken as a sample
+    of the log, parsing is aborted when error rate of the log is over the
+    limit for sure, see `is_error_rate_exceeded`. Unlike the limit of error
+    lines of the whole log a long burst of broken lines rejects the log
+
+    Returns:
+        `MAX_ERROR_RATE`, None if `EARLY_ABORT` is off or size of the log is
+          known
+    """
+    if not config.early_abort or config.max_error_rate >= 1:
+        return None
+    if get_uncompressed_size(log) is not None:
+        return None
+    return config.max_error_rate
+
+
+def is_error_rate_exceeded(
+    error_lines: int,
+    total_lines: int,
+    max_error_rate: float
+) -> bool:
+    """Checks if error rate of the whole log is over the limit for sure
+
+    Lines are a sample spread across the log, the rate is exceeded if the
+    lower bound of Wilson score interval is over the limit
+    """
+    if not total_lines:
+        return False
+    z2 = ERROR_RATE_Z ** 2
+    rate = error_lines / total_lines
+    center = rate + z2 / (2 * total_lines)
+    spread = ERROR_RATE_Z * math.sqrt(
+        rate * (1 - rate) / total_lines + z2 / (4 * total_lines ** 2)
+    )
+    lower_bound = (center - spread) / (1 + z2 / total_lines)
+    return lower_bound > max_error_rate
+
+
+def check_log_sample(log: Log, config: Config) -> None:
+    """Parses lines spread across the log before parsing the whole of it
+
+    Only the first lines of gzip log are read, they are not a sample of
+    the whole log, so they are checked like lines parsed so far, see
+    `get_abort_error_lines` and `get_abort_error_rate`
+
+    Raises:
+        TooManyErrors: if log is clearly in another format
+    """
+    lines = sample_log(log)
+    error_lines, _ = _parse_sample(lines, config.log_format)
+    if log.path.suffix == '.gz':
+        max_error_lines = get_abort_error_lines(log, config, lines)
+        if max_error_lines is not None:
+            exceeded = error_lines > max_error_lines
+        else:
+            exceeded = is_error_rate_exceeded(
+                error_lines, len(lines), config.max_error_rate
+            )
+    else:
+        exceeded = is_error_rate_exceeded(
+            error_lines, len(lines), config.max_error_rate
+        )
+    if exceeded:
+        raise TooManyErrors(len(lines), error_lines, sample=True)
+
+
+def _parse_sample(
+    lines: list[bytes],
+    log_format: str
+) -> tuple[int, int | None]:
+    """Counts error lines of sample and finds its shortest parsed line
+
+    Returns:
+        Number of error lines and length of the shortest parsed line, None
+          if no line is parsed
+    """
+    parser = compile_log_format(log_format)
+    error_lines = 0
+    shortest_line = None
+    for line in lines:
+        m = parser.bytes_pattern.match(line)
+        try:
+            if m is None or not math.isfinite(float(m[parser.time_group])):
+                raise ValueError
+        except ValueError:
+            error_lines += 1
+            continue
+        if shortest_line is None or len(line) < shortest_line:
+            shortest_line = len(line)
+    return error_lines, shortest_line
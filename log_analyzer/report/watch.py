@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from .batch import build_log_report
+from .config import Config
+from .fs import Log, get_report_path, iter_logs
+from .metrics import get_metrics_path
+
+# Logs of directory found by `WatchedDir.scan`: stat of directory, time
+# of the scan and log, its size and mtime, report path and whether the
+# report exists for every log
+DirScan = namedtuple('DirScan', ['dir_stat', 'time', 'logs'])
+WatchRun = namedtuple('WatchRun', [
+    'log', 'report', 'status', 'started', 'seconds', 'metrics'
+])
+# Finished runs shown by status endpoint
+WATCH_RUNS = 50
+# Number of times a log is built again when its worker process dies, e.g.
+# killed by OOM killer
+WATCH_RETRIES = 1
+logger = logging.getLogger(__name__)
+
+
+def get_watch_configs(config: Config) -> list[Config]:
+    """Settings of every watched log directory, see `WATCH_DIRS`"""
+    if config.watch_dirs is None:
+        return [config]
+    return [
+        config._replace(log_dir=log_dir, report_dir=report_dir)
+        for log_dir, report_dir in config.watch_dirs
+    ]
+
+
+class WatchedDir:
+    """Finds new logs of a log directory without reports
+
+    Directory is scanned only if its mtime or size changed since the previous
+    poll or there are logs which are still written. Log is new when its size
+    and mtime are the same on two polls in a row or it is not modified for
+    `WATCH_INTERVAL`, so a log being compressed by logrotate is not taken
+    before it is complete. Log is pending until its build is finished, see
+    `done`. Every version of a log is built once, a rejected or failed log
+    is taken again only when it is changed
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._dir_stat = None
+        self._unstable = {}
+        self._pending = {}
+        self._taken = {}
+
+    def poll(self) -> list[tuple[Log, Path]]:
+        """Finds new logs and paths of their reports
+
+        Scanning is split from updating state, see `scan` and `update`
+        """
+        return self.update(self.scan(self.get_scanned_stat()))
+
+    def get_scanned_stat(self) -> tuple[int, int] | None:
+        """Stat of directory not to scan again, None to scan it anyway"""
+        return None if self._unstable else self._dir_stat
+
+    def scan(self, scanned_stat: tuple[int, int] | None) -> DirScan | None:
+        """Stats logs of directory unless its stat is `scanned_stat`
+
+        Only file system and settings are read, so scanning may run in a
+        thread while state of the directory is changed by `done` and
+        `update` on the event loop
+
+        Returns:
+            Found logs, None if directory is not changed or can not be
+              stat-ed
+        """
+        log_dir = Path(self.config.log_dir)
+        try:
+            st = log_dir.stat()
+        except OSError:
+            return None
+        dir_stat = st.st_mtime_ns, st.st_size
+        if dir_stat == scanned_stat:
+            return None
+        logs = []
+        for log in iter_logs(self.config):
+            try:
+                st = log.path.stat()
+            except OSError:
+                continue
+            report_path = get_report_path(log, self.config)
+            logs.append((
+                log, (st.st_size, st.st_mtime_ns), report_path,
+                report_path.is_file()
+            ))
+        return DirScan(dir_stat, time.time(), logs)
+
+    def update(self, scan: DirScan | None) -> list[tuple[Log, Path]]:
+        """Takes new logs of scan, see `scan`
+
+        Returns:
+            New logs and paths of their reports in order of dates
+        """
+        if scan is None:
+            return []
+        unstable = {}
+        new_logs = []
+        for log, version, report_path, has_report in scan.logs:
+            if (
+                log.path in self._pending
+                or self._taken.get(log.path) == version
+            ):
+                continue
+            stable = (
+                self._unstable.get(log.path) == version
+                or scan.time - version[1] / 1e9 > self.config.watch_interval
+            )
+            if not stable:
+                unstable[log.path] = version
+            elif has_report:
+                self._taken[log.path] = version
+            else:
+                self._pending[log.path] = version
+                new_logs.append((log, report_path))
+        # Failed scan is not applied, so the directory is scanned again
+        self._dir_stat = scan.dir_stat
+        self._unstable = unstable
+        return sorted(new_logs, key=lambda item: item[0].date)
+
+    def done(self, log: Log) -> None:
+        """Marks version of the log taken by `poll` as built
+
+        Log changed while it was built is taken by the next poll again
+        """
+        self._taken[log.path] = self._pending.pop(log.path)
+        self._dir_stat = None
+
+
+class LogWatcher:
+    """Builds reports of new logs as they appear in watched directories
+
+    Directories are polled every `WATCH_INTERVAL` seconds, new logs are
+    queued and built by `BATCH_WORKERS` processes. Pool of processes is
+    recreated when a worker dies, its logs are queued again. Directory which
+    can not be polled is polled again on the next interval. With
+    `WATCH_PORT` status, recent runs and poll errors are served as JSON on
+    `http://127.0.0.1:<port>/status`
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.dirs = [WatchedDir(c) for c in get_watch_configs(config)]
+        self.port = None
+        self.queue = asyncio.Queue()
+        self.queued = set()
+        self.running = {}
+        self.runs = deque(maxlen=WATCH_RUNS)
+        self.started = time.time()
+        self.polled = None
+        self.poll_errors = {}
+        self.executor = None
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Watches directories until `stop` is set or task is cancelled"""
+        if stop is None:
+            stop = asyncio.Event()
+        server = None
+        if self.config.watch_port is not None:
+            server = await asyncio.start_server(
+                self._handle_http, '127.0.0.1', self.config.watch_port
+            )
+            self.port = server.sockets[0].getsockname()[1]
+            logger.info('Status is served on port %d', self.port)
+        self.executor = self._new_executor()
+        tasks = [asyncio.create_task(self._poll())] + [
+            asyncio.create_task(self._build())
+            for _ in range(self.config.batch_workers)
+        ]
+        try:
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+
+    def status(self) -> dict:
+        return dict(
+            started=self.started,
+            polled=self.polled,
+            dirs=[
+                dict(log_dir=d.config.log_dir, report_dir=d.config.report_dir)
+                for d in self.dirs
+            ],
+            poll_errors=self.poll_errors,
+            queued=sorted(str(log.path) for log in self.queued),
+            running=[str(log.path) for log in self.running],
+            runs=[run._asdict() for run in reversed(self.runs)],
+        )
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Event loop has threads, forking it may deadlock workers
+        return ProcessPoolExecutor(
+            max_workers=self.config.batch_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    async def _poll(self) -> None:
+        while True:
+            for watched in self.dirs:
+                log_dir = watched.config.log_dir
+                try:
+                    # Only file system is read in the thread, state of the
+                    # directory is changed on the loop like by `done`
+                    scan = await asyncio.to_thread(
+                        watched.scan, watched.get_scanned_stat()
+                    )
+                except Exception as e:
+                    # Directory may be unavailable for a while, e.g. on
+                    # network file system, it is polled again
+                    logger.exception('Unable to poll `%s`', log_dir)
+                    self.poll_errors[log_dir] = dict(
+                        error=str(e), time=time.time()
+                    )
+                    continue
+                self.poll_errors.pop(log_dir, None)
+                for log, report_path in watched.update(scan):
+                    logger.info('Queued `%s`', log.path)
+                    self.queued.add(log)
+                    await self.queue.put((log, report_path, watched, 0))
+            self.polled = time.time()
+            await asyncio.sleep(self.config.watch_interval)
+
+    async def _build(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            log, report_path, watched, retries = await self.queue.get()
+            config = watched.config
+            self.queued.discard(log)
+            self.running[log] = report_path
+            started = time.time()
+            executor = self.executor
+            broken = False
+            try:
+                saved = await loop.run_in_executor(
+                    executor, build_log_report, log, report_path,
+                    config._replace(workers=1)
+                )
+            except BrokenProcessPool:
+                status = 'failed'
+                broken = True
+                logger.exception('Worker building `%s` died', log.path)
+                # Other tasks may have replaced the executor already
+                if self.executor is executor:
+                    executor.shutdown(wait=False)
+                    self.executor = self._new_executor()
+            except Exception:
+                status = 'failed'
+                logger.exception('Unable to build report for `%s`', log.path)
+            else:
+                status = 'built' if saved else 'rejected'
+                logger.info('Report for `%s` is %s', log.path, status)
+            finally:
+                del self.running[log]
+            self.runs.append(WatchRun(
+                log=str(log.path),
+                report=str(report_path),
+                status=status,
+                started=started,
+                seconds=time.time() - started,
+                metrics=_load_metrics(report_path) if config.metrics else None,
+            ))
+            if broken and retries < WATCH_RETRIES:
+                logger.info('Queued `%s` again', log.path)
+                self.queued.add(log)
+                await self.queue.put((log, report_path, watched, retries + 1))
+            else:
+                watched.done(log)
+
+    async def _handle_http(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            # Headers are not used
+            while (await reader.readline()) not in (b'', b'\r\n', b'\n'):
+                pass
+            if request[:2] == ['GET', '/status']:
+                code, reason = 200, 'OK'
+                body = json.dumps(self.status(), indent=4).encode()
+            else:
+                code, reason = 404, 'Not Found'
+                body = b'{"error": "not found"}'
+            writer.write(
+                f'HTTP/1.0 {code} {reason}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def watch_logs(config: Config) -> None:
+    """Runs `LogWatcher` until interrupted"""
+    asyncio.run(LogWatcher(config).run())
+
+
+def _load_metrics(report_path: Path) -> dict | None:
+    try:
+        with open(get_metrics_path(report_path)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
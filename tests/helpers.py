@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from log_analyzer.report import prepare_config
+
+LOG_LINE_FORMAT = (
+    '1.169.137.128 -  - [{time_local} +0300] '
+    '"GET {url} HTTP/1.1" 200 19415 "-" '
+    '"Slotovod" "-" "1498697422-{request_id}-4708-9752769" '
+    '"712e90144abee9" {time}\n'
+)
+
+
+def make_line(
+    banner: int | str = 16852664,
+    time: float | str = .199,
+    url: str | None = None,
+    time_local: str = '29/Jun/2017:03:50:22',
+    request_id: int = 2118016444
+) -> str:
+    """Line of default log format, url is `/api/v2/banner/<banner>`"""
+    if url is None:
+        url = f'/api/v2/banner/{banner}'
+    return LOG_LINE_FORMAT.format(
+        time_local=time_local, url=url, request_id=request_id, time=time
+    )
+
+
+LOG_LINE = make_line()
+
+
+class TmpDirTestCase(unittest.TestCase):
+    """Test case with temporary directory `dir` removed after every test
+
+    `config` is the default one with `REPORT_DIR` in `dir`
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.dir = Path(tmp_dir.name)
+        self.config = prepare_config()._replace(
+            report_dir=str(self.dir / 'reports')
+        )
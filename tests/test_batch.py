@@ -0,0 +1,57 @@
+import gzip
+import unittest
+from datetime import date
+
+from log_analyzer.report import build_reports, find_log, find_pending_logs
+
+from helpers import LOG_LINE, TmpDirTestCase
+
+
+class BatchReportTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        log_dir = self.dir / 'logs'
+        log_dir.mkdir()
+        for day in range(20170601, 20170605):
+            with open(log_dir / f'nginx-access-ui.log-{day}', 'w') as f:
+                f.write(LOG_LINE * (day % 10))
+        with gzip.open(log_dir / 'nginx-access-ui.log-20170605.gz', 'wt') as f:
+            f.write(LOG_LINE)
+        (log_dir / 'nginx-access-ui.log-20170606.bz2').touch()
+        self.config = self.config._replace(
+            log_dir=str(log_dir), batch_workers=2
+        )
+
+    def test_latest_log(self):
+        self.assertEqual(find_log(self.config).date, date(2017, 6, 5))
+
+    def test_pending_logs(self):
+        pending = find_pending_logs(self.config)
+        self.assertEqual(len(pending), 5)
+        (self.dir / 'reports' / 'report-2017.06.04.html').touch()
+        pending = find_pending_logs(self.config, since=date(2017, 6, 3))
+        self.assertEqual(
+            [log.date for log, _ in pending],
+            [date(2017, 6, 3), date(2017, 6, 5)]
+        )
+
+    def test_build_reports(self):
+        pending = find_pending_logs(self.config)
+        built, rejected, failed = build_reports(pending, self.config)
+        self.assertEqual((built, rejected, failed), (5, 0, 0))
+        for _, report_path in pending:
+            self.assertTrue(report_path.is_file())
+        self.assertEqual(find_pending_logs(self.config), [])
+
+    def test_gzip_reports(self):
+        config = self.config._replace(report_gzip=True)
+        pending = find_pending_logs(config, since=date(2017, 6, 5))
+        build_reports(pending, config)
+        report_path = self.dir / 'reports' / 'report-2017.06.05.html.gz'
+        with gzip.open(report_path, 'rt') as f:
+            self.assertIn('/api/v2/banner/16852664', f.read())
+        self.assertEqual(find_pending_logs(config, date(2017, 6, 5)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import gzip
+import unittest
+from datetime import date
+
+from benchmarks.bench import (
+    BenchResult,
+    check_baseline,
+    format_count,
+    load_baseline,
+    parse_count,
+    save_baseline,
+)
+from benchmarks.generator import generate_log, get_log_name
+from log_analyzer.report.fs import Log, read_log_bytes
+from log_analyzer.report.report import collect_stat
+
+from helpers import TmpDirTestCase
+
+
+class BenchmarksTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_generate_log(self):
+        path = self.dir / get_log_name(date(2017, 6, 30))
+        generate_log(path, 5000, urls=100, error_rate=.1, seed=1)
+        aggregate = collect_stat(read_log_bytes(Log(path, date.today())))
+        self.assertEqual(aggregate.total_lines, 5000)
+        self.assertAlmostEqual(aggregate.error_lines / 5000, .1, delta=.02)
+        self.assertLessEqual(len(aggregate.urls_stat), 100)
+
+        gz_path = self.dir / get_log_name(date(2017, 6, 30), gz=True)
+        generate_log(gz_path, 5000, urls=100, error_rate=.1, seed=1)
+        with gzip.open(gz_path, 'rb') as f:
+            self.assertEqual(f.read(), path.read_bytes())
+
+        generate_log(path, 5000, urls=100, error_rate=.1, seed=2)
+        with gzip.open(gz_path, 'rb') as f:
+            self.assertNotEqual(f.read(), path.read_bytes())
+
+    def test_counts(self):
+        self.assertEqual(parse_count('10M'), 10 ** 7)
+        self.assertEqual(parse_count('5k'), 5000)
+        self.assertEqual(parse_count('123'), 123)
+        self.assertEqual(format_count(10 ** 8), '100M')
+        self.assertEqual(format_count(1500), '1500')
+
+    def test_baseline(self):
+        results = [
+            BenchResult('1M-plain', 10 ** 6, 1, 95000, 100, {}),
+            BenchResult('1M-gz', 10 ** 6, 1, 80000, 100, {}),
+            BenchResult('10M-gz', 10 ** 7, 1, 80000, 100, {}),
+        ]
+        baseline_path = self.dir / 'baseline.json'
+        save_baseline(
+            [BenchResult('1M-plain', 10 ** 6, 1, 100000, 100, {})],
+            baseline_path
+        )
+        save_baseline(
+            [BenchResult('1M-gz', 10 ** 6, 1, 100000, 100, {})],
+            baseline_path
+        )
+        baseline = load_baseline(baseline_path)
+        self.assertEqual(baseline, {'1M-plain': 100000, '1M-gz': 100000})
+        regressions = check_baseline(results, baseline, 10)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('1M-gz'))
+        self.assertEqual(check_baseline(results, baseline, 25), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
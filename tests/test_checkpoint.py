@@ -0,0 +1,114 @@
+import gzip
+import random
+import unittest
+from datetime import date
+from unittest import mock
+
+from log_analyzer.report.checkpoint import (
+    collect_stat_checkpointed,
+    get_checkpoint_path,
+    iter_log_ranges,
+)
+from log_analyzer.report.fs import Log, read_log_bytes
+from log_analyzer.report.gzindex import get_index_path
+from log_analyzer.report.report import (
+    collect_stat,
+    prepare_report_table,
+    scan_stat,
+)
+
+from helpers import TmpDirTestCase, make_line
+
+
+class CheckpointTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        rnd = random.Random(0)
+        self.content = ''.join(
+            make_line(
+                banner=rnd.randrange(1000), time=rnd.randrange(10000) / 1000
+            )
+            for _ in range(20000)
+        ).encode()
+        self.config = self.config._replace(checkpoint_interval=0)
+
+    def get_collect(self, log, config):
+        if config.mmap_read and log.path.suffix != '.gz':
+            return scan_stat
+        return collect_stat
+
+    def interrupt(self, log, config, ranges):
+        calls = []
+        collect = self.get_collect(log, config)
+
+        def collect_interrupted(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == ranges:
+                raise KeyboardInterrupt
+            return collect(*args, **kwargs)
+
+        with mock.patch(
+            f'log_analyzer.report.checkpoint.{collect.__name__}',
+            collect_interrupted
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                collect_stat_checkpointed(log, config)
+
+    def count_ranges(self, log, config):
+        count = 0
+        for _, _, lines in iter_log_ranges(log, config):
+            for _ in lines:
+                pass
+            count += 1
+        return count
+
+    def check_resume(self, log, config):
+        ranges = self.count_ranges(log, config)
+        self.assertGreater(ranges, 3)
+        expected = collect_stat(read_log_bytes(log))
+        self.interrupt(log, config, 3)
+        checkpoint_path = get_checkpoint_path(log, config)
+        self.assertTrue(checkpoint_path.is_file())
+
+        collect = self.get_collect(log, config)
+        with mock.patch(
+            f'log_analyzer.report.checkpoint.{collect.__name__}',
+            wraps=collect
+        ) as resumed_collect:
+            aggregate = collect_stat_checkpointed(log, config)
+        self.assertEqual(resumed_collect.call_count, ranges - 2)
+        self.assertFalse(checkpoint_path.exists())
+        self.assertEqual(aggregate.total_lines, expected.total_lines)
+        self.assertEqual(
+            prepare_report_table(aggregate.urls_stat, None),
+            prepare_report_table(expected.urls_stat, None)
+        )
+
+    def test_plain(self):
+        log = Log(self.dir / 'nginx-access-ui.log-20170630', date.today())
+        log.path.write_bytes(self.content)
+        with mock.patch('log_analyzer.report.checkpoint.CHECKPOINT_SPAN',
+                        len(self.content) // 5):
+            self.check_resume(log, self.config)
+            self.check_resume(log, self.config._replace(mmap_read=False))
+
+    def test_gzip(self):
+        log = Log(self.dir / 'nginx-access-ui.log-20170630.gz', date.today())
+        log.path.write_bytes(gzip.compress(self.content * 2))
+        # Access points are found while the log is parsed, it is not indexed
+        self.check_resume(log, self.config._replace(gzip_index_span_mb=1))
+        self.assertFalse(get_index_path(log.path).exists())
+
+    def test_stale_checkpoint(self):
+        log = Log(self.dir / 'nginx-access-ui.log-20170630', date.today())
+        log.path.write_bytes(self.content)
+        with mock.patch('log_analyzer.report.checkpoint.CHECKPOINT_SPAN',
+                        len(self.content) // 5):
+            self.interrupt(log, self.config, 3)
+            config = self.config._replace(aggregation='sketch')
+            aggregate = collect_stat_checkpointed(log, config)
+        self.assertEqual(aggregate.total_lines, 20000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import pickle
+import random
+import unittest
+
+from log_analyzer.report.columnar import np
+from log_analyzer.report.report import (
+    PERCENTILES,
+    collect_stat,
+    merge_stat,
+    prepare_columnar_table,
+    prepare_table,
+)
+
+from helpers import make_line
+
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class ColumnarTableTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(7)
+        self.lines = [
+            make_line(
+                banner=rnd.randint(0, 50),
+                time=round(rnd.expovariate(3), 3)
+            )
+            for _ in range(3000)
+        ]
+
+    def expected_table(self, report_size: int) -> list[dict]:
+        urls_stat = collect_stat(self.lines).urls_stat
+        total_requests = sum(len(t) for t in urls_stat.values())
+        total_time = sum(sum(t) for t in urls_stat.values())
+        filtered_stat = sorted(
+            urls_stat.items(), key=lambda x: sum(x[1]), reverse=True
+        )[:report_size]
+        return prepare_table(filtered_stat, total_requests, total_time)
+
+    def assertTablesEqual(self, table: list[dict], expected: list[dict]):
+        self.assertEqual(len(table), len(expected))
+        for row, expected_row in zip(table, expected):
+            self.assertEqual(row.keys(), expected_row.keys())
+            self.assertEqual(row['url'], expected_row['url'])
+            self.assertEqual(row['count'], expected_row['count'])
+            for key in row.keys() - {'url', 'count'}:
+                self.assertAlmostEqual(row[key], expected_row[key])
+
+    def test_same_table_as_exact(self):
+        stat = collect_stat(self.lines, aggregation='columnar').urls_stat
+        for report_size in (1, 10, 1000):
+            self.assertTablesEqual(
+                prepare_columnar_table(stat, report_size, PERCENTILES),
+                self.expected_table(report_size)
+            )
+
+    def test_ties(self):
+        # Urls with equal totals are taken in order of the first appearance
+        lines = [
+            make_line(banner=banner, time=1)
+            for banner in range(500)
+        ]
+        stat = collect_stat(lines, aggregation='columnar').urls_stat
+        for report_size in (1, 7, 100):
+            table = prepare_columnar_table(stat, report_size, PERCENTILES)
+            self.assertEqual(
+                [row['url'] for row in table],
+                [f'/api/v2/banner/{banner}' for banner in range(report_size)]
+            )
+
+    def test_merge(self):
+        aggregate = merge_stat(
+            [
+                collect_stat(self.lines[:1000], aggregation='columnar'),
+                collect_stat(self.lines[1000:], aggregation='columnar'),
+            ],
+            'columnar'
+        )
+        self.assertTablesEqual(
+            prepare_columnar_table(aggregate.urls_stat, 20, PERCENTILES),
+            self.expected_table(20)
+        )
+
+    def test_pickle(self):
+        stat = collect_stat(self.lines, aggregation='columnar').urls_stat
+        restored = pickle.loads(pickle.dumps(stat))
+        self.assertEqual(list(restored), list(stat))
+        self.assertEqual(restored.times, stat.times)
+        restored['/new'].append(1.)
+        self.assertEqual(restored.ids[-1], len(stat))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+from log_analyzer.report.follow import (
+    get_follow_checkpoint_path,
+    refresh_follow,
+    start_follow,
+)
+from log_analyzer.report.report import collect_stat, save_stat_report
+
+from helpers import LOG_LINE, TmpDirTestCase
+
+
+class FollowTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.dir / 'nginx-access-ui.log'
+        self.checkpoint_path = get_follow_checkpoint_path(
+            self.path, self.config
+        )
+        self.report_path = (
+            self.dir / 'reports' / f'report-{date.today():%Y.%m.%d}.html'
+        )
+
+    def write(self, content: str, path: Path | None = None) -> None:
+        with open(path or self.path, 'a') as f:
+            f.write(content)
+
+    def start(self):
+        state = start_follow(self.path, self.checkpoint_path, self.config)
+        self.addCleanup(state.tail.close)
+        return state
+
+    def refresh(self, state):
+        state = refresh_follow(state, self.checkpoint_path, self.config)
+        self.addCleanup(state.tail.close)
+        return state
+
+    def test_incremental_refresh(self):
+        self.write(LOG_LINE * 3)
+        state = self.refresh(self.start())
+        self.assertEqual(state.aggregate.total_lines, 3)
+        self.assertTrue(self.report_path.is_file())
+
+        self.write(LOG_LINE * 2 + LOG_LINE[:20])
+        state = self.refresh(state)
+        self.assertEqual(state.aggregate.total_lines, 5)
+        self.write(LOG_LINE[20:])
+        state = self.refresh(state)
+        self.assertEqual(state.aggregate.total_lines, 6)
+        self.assertEqual(state.aggregate.error_lines, 0)
+        self.assertEqual(state.tail.offset, self.path.stat().st_size)
+
+    def test_resume_from_checkpoint(self):
+        self.write(LOG_LINE * 3)
+        state = self.refresh(self.start())
+        state.tail.close()
+        self.write(LOG_LINE)
+        state = self.refresh(self.start())
+        self.assertEqual(state.aggregate.total_lines, 4)
+
+    def test_checkpoint_appended(self):
+        self.write(LOG_LINE * 1000)
+        state = self.refresh(self.start())
+        base_size = self.checkpoint_path.stat().st_size
+        for _ in range(3):
+            self.write(LOG_LINE)
+            state = self.refresh(state)
+        # Only aggregates of new lines are appended
+        appended = self.checkpoint_path.stat().st_size - base_size
+        self.assertLess(appended, base_size)
+        state.tail.close()
+        resumed = self.start()
+        self.assertEqual(resumed.tail.offset, self.path.stat().st_size)
+        self.assertEqual(
+            resumed.aggregate,
+            collect_stat(self.path.read_bytes().splitlines())
+        )
+        # Checkpoint is replaced when appended aggregates get large
+        for _ in range(300):
+            self.write(LOG_LINE)
+            resumed = self.refresh(resumed)
+        self.assertLess(self.checkpoint_path.stat().st_size, base_size * 3)
+        self.assertEqual(resumed.aggregate.total_lines, 1303)
+
+    def test_broken_checkpoint_end(self):
+        self.write(LOG_LINE * 3)
+        state = self.refresh(self.start())
+        self.write(LOG_LINE * 2)
+        state = self.refresh(state)
+        state.tail.close()
+        content = self.checkpoint_path.read_bytes()
+        self.checkpoint_path.write_bytes(content[:-10])
+        # Lines of partially saved aggregate are parsed again
+        with self.assertLogs('log_analyzer.report.follow'):
+            state = self.start()
+        self.assertEqual(state.aggregate.total_lines, 3)
+        state = self.refresh(state)
+        self.assertEqual(state.aggregate.total_lines, 5)
+        state.tail.close()
+        self.assertEqual(self.start().aggregate.total_lines, 5)
+
+    def test_throttled_render(self):
+        self.write(LOG_LINE * 3)
+        with mock.patch(
+            'log_analyzer.report.follow.FOLLOW_RENDER_RATIO', 1e9
+        ):
+            state = self.refresh(self.start())
+            content = self.report_path.read_text()
+            self.write(LOG_LINE)
+            state = self.refresh(state)
+            self.assertEqual(state.aggregate.total_lines, 4)
+            self.assertEqual(self.report_path.read_text(), content)
+            # Report of the day is finished on rotation
+            self.path.rename(self.dir / 'nginx-access-ui.log-20170630')
+            self.write(LOG_LINE)
+            state = self.refresh(state)
+            self.assertNotEqual(self.report_path.read_text(), content)
+
+    def test_rotation(self):
+        self.write(LOG_LINE * 3)
+        state = self.refresh(self.start())
+        rotated_path = self.dir / 'nginx-access-ui.log-20170630'
+        self.path.rename(rotated_path)
+        self.write(LOG_LINE, rotated_path)
+        self.write(LOG_LINE * 2)
+        state = self.refresh(state)
+        # Old file is read to the end, new file is followed from the start
+        self.assertEqual(state.aggregate.total_lines, 0)
+        self.assertEqual(state.tail.offset, 0)
+        state = self.refresh(state)
+        self.assertEqual(state.aggregate.total_lines, 2)
+
+    def test_truncation(self):
+        self.write(LOG_LINE * 3)
+        state = self.refresh(self.start())
+        self.path.write_text(LOG_LINE)
+        state = self.refresh(state)
+        self.assertEqual(state.aggregate.total_lines, 1)
+
+    def test_truncation_render(self):
+        self.write(LOG_LINE * 3)
+        with mock.patch(
+            'log_analyzer.report.follow.FOLLOW_RENDER_RATIO', 1e9
+        ), mock.patch(
+            'log_analyzer.report.follow.save_stat_report',
+            wraps=save_stat_report
+        ) as render:
+            state = self.refresh(self.start())
+            self.write(LOG_LINE)
+            state = self.refresh(state)
+            self.assertEqual(render.call_count, 1)
+            # Report of the day is finished on truncation
+            self.path.write_text('')
+            state = self.refresh(state)
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(render.call_args.args[0].total_lines, 4)
+        self.assertEqual(state.aggregate.total_lines, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
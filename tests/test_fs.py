@@ -0,0 +1,141 @@
+import gzip
+import unittest
+from datetime import date
+
+from log_analyzer.report.fs import (
+    Log,
+    open_report,
+    read_log,
+    read_log_blocks,
+    read_log_windows,
+    split_log,
+)
+
+from helpers import TmpDirTestCase
+
+LINES = [f'line {i} {"x" * (i % 50)}' for i in range(5000)]
+
+
+class ReadLogBlocksTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def make_log(self, name: str, content: bytes) -> Log:
+        path = self.dir / name
+        path.write_bytes(content)
+        return Log(path, date.today())
+
+    def read_lines(self, log: Log) -> list[str]:
+        return [
+            line.decode()
+            for lines in read_log_blocks(log, block_size=1000)
+            for line in lines
+        ]
+
+    def test_plain(self):
+        log = self.make_log('log', '\n'.join(LINES).encode())
+        self.assertEqual(self.read_lines(log), LINES)
+
+    def test_gzip(self):
+        content = ('\n'.join(LINES) + '\n').encode()
+        log = self.make_log('log.gz', gzip.compress(content))
+        self.assertEqual(self.read_lines(log), LINES)
+        self.assertEqual(
+            self.read_lines(log),
+            [line.rstrip('\n') for line in read_log(log)]
+        )
+
+    def test_multi_member_gzip(self):
+        content = (
+            gzip.compress(('\n'.join(LINES[:100]) + '\n').encode())
+            + gzip.compress(('\n'.join(LINES[100:]) + '\n').encode())
+            + b'\x00' * 10
+        )
+        log = self.make_log('log.gz', content)
+        self.assertEqual(self.read_lines(log), LINES)
+
+    def test_truncated_gzip(self):
+        content = gzip.compress(('\n'.join(LINES)).encode())
+        log = self.make_log('log.gz', content[:-100])
+        with self.assertRaises(EOFError):
+            self.read_lines(log)
+
+
+class ReadLogWindowsTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.dir / 'log'
+        self.log = Log(self.path, date.today())
+
+    def read_windows(self, *args, **kwargs) -> list[bytes]:
+        return [
+            bytes(window)
+            for window in read_log_windows(self.log, *args, **kwargs)
+        ]
+
+    def test_windows_end_with_lines(self):
+        content = '\n'.join(LINES).encode()
+        self.path.write_bytes(content)
+        windows = self.read_windows(window_size=1000)
+        self.assertEqual(b''.join(windows), content)
+        self.assertGreater(len(windows), 1)
+        for window in windows[:-1]:
+            self.assertTrue(window.endswith(b'\n'))
+            self.assertLessEqual(len(window), 1000)
+
+    def test_long_line(self):
+        self.path.write_bytes(b'a' * 3000 + b'\nb\n' + b'c' * 3000)
+        self.assertEqual(
+            self.read_windows(window_size=1000),
+            [b'a' * 3000 + b'\n', b'b\n', b'c' * 3000]
+        )
+
+    def test_ranges(self):
+        content = '\n'.join(LINES).encode()
+        self.path.write_bytes(content)
+        for start, end in split_log(self.log, 3):
+            self.assertEqual(
+                b''.join(self.read_windows(start, end, window_size=1000)),
+                content[start:end]
+            )
+
+    def test_empty(self):
+        self.path.write_bytes(b'')
+        self.assertEqual(self.read_windows(), [])
+
+
+class OpenReportTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_plain(self):
+        report_path = self.dir / 'report.html'
+        with open_report(report_path) as f:
+            f.write('<html>ü</html>')
+            self.assertFalse(report_path.exists())
+        self.assertEqual(report_path.read_text('utf-8'), '<html>ü</html>')
+        self.assertEqual(list(self.dir.iterdir()), [report_path])
+
+    def test_gzip(self):
+        report_path = self.dir / 'report.html.gz'
+        for _ in range(2):
+            with open_report(report_path) as f:
+                f.write('<html></html>')
+            content = report_path.read_bytes()
+        self.assertEqual(gzip.decompress(content), b'<html></html>')
+        # The same report is the same file
+        self.assertEqual(report_path.read_bytes(), content)
+
+    def test_failure_keeps_report(self):
+        report_path = self.dir / 'report.html'
+        report_path.write_text('old')
+        with self.assertRaises(RuntimeError):
+            with open_report(report_path) as f:
+                f.write('partial')
+                raise RuntimeError
+        self.assertEqual(report_path.read_text(), 'old')
+        self.assertEqual(list(self.dir.iterdir()), [report_path])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import gzip
+import os
+import random
+import unittest
+from datetime import date
+
+from log_analyzer.report import prepare_config
+from log_analyzer.report.fs import Log, read_log, read_log_bytes
+from log_analyzer.report.gzindex import (
+    build_gzip_index,
+    ensure_gzip_index,
+    get_index_path,
+    iter_gzip_lines,
+    load_gzip_index,
+    read_gzip_range,
+)
+from log_analyzer.report.parallel import build_report_parallel, split_gzip_index
+from log_analyzer.report.report import build_report
+
+from helpers import TmpDirTestCase, make_line
+
+SPAN = 1 << 16
+
+
+class GzipIndexTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = Log(
+            self.dir / 'nginx-access-ui.log-20170630.gz', date.today()
+        )
+        rnd = random.Random(0)
+        self.content = ''.join(
+            make_line(
+                banner=rnd.randrange(5000), time=rnd.randrange(10000) / 1000
+            )
+            for _ in range(20000)
+        ).encode()
+        self.log.path.write_bytes(gzip.compress(self.content))
+
+    def read_ranges(self, points: list) -> list[bytes]:
+        ends = [point.out for point in points[1:]] + [len(self.content)]
+        return [
+            line
+            for point, end in zip(points, ends)
+            for line in read_gzip_range(self.log.path, point, end)
+        ]
+
+    def test_ranges_cover_log(self):
+        index = build_gzip_index(self.log.path, SPAN)
+        self.assertGreater(len(index.points), 3)
+        # Most of deflate blocks do not start at byte boundary
+        self.assertTrue(any(point.bits for point in index.points))
+        for point in index.points:
+            self.assertEqual(
+                point.window, self.content[point.out - len(point.window):
+                                           point.out]
+            )
+        lines = self.read_ranges([None] + index.points)
+        self.assertEqual(lines, list(read_log_bytes(self.log)))
+
+    def test_multiple_members(self):
+        half = self.content.index(b'\n', len(self.content) // 2) + 1
+        self.log.path.write_bytes(
+            gzip.compress(self.content[:half])
+            + gzip.compress(self.content[half:])
+            + b'\x00' * 16
+        )
+        index = build_gzip_index(self.log.path, SPAN)
+        self.assertTrue(any(point.out > half for point in index.points))
+        lines = self.read_ranges([None] + index.points)
+        self.assertEqual(lines, self.content.splitlines())
+
+    def test_lines_with_points(self):
+        half = self.content.index(b'\n', len(self.content) // 2) + 1
+        self.log.path.write_bytes(
+            gzip.compress(self.content[:half])
+            + gzip.compress(self.content[half:])
+        )
+        lines = self.content.splitlines()
+        items = list(iter_gzip_lines(self.log.path, SPAN))
+        points = [item for item in items if not isinstance(item, bytes)]
+        self.assertEqual(
+            points, build_gzip_index(self.log.path, SPAN).points
+        )
+        self.assertEqual(
+            [item for item in items if isinstance(item, bytes)], lines
+        )
+        for point in points:
+            # Lines before the point and lines read from it are the log
+            before = items.index(point) - points.index(point)
+            resumed = [
+                item for item in iter_gzip_lines(self.log.path, SPAN, point)
+                if isinstance(item, bytes)
+            ]
+            self.assertEqual(resumed, lines[before:])
+
+    def test_resume_before_next_member(self):
+        half = self.content.index(b'\n', len(self.content) // 2) + 1
+        self.log.path.write_bytes(
+            gzip.compress(self.content[:half]) + b'\x00' * 5
+            + gzip.compress(self.content[half:])
+        )
+        points = build_gzip_index(self.log.path, SPAN).points
+        first = points[0]
+        self.assertLess(first.out, half)
+        # Points of the next member found after resuming are the same
+        resumed = [
+            item for item in iter_gzip_lines(self.log.path, SPAN, first)
+            if not isinstance(item, bytes)
+        ]
+        self.assertEqual(resumed, points[1:])
+        later = [point for point in resumed if point.out > half]
+        self.assertTrue(later)
+        lines = self.read_ranges([None, later[0]])
+        self.assertEqual(lines, self.content.splitlines())
+
+    def test_split_index(self):
+        index = build_gzip_index(self.log.path, SPAN)
+        points = split_gzip_index(index.points, 3)
+        self.assertEqual(len(points), 3)
+        self.assertIsNone(points[0])
+        self.assertLess(points[1].out, points[2].out)
+        lines = self.read_ranges(points)
+        self.assertEqual(lines, self.content.splitlines())
+        self.assertEqual(split_gzip_index([], 3), [None])
+
+    def test_reuse_index(self):
+        index = ensure_gzip_index(self.log.path, SPAN)
+        index_path = get_index_path(self.log.path)
+        self.assertTrue(index_path.is_file())
+        self.assertEqual(load_gzip_index(self.log.path, index_path), index)
+        # Rewritten log makes index stale
+        stat = self.log.path.stat()
+        os.utime(self.log.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNone(load_gzip_index(self.log.path, index_path))
+        index_path.write_bytes(b'broken')
+        self.assertIsNone(load_gzip_index(self.log.path, index_path))
+        self.assertEqual(
+            ensure_gzip_index(self.log.path, SPAN).points, index.points
+        )
+
+    def test_same_report_as_serial(self):
+        config = prepare_config()._replace(
+            workers=4, gzip_index=True, gzip_index_span_mb=1
+        )
+        self.log.path.write_bytes(gzip.compress(self.content * 20))
+        serial_path = self.dir / 'serial.html'
+        parallel_path = self.dir / 'parallel.html'
+        build_report(read_log(self.log), serial_path, config)
+        build_report_parallel(self.log, parallel_path, config)
+        self.assertEqual(serial_path.read_bytes(), parallel_path.read_bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from datetime import date
+
+from log_analyzer.report.history import (
+    open_history,
+    query_new_urls,
+    query_top,
+    query_trend,
+    save_history,
+)
+from log_analyzer.report.report import collect_stat
+
+from helpers import make_line
+
+
+def make_aggregate(times: dict[str, list[float]]):
+    return collect_stat(
+        make_line(url=url, time=t)
+        for url, url_times in times.items()
+        for t in url_times
+    )
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = open_history(':memory:')
+        self.addCleanup(self.conn.close)
+        save_history(self.conn, date(2017, 6, 1), make_aggregate({
+            '/a': [1, 1], '/b': [5],
+        }))
+        save_history(self.conn, date(2017, 6, 2), make_aggregate({
+            '/a': [2, 2, 2], '/c': [.5],
+        }))
+
+    def test_top(self):
+        rows = query_top(self.conn, date(2017, 6, 1), date(2017, 6, 2))
+        self.assertEqual([row['url'] for row in rows], ['/a', '/b', '/c'])
+        self.assertEqual(rows[0]['count'], 5)
+        self.assertEqual(rows[0]['time_sum'], 8)
+        rows = query_top(
+            self.conn, date(2017, 6, 1), date(2017, 6, 2), 1, 'time_max'
+        )
+        self.assertEqual([row['url'] for row in rows], ['/b'])
+
+    def test_trend(self):
+        rows = query_trend(self.conn, '/a')
+        self.assertEqual(
+            [row['day'] for row in rows], ['2017-06-01', '2017-06-02']
+        )
+        self.assertEqual([row['time_med'] for row in rows], [1, 2])
+
+    def test_new_urls(self):
+        rows = query_new_urls(self.conn, date(2017, 6, 2), date(2017, 6, 2))
+        self.assertEqual([row['url'] for row in rows], ['/c'])
+
+    def test_upsert(self):
+        save_history(self.conn, date(2017, 6, 2), make_aggregate({
+            '/a': [3],
+        }))
+        rows = query_trend(self.conn, '/a')
+        self.assertEqual(rows[-1]['count'], 1)
+        rows = query_top(self.conn, date(2017, 6, 2), date(2017, 6, 2))
+        self.assertEqual([row['url'] for row in rows], ['/a'])
+
+    def test_resave_new_urls(self):
+        # `/c` is not in the day saved again, `/b` is first seen on it now
+        save_history(self.conn, date(2017, 6, 2), make_aggregate({
+            '/a': [3], '/b': [1],
+        }))
+        self.assertEqual(
+            query_new_urls(self.conn, date(2017, 6, 2), date(2017, 6, 2)),
+            []
+        )
+        # Day saved again without `/b` is not its first day anymore
+        save_history(self.conn, date(2017, 6, 1), make_aggregate({
+            '/a': [1],
+        }))
+        rows = query_new_urls(self.conn, date(2017, 6, 1), date(2017, 6, 2))
+        self.assertEqual(
+            sorted((row['url'], row['first_day']) for row in rows),
+            [('/a', '2017-06-01'), ('/b', '2017-06-02')]
+        )
+        self.assertEqual(
+            self.conn.execute(
+                "SELECT last_day FROM urls WHERE url = '/a'"
+            ).fetchone()[0],
+            '2017-06-02'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
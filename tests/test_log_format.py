@@ -0,0 +1,111 @@
+import unittest
+
+from log_analyzer.report.log_format import (
+    DEFAULT_LOG_FORMAT,
+    compile_log_format,
+)
+from log_analyzer.report.report import collect_stat, parse_line, scan_stat
+from log_analyzer.report.validate import TooManyErrors, _parse_sample
+
+LOG_LINE = (
+    '1.99.174.176 3b81f63526fa8  - [29/Jun/2017:03:50:22 +0300] '
+    '"GET /api/1/photogenic_banners/list/?server_name=WIN7RB4 HTTP/1.1" '
+    '200 12 "-" "Python-urllib/2.7" "-" "1498697422-32900793-4708-9752770" '
+    '"-" 0.133\n'
+)
+
+
+class LogFormatTest(unittest.TestCase):
+    def test_default_format(self):
+        parser = compile_log_format(DEFAULT_LOG_FORMAT)
+        match = parser.pattern.match(LOG_LINE)
+        self.assertIsNotNone(match)
+        self.assertEqual(
+            match[parser.url_group],
+            '/api/1/photogenic_banners/list/?server_name=WIN7RB4'
+        )
+        self.assertEqual(match[parser.time_group], '0.133')
+
+    def test_extra_fields(self):
+        log_format = DEFAULT_LOG_FORMAT + ' $upstream_addr "$host"'
+        line = LOG_LINE.rstrip('\n') + ' 10.0.0.1:8080 "rb.mail.ru"\n'
+        self.assertIsNone(parse_line(line))
+        result = parse_line(line, log_format)
+        self.assertEqual(result.request_time_sec, 0.133)
+
+    def test_time_before_url(self):
+        log_format = '$request_time $remote_addr $request_uri'
+        result = parse_line('0.5 1.2.3.4 /api/v1/x\n', log_format)
+        self.assertEqual(result.url, '/api/v1/x')
+        self.assertEqual(result.request_time_sec, 0.5)
+
+    def test_required_variables(self):
+        with self.assertRaises(ValueError):
+            compile_log_format('$remote_addr "$request"')
+        with self.assertRaises(ValueError):
+            compile_log_format('$request_uri $uri $request_time')
+
+    def test_invalid_time_is_error(self):
+        aggregate = collect_stat(
+            [LOG_LINE, LOG_LINE.replace('0.133', '-')]
+        )
+        self.assertEqual(aggregate.total_lines, 2)
+        self.assertEqual(aggregate.error_lines, 1)
+
+    def test_non_finite_time_is_error(self):
+        lines = [LOG_LINE] + [
+            LOG_LINE.replace('0.133', time)
+            for time in ('nan', 'inf', '-Infinity')
+        ]
+        for aggregation in ('exact', 'sketch'):
+            aggregate = collect_stat(lines, aggregation=aggregation)
+            self.assertEqual(aggregate.total_lines, 4)
+            self.assertEqual(aggregate.error_lines, 3)
+            aggregate = scan_stat(
+                [''.join(lines).encode()], aggregation=aggregation
+            )
+            self.assertEqual(aggregate.total_lines, 4)
+            self.assertEqual(aggregate.error_lines, 3)
+        self.assertIsNone(parse_line(lines[1]))
+        sample = [line.encode() for line in lines]
+        self.assertEqual(
+            _parse_sample(sample, DEFAULT_LOG_FORMAT), (3, len(LOG_LINE))
+        )
+
+    def test_scan_stat(self):
+        lines = [
+            LOG_LINE.rstrip('\n'),
+            '',
+            'WRONG FMT',
+            LOG_LINE.replace('0.133', '-').rstrip('\n'),
+            LOG_LINE.replace('list', 'item').rstrip('\n') + ' \r',
+            '',
+            LOG_LINE.replace('0.133', '1.5').rstrip('\n'),
+        ]
+        for end in ('', '\n', '\n\nWRONG FMT'):
+            content = ('\n'.join(lines) + end).encode()
+            split_lines = content.split(b'\n')
+            if not split_lines[-1]:
+                split_lines.pop()
+            expected = collect_stat(split_lines)
+            windows = [
+                content[:len(LOG_LINE) + 1], content[len(LOG_LINE) + 1:]
+            ]
+            for aggregate in (scan_stat([content]), scan_stat(windows)):
+                self.assertEqual(aggregate.total_lines, expected.total_lines)
+                self.assertEqual(aggregate.error_lines, expected.error_lines)
+                self.assertEqual(
+                    list(aggregate.urls_stat.items()),
+                    list(expected.urls_stat.items())
+                )
+
+    def test_scan_stat_abort(self):
+        content = ''.join([LOG_LINE] * 100 + ['WRONG FMT\n'] * 100).encode()
+        windows = [content[:len(LOG_LINE) * 100], content[len(LOG_LINE) * 100:]]
+        self.assertEqual(scan_stat(windows).error_lines, 100)
+        with self.assertRaises(TooManyErrors):
+            scan_stat(windows, max_error_lines=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
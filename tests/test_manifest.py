@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import unittest
+from datetime import date
+from unittest import mock
+
+from log_analyzer.report import (
+    build_log_report,
+    build_reports,
+    find_log,
+    find_pending_logs,
+    get_report_path,
+    is_log_pending,
+)
+from log_analyzer.report.manifest import (
+    LOG_BUILT,
+    LOG_NEW,
+    LOG_REJECTED,
+    open_manifest,
+    scan_manifest,
+)
+
+from helpers import LOG_LINE, TmpDirTestCase
+
+
+class ManifestTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log_dir = self.dir / 'logs'
+        self.log_dir.mkdir()
+        for day in range(20170601, 20170604):
+            (self.log_dir / f'nginx-access-ui.log-{day}').write_text(LOG_LINE)
+        self.broken_path = self.log_dir / 'nginx-access-ui.log-20170604'
+        self.broken_path.write_text('WRONG FMT\n')
+        (self.log_dir / 'other.log').touch()
+        self.config = self.config._replace(
+            log_dir=str(self.log_dir),
+            batch_workers=1,
+            metrics=False,
+            aggregate_cache=False,
+        )
+
+    def scan(self):
+        conn = open_manifest(self.config.report_dir)
+        try:
+            return scan_manifest(conn, self.config)
+        finally:
+            conn.close()
+
+    def test_scan(self):
+        entries = self.scan()
+        self.assertEqual(len(entries), 4)
+        entry = entries['nginx-access-ui.log-20170601']
+        self.assertEqual(entry.day, '2017-06-01')
+        self.assertEqual(entry.size, len(LOG_LINE))
+        self.assertEqual(entry.status, LOG_NEW)
+        self.assertEqual(self.scan(), entries)
+
+        # Touched log keeps its fingerprint
+        os.utime(self.broken_path, (0, 0))
+        self.assertEqual(
+            self.scan()[self.broken_path.name].fingerprint,
+            entries[self.broken_path.name].fingerprint
+        )
+        self.broken_path.unlink()
+        self.assertEqual(len(self.scan()), 3)
+
+    def test_build_reports(self):
+        pending = find_pending_logs(self.config)
+        self.assertEqual(len(pending), 4)
+        self.assertEqual(build_reports(pending, self.config), (3, 1, 0))
+        entries = self.scan()
+        self.assertEqual(
+            sorted(entry.status for entry in entries.values()),
+            [LOG_BUILT] * 3 + [LOG_REJECTED]
+        )
+        self.assertTrue(all(
+            entry.seconds is not None for entry in entries.values()
+        ))
+        # Unchanged logs are not read, rejected one is not pending
+        with mock.patch(
+            'log_analyzer.report.manifest.get_log_fingerprint'
+        ) as get_log_fingerprint:
+            self.assertEqual(find_pending_logs(self.config), [])
+        get_log_fingerprint.assert_not_called()
+        # Rejected log is pending with other settings it is checked by
+        for config in (
+            self.config._replace(max_error_rate=1),
+            self.config._replace(log_format='$request $request_time'),
+        ):
+            self.assertEqual(
+                [log.path for log, _ in find_pending_logs(config)],
+                [self.broken_path]
+            )
+        # Rejected log is pending when it is changed
+        self.broken_path.write_text(LOG_LINE)
+        self.assertEqual(
+            [log.path for log, _ in find_pending_logs(self.config)],
+            [self.broken_path]
+        )
+        # Deleted report is built again
+        report_path = self.dir / 'reports' / 'report-2017.06.01.html'
+        report_path.unlink()
+        self.assertEqual(
+            [log.date for log, _ in find_pending_logs(self.config)],
+            [date(2017, 6, 1), date(2017, 6, 4)]
+        )
+
+    def test_latest_log(self):
+        log = find_log(self.config)
+        self.assertEqual(log.path, self.broken_path)
+        report_path = get_report_path(log, self.config)
+        self.assertTrue(is_log_pending(log, report_path, self.config))
+        self.assertFalse(build_log_report(log, report_path, self.config))
+        # Rejected latest log is not parsed on every run
+        self.assertFalse(is_log_pending(log, report_path, self.config))
+        self.assertTrue(is_log_pending(
+            log, report_path, self.config._replace(max_error_rate=1)
+        ))
+        # Without manifest only reports are checked
+        self.assertTrue(is_log_pending(
+            log, report_path, self.config._replace(manifest=False)
+        ))
+        self.broken_path.write_text(LOG_LINE)
+        self.assertTrue(is_log_pending(log, report_path, self.config))
+
+    def test_old_manifest(self):
+        path = self.dir / 'reports' / '.manifest.sqlite'
+        path.parent.mkdir()
+        conn = sqlite3.connect(path)
+        conn.execute(
+            'CREATE TABLE logs (log_dir TEXT NOT NULL, name TEXT NOT NULL, '
+            'day TEXT NOT NULL, size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, fingerprint TEXT NOT NULL, '
+            'status TEXT NOT NULL, started TEXT, seconds REAL, '
+            'PRIMARY KEY (log_dir, name)) WITHOUT ROWID'
+        )
+        conn.close()
+        self.assertEqual(len(self.scan()), 4)
+        self.assertEqual(build_reports(
+            find_pending_logs(self.config), self.config
+        ), (3, 1, 0))
+        self.assertEqual(find_pending_logs(self.config), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
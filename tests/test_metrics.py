@@ -0,0 +1,73 @@
+import json
+import unittest
+from datetime import date
+
+from log_analyzer.report.batch import build_log_report
+from log_analyzer.report.fs import Log, read_log_blocks
+from log_analyzer.report.metrics import Metrics, get_metrics_path
+
+from helpers import TmpDirTestCase, make_line
+
+
+class MetricsTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = Log(self.dir / 'nginx-access-ui.log-20170630', date.today())
+        with open(self.log.path, 'w') as f:
+            for i in range(1000):
+                f.write(make_line(banner=i % 37, time=(i % 13) / 7))
+            f.write('WRONG FMT\n')
+        self.report_path = self.dir / 'report-2017.06.30.html'
+        self.config = self.config._replace(aggregate_cache=False)
+
+    def test_stage_excludes_nested(self):
+        metrics = Metrics()
+        with metrics.stage('parse', exclude='read'):
+            for _ in metrics.read_blocks(read_log_blocks(self.log)):
+                sum(range(10000))
+        self.assertEqual(
+            metrics.counters['bytes_uncompressed'],
+            self.log.path.stat().st_size
+        )
+        self.assertGreater(metrics.stages['read']['wall'], 0)
+        self.assertGreater(metrics.stages['parse']['wall'], 0)
+        with metrics.stage('parse'):
+            pass
+        self.assertEqual(set(metrics.stages), {'read', 'parse'})
+
+    def test_metrics_file(self):
+        self.assertTrue(
+            build_log_report(self.log, self.report_path, self.config)
+        )
+        with open(get_metrics_path(self.report_path)) as f:
+            metrics = json.load(f)
+        self.assertEqual(metrics['total_lines'], 1001)
+        self.assertEqual(metrics['error_lines'], 1)
+        self.assertEqual(metrics['urls'], 37)
+        self.assertEqual(
+            metrics['bytes_read'], self.log.path.stat().st_size
+        )
+        self.assertTrue(metrics['saved'])
+        self.assertGreater(metrics['lines_per_sec'], 0)
+        # Memory-mapped log is read during parsing
+        self.assertEqual(
+            list(metrics['stages']),
+            ['sample', 'parse', 'prepare_table', 'write']
+        )
+        config = self.config._replace(mmap_read=False)
+        self.assertTrue(build_log_report(self.log, self.report_path, config))
+        with open(get_metrics_path(self.report_path)) as f:
+            metrics = json.load(f)
+        self.assertEqual(
+            list(metrics['stages']),
+            ['sample', 'read', 'parse', 'prepare_table', 'write']
+        )
+
+    def test_metrics_off(self):
+        config = self.config._replace(metrics=False)
+        self.assertTrue(build_log_report(self.log, self.report_path, config))
+        self.assertFalse(get_metrics_path(self.report_path).exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
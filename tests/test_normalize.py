@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from log_analyzer.report.normalize import (
+    DEFAULT_URL_RULES,
+    URLNormalizer,
+    compile_url_rules,
+)
+from log_analyzer.report.report import collect_stat
+
+from helpers import make_line
+
+
+class URLNormalizerTest(unittest.TestCase):
+    def test_default_rules(self):
+        normalized = URLNormalizer(DEFAULT_URL_RULES)
+        cases = [
+            ('/api/v2/banner/16852664', '/api/v2/banner/{id}'),
+            ('/api/v2/banner/16852664/', '/api/v2/banner/{id}/'),
+            (
+                '/api/v2/group/1/banners?page=2',
+                '/api/v2/group/{id}/banners?{query}'
+            ),
+            (
+                '/export/0c5a3fe8-1111-2222-3333-444455556666/status',
+                '/export/{uuid}/status'
+            ),
+            ('/static/d41d8cd98f00b204e9800998ecf8427e', '/static/{hash}'),
+            ('/api/v2/slot4/', '/api/v2/slot4/'),
+            ('/', '/'),
+        ]
+        for url, expected in cases:
+            self.assertEqual(normalized[url], expected)
+            self.assertEqual(normalized[url.encode()], expected.encode())
+
+    def test_custom_rules(self):
+        normalized = URLNormalizer([['[a-z]+-\\d+', '{slug}']])
+        self.assertEqual(normalized['/post/abc-12/1'], '/post/{slug}/1')
+        with self.assertRaises(ValueError):
+            compile_url_rules((('(', '{x}'),))
+
+    def test_cache_is_bounded(self):
+        with mock.patch('log_analyzer.report.normalize.URL_CACHE_SIZE', 10):
+            normalized = URLNormalizer(DEFAULT_URL_RULES)
+            for i in range(25):
+                self.assertEqual(normalized[f'/x/{i}'], '/x/{id}')
+            self.assertLessEqual(len(normalized), 10)
+
+    def test_collect_normalized(self):
+        lines = [
+            make_line(url=f'/api/v2/banner/{i}', time=1).encode()
+            for i in range(100)
+        ]
+        aggregate = collect_stat(lines, url_rules=DEFAULT_URL_RULES)
+        self.assertEqual(
+            dict(aggregate.urls_stat), {b'/api/v2/banner/{id}': [1.] * 100}
+        )
+        aggregate = collect_stat(lines)
+        self.assertEqual(len(aggregate.urls_stat), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from datetime import date
+
+from log_analyzer.report import Config, prepare_config
+from log_analyzer.report.fs import (
+    Log,
+    read_log,
+    read_log_bytes,
+    read_log_range,
+    split_log,
+)
+from log_analyzer.report.parallel import build_report_parallel
+from log_analyzer.report.report import build_report
+
+from helpers import TmpDirTestCase, make_line
+
+
+class ParallelReportTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = Log(self.dir / 'nginx-access-ui.log-20170630', date.today())
+        with open(self.log.path, 'w') as f:
+            for i in range(1000):
+                if i % 97 == 0:
+                    f.write('WRONG FMT\n')
+                f.write(make_line(banner=i % 37, time=(i % 13) / 7))
+
+    def make_config(self, workers: int) -> Config:
+        return prepare_config()._replace(workers=workers, max_error_rate=.5)
+
+    def test_ranges_cover_log(self):
+        ranges = split_log(self.log, 7)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], self.log.path.stat().st_size)
+        lines = [
+            line
+            for start, end in ranges
+            for line in read_log_range(self.log, start, end)
+        ]
+        self.assertEqual(lines, list(read_log_bytes(self.log)))
+
+    def test_more_ranges_than_lines(self):
+        ranges = split_log(self.log, 100000)
+        lines = sum(
+            len(list(read_log_range(self.log, start, end)))
+            for start, end in ranges
+        )
+        self.assertEqual(lines, len(list(read_log_bytes(self.log))))
+
+    def test_same_report_as_serial(self):
+        serial_path = self.dir / 'serial.html'
+        parallel_path = self.dir / 'parallel.html'
+        build_report(read_log(self.log), serial_path, self.make_config(1))
+        build_report_parallel(self.log, parallel_path, self.make_config(4))
+        self.assertEqual(serial_path.read_bytes(), parallel_path.read_bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import math
+import random
+import unittest
+from datetime import date
+from itertools import permutations
+
+from log_analyzer.report import (
+    build_partial_report,
+    collect_partial,
+    load_partial,
+    merge_partials,
+    save_partial,
+)
+from log_analyzer.report.fs import Log, read_log_bytes
+from log_analyzer.report.partial import PartialError
+from log_analyzer.report.report import collect_stat, prepare_report_table
+
+from helpers import TmpDirTestCase, make_line
+
+SOURCES = ('front1', 'front2', 'front3')
+
+
+class PartialTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config = self.config._replace(aggregate_cache=False)
+        rnd = random.Random(0)
+        self.logs = {}
+        for source in SOURCES:
+            path = self.dir / source / 'nginx-access-ui.log-20170630'
+            path.parent.mkdir()
+            # Times are not exact in binary, so sums depend on their order
+            path.write_text(''.join(
+                make_line(
+                    banner=rnd.randrange(300),
+                    time=rnd.random() * 10
+                )
+                for _ in range(3000)
+            ))
+            self.logs[source] = Log(path, date(2017, 6, 30))
+
+    def collect_partials(self):
+        partials = {}
+        for source, log in self.logs.items():
+            partial_path = self.dir / f'{source}.stat'
+            save_partial(
+                collect_partial(log, self.config, source), partial_path
+            )
+            partials[source] = load_partial(partial_path)
+        return partials
+
+    def test_merge(self):
+        partials = self.collect_partials()
+        expected = collect_stat(
+            line
+            for source in SOURCES
+            for line in read_log_bytes(self.logs[source])
+        )
+        expected_table = prepare_report_table(expected.urls_stat, None)
+        merges = [
+            merge_partials(partials[s] for s in order)
+            for order in permutations(SOURCES)
+        ] + [
+            merge_partials([
+                partials['front2'],
+                merge_partials([partials['front3'], partials['front1']])
+            ]),
+        ]
+        for merged in merges:
+            self.assertEqual(merged.sources, list(SOURCES))
+            self.assertEqual(
+                merged.aggregate.total_lines, expected.total_lines
+            )
+            self.assertEqual(
+                list(merged.aggregate.urls_stat), list(expected.urls_stat)
+            )
+            self.assertEqual(
+                prepare_report_table(merged.aggregate.urls_stat, None),
+                expected_table
+            )
+
+    def test_sketch_merge(self):
+        self.config = self.config._replace(aggregation='sketch')
+        partials = self.collect_partials()
+        expected = collect_stat(
+            line
+            for source in SOURCES
+            for line in read_log_bytes(self.logs[source])
+        )
+        merges = [
+            merge_partials(partials[s] for s in order)
+            for order in permutations(SOURCES)
+        ] + [
+            merge_partials([
+                partials['front2'],
+                merge_partials([partials['front3'], partials['front1']])
+            ]),
+        ]
+        for merged in merges:
+            for url, sketch in merged.aggregate.urls_stat.items():
+                # Sum of sketch is exact whatever order of merging is
+                self.assertEqual(
+                    sketch.total, math.fsum(expected.urls_stat[url])
+                )
+
+    def test_report(self):
+        partials = self.collect_partials()
+        saved, report_path = build_partial_report(
+            partials.values(), self.config
+        )
+        self.assertTrue(saved)
+        self.assertEqual(report_path.name, 'report-2017.06.30.html')
+        self.assertIn('/api/v2/banner/', report_path.read_text())
+
+    def test_invalid_merge(self):
+        partials = self.collect_partials()
+        with self.assertRaises(PartialError):
+            merge_partials([partials['front1'], partials['front1']])
+        other_day = partials['front2']._replace(day=date(2017, 7, 1))
+        with self.assertRaises(PartialError):
+            merge_partials([partials['front1'], other_day])
+        with self.assertRaises(PartialError):
+            collect_partial(
+                self.logs['front1'],
+                self.config._replace(aggregation='columnar'), 'front1'
+            )
+        broken_path = self.dir / 'broken.stat'
+        broken_path.write_bytes(b'broken')
+        with self.assertRaises(PartialError):
+            load_partial(broken_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
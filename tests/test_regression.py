@@ -0,0 +1,157 @@
+import json
+import random
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+from log_analyzer.report.fs import Log, get_report_path
+from log_analyzer.report.regression import (
+    REGRESSION_CACHE_NAME,
+    find_previous_reports,
+    find_regressions,
+    get_regressions_path,
+    load_report_table,
+)
+from log_analyzer.report.report import (
+    collect_stat,
+    prepare_report_table,
+    save_stat_report,
+)
+
+from helpers import TmpDirTestCase, make_line
+
+DAY = date(2017, 6, 30)
+
+
+class RegressionTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config = self.config._replace(report_dir=str(self.dir))
+        self.rnd = random.Random(0)
+
+    def make_lines(self, slow=None):
+        lines = []
+        for banner in range(10):
+            # Day-to-day noise of a few percent
+            scale = self.rnd.uniform(.95, 1.05)
+            if banner == slow:
+                scale *= 2
+            lines += [
+                make_line(banner=banner, time=(i % 7 + 1) / 10 * scale)
+                for i in range(50)
+            ]
+        return lines
+
+    def save_report(self, day, lines, config=None):
+        config = config or self.config
+        report_path = get_report_path(Log(None, day), config)
+        self.assertTrue(
+            save_stat_report(collect_stat(lines), report_path, config)
+        )
+        return report_path
+
+    def save_history(self, days, config=None):
+        for i in range(days, 0, -1):
+            self.save_report(DAY - timedelta(days=i), self.make_lines(), config)
+
+    def test_regressions(self):
+        self.save_history(10)
+        config = self.config._replace(regression_days=7)
+        with self.assertLogs('log_analyzer.report.regression') as logs:
+            report_path = self.save_report(DAY, self.make_lines(slow=3), config)
+        summary = json.loads(get_regressions_path(report_path).read_text())
+        self.assertEqual(len(summary['reports']), 7)
+        self.assertEqual(summary['reports'][0], 'report-2017.06.29.html')
+        self.assertEqual(
+            [(r['url'], r['column']) for r in summary['regressions']],
+            [
+                ('/api/v2/banner/3', column)
+                for column in ('time_med', 'time_avg', 'time_sum')
+            ]
+        )
+        regression = summary['regressions'][0]
+        self.assertAlmostEqual(regression['change'], 1, delta=.15)
+        self.assertEqual(regression['days'], 7)
+        self.assertIn('3 regressions', logs.output[0])
+        content = report_path.read_text()
+        self.assertIn('var regressions = [{"url": "/api/v2/banner/3"', content)
+
+    def test_no_regressions(self):
+        self.save_history(5)
+        config = self.config._replace(regression_days=30)
+        report_path = self.save_report(DAY, self.make_lines(), config)
+        summary = json.loads(get_regressions_path(report_path).read_text())
+        self.assertEqual(len(summary['reports']), 5)
+        self.assertEqual(summary['regressions'], [])
+        self.assertIn('var regressions = [];', report_path.read_text())
+
+    def test_few_days(self):
+        self.save_history(2)
+        table = [dict(
+            url='/api/v2/banner/3', time_med=100, time_avg=100, time_sum=100
+        )]
+        summary = find_regressions(
+            table, get_report_path(Log(None, DAY), self.config), 30
+        )
+        self.assertEqual(summary['regressions'], [])
+
+    def test_previous_reports(self):
+        for day in (DAY - timedelta(days=2), DAY, DAY + timedelta(days=1)):
+            self.save_report(day, self.make_lines())
+        self.save_report(
+            DAY - timedelta(days=1), self.make_lines(),
+            self.config._replace(report_gzip=True)
+        )
+        (self.dir / 'report-2017.06.28.metrics.json').write_text('{}')
+        report_path = get_report_path(Log(None, DAY), self.config)
+        self.assertEqual(
+            [path.name for path in find_previous_reports(report_path, 30)],
+            ['report-2017.06.29.html.gz', 'report-2017.06.28.html']
+        )
+        self.assertEqual(
+            [path.name for path in find_previous_reports(report_path, 1)],
+            ['report-2017.06.29.html.gz']
+        )
+
+    def test_load_report_table(self):
+        lines = self.make_lines()
+        table = prepare_report_table(collect_stat(lines).urls_stat, None)
+        for config in (
+            self.config._replace(report_gzip=True),
+            self.config._replace(report_shard_size=3),
+        ):
+            report_path = self.save_report(DAY, lines, config)
+            self.assertEqual(load_report_table(report_path), table)
+
+    def test_cache(self):
+        self.save_history(5)
+        table = prepare_report_table(
+            collect_stat(self.make_lines(slow=3)).urls_stat, None
+        )
+        report_path = get_report_path(Log(None, DAY), self.config)
+        summary = find_regressions(table, report_path, 30)
+        self.assertTrue((self.dir / REGRESSION_CACHE_NAME).is_file())
+        with mock.patch(
+            'log_analyzer.report.regression.load_report_table'
+        ) as load:
+            self.assertEqual(find_regressions(table, report_path, 30), summary)
+            load.assert_not_called()
+        # Changed report is parsed again
+        self.save_report(DAY - timedelta(days=1), self.make_lines(slow=3))
+        with mock.patch(
+            'log_analyzer.report.regression.load_report_table',
+            wraps=load_report_table
+        ) as load:
+            regressions = find_regressions(table, report_path, 30)[
+                'regressions'
+            ]
+            self.assertEqual(load.call_count, 1)
+        self.assertNotEqual(regressions, summary['regressions'])
+        self.assertEqual(
+            [r['url'] for r in regressions],
+            [r['url'] for r in summary['regressions']]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,14 @@
+import json
 import unittest
+from string import Template
 
+from log_analyzer.report.fs import get_report_template
 from log_analyzer.report.report import (
     URLStat,
     parse_line,
     prepare_stats,
     prepare_table,
+    render_table,
 )
 
 
@@ -57,6 +61,16 @@ class ReportGenerationTest(unittest.TestCase):
         self.assertEqual(result[1]['count_perc'], 3)
         self.assertEqual(result[2]['time_max'], 20)
 
+    def test_render_table(self):
+        table = prepare_table(
+            [('url1', [1, 2]), ('url2', [3])], 3, 6
+        )
+        expected = Template(get_report_template()).safe_substitute(
+            table_json=json.dumps(table), regressions_json='[]'
+        )
+        self.assertEqual(render_table(table), expected)
+        self.assertIn('[]', render_table([]))
+
 
 if __name__ == '__main__':
     unittest.main()
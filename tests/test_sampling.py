@@ -0,0 +1,205 @@
+import gzip
+import json
+import random
+import unittest
+from datetime import date
+
+from log_analyzer.report import prepare_config
+from log_analyzer.report.batch import build_log_report
+from log_analyzer.report.cache import get_cache_key
+from log_analyzer.report.columnar import np
+from log_analyzer.report.fs import Log
+from log_analyzer.report.report import collect_stat, prepare_report_table
+from log_analyzer.report.sampling import sample_lines
+
+from helpers import TmpDirTestCase, make_line
+
+
+def make_lines(count, seed=0):
+    rnd = random.Random(seed)
+    return [
+        make_line(
+            banner=rnd.randrange(20), request_id=i,
+            time=round(rnd.expovariate(5), 3)
+        ).encode()
+        for i in range(count)
+    ]
+
+
+class SampleLinesTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = make_lines(20000)
+        self.config = prepare_config()._replace(sample_rate=.1)
+
+    def test_deterministic(self):
+        sampled = list(sample_lines(self.lines, self.config))
+        self.assertEqual(list(sample_lines(self.lines, self.config)), sampled)
+        # Line is kept whatever lines are around it
+        self.assertEqual(
+            list(sample_lines(self.lines[:1000], self.config))
+            + list(sample_lines(self.lines[1000:], self.config)),
+            sampled
+        )
+        self.assertEqual(
+            list(sample_lines(
+                [line.decode() for line in self.lines], self.config
+            )),
+            [line.decode() for line in sampled]
+        )
+        other = list(sample_lines(
+            self.lines, self.config._replace(sample_seed=1)
+        ))
+        self.assertNotEqual(other, sampled)
+
+    def test_rate(self):
+        self.assertEqual(
+            list(sample_lines(self.lines, prepare_config())), self.lines
+        )
+        for rate in (.01, .1, .5):
+            config = self.config._replace(sample_rate=rate)
+            kept = len(list(sample_lines(self.lines, config)))
+            self.assertAlmostEqual(kept / len(self.lines), rate, delta=.01)
+        config = self.config._replace(sample_rate=1)
+        self.assertEqual(list(sample_lines(self.lines, config)), self.lines)
+
+
+class ScaleStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = make_lines(50000)
+        self.full = {
+            row['url']: row for row in prepare_report_table(
+                collect_stat(self.lines).urls_stat, None
+            )
+        }
+
+    def get_table(self, aggregation, sample_rate=.1, sample_seed=0):
+        config = prepare_config()._replace(
+            sample_rate=sample_rate, sample_seed=sample_seed
+        )
+        aggregate = collect_stat(
+            sample_lines(self.lines, config), aggregation=aggregation
+        )
+        return prepare_report_table(aggregate.urls_stat, None, sample_rate)
+
+    def test_estimates_within_intervals(self):
+        covered = 0
+        rows = 0
+        for seed in range(5):
+            for row in self.get_table('exact', sample_seed=seed):
+                full = self.full[row['url']]
+                rows += 3
+                covered += abs(row['count'] - full['count']) <= row['count_ci']
+                covered += (
+                    abs(row['time_sum'] - full['time_sum'])
+                    <= row['time_sum_ci']
+                )
+                covered += (
+                    abs(row['time_avg'] - full['time_avg'])
+                    <= row['time_avg_ci']
+                )
+        # 95% intervals
+        self.assertGreater(covered / rows, .85)
+
+    def test_full_rate(self):
+        for row in self.get_table('exact', sample_rate=1):
+            full = self.full[row['url']]
+            self.assertEqual(row['count'], full['count'])
+            self.assertAlmostEqual(row['time_sum'], full['time_sum'])
+            self.assertEqual(row['count_ci'], 0)
+            self.assertEqual(row['time_sum_ci'], 0)
+
+    def test_sketch_intervals(self):
+        exact = self.get_table('exact')
+        sketch = self.get_table('sketch')
+        self.assertEqual(
+            [row['count'] for row in sketch], [row['count'] for row in exact]
+        )
+        for sketch_row, exact_row in zip(sketch, exact):
+            self.assertEqual(sketch_row['count_ci'], exact_row['count_ci'])
+            self.assertAlmostEqual(
+                sketch_row['time_sum_ci'] / exact_row['time_sum_ci'], 1,
+                delta=.02
+            )
+
+    @unittest.skipIf(np is None, 'NumPy is not installed')
+    def test_columnar_intervals(self):
+        exact = self.get_table('exact')
+        columnar = self.get_table('columnar')
+        for columnar_row, exact_row in zip(columnar, exact):
+            self.assertEqual(columnar_row['url'], exact_row['url'])
+            for name in ('count', 'count_ci', 'time_sum', 'time_sum_ci'):
+                self.assertAlmostEqual(columnar_row[name], exact_row[name])
+
+
+class SampledReportTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = Log(self.dir / 'nginx-access-ui.log-20170630', date.today())
+        self.log.path.write_bytes(b''.join(make_lines(20000)))
+        self.config = self.config._replace(
+            report_dir=str(self.dir), sample_rate=.2, sample_seed=3,
+            aggregate_cache=False, manifest=False, metrics=False
+        )
+
+    def build_table(self, log, config, name):
+        report_path = self.dir / name
+        self.assertTrue(build_log_report(log, report_path, config))
+        content = report_path.read_text()
+        start = content.index('var table = ') + len('var table = ')
+        return json.loads(content[start:content.index(';\n', start)])
+
+    def test_same_report_of_every_reader(self):
+        table = self.build_table(self.log, self.config, 'report.html')
+        self.assertEqual(len(table), 20)
+        self.assertIn('count_ci', table[0])
+        self.assertAlmostEqual(
+            sum(row['count'] for row in table), 20000, delta=1000
+        )
+        configs = [
+            self.config._replace(mmap_read=False),
+            self.config._replace(workers=2),
+            self.config._replace(aggregate_cache=True),
+            self.config._replace(aggregate_cache=True),
+            self.config._replace(checkpoint_interval=0),
+        ]
+        for i, config in enumerate(configs):
+            with self.subTest(config=config):
+                self.assertEqual(
+                    self.build_table(self.log, config, f'report-{i}.html'),
+                    table
+                )
+        gz_log = Log(self.dir / 'nginx-access-ui.log-20170630.gz', date.today())
+        with gzip.open(gz_log.path, 'wb') as f:
+            f.write(self.log.path.read_bytes())
+        for config in (self.config, self.config._replace(gzip_index=True)):
+            self.assertEqual(
+                self.build_table(gz_log, config, 'report-gz.html'), table
+            )
+
+    def test_error_rate(self):
+        with open(self.log.path, 'a') as f:
+            for i in range(5000):
+                f.write(f'WRONG FMT {i}\n')
+        config = self.config._replace(max_error_rate=.1)
+        for early_abort in (True, False):
+            self.assertFalse(build_log_report(
+                self.log, self.dir / 'report.html',
+                config._replace(early_abort=early_abort)
+            ))
+        self.assertTrue(build_log_report(
+            self.log, self.dir / 'report.html',
+            config._replace(max_error_rate=.3)
+        ))
+
+    def test_cache_key(self):
+        key = get_cache_key(self.log, self.config)
+        self.assertNotEqual(
+            get_cache_key(self.log, self.config._replace(sample_seed=4)), key
+        )
+        self.assertNotIn(
+            'sample', get_cache_key(self.log, prepare_config())
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import unittest
+from pathlib import Path
+
+from log_analyzer.report.fs import TEMPLATE_INCLUDES, get_report_template
+from log_analyzer.report.report import prepare_table
+from log_analyzer.report.shards import (
+    SHARD_INDEXES,
+    get_shards_dir,
+    save_sharded_report,
+)
+
+from helpers import TmpDirTestCase
+
+
+def load_script(path: Path, callback: str) -> list:
+    content = path.read_text('utf-8').strip()
+    prefix = f'{callback}('
+    assert content.startswith(prefix) and content.endswith(');')
+    return json.loads(f'[{content[len(prefix):-2]}]')
+
+
+class ShardedReportTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.report_path = self.dir / 'report-2017.06.30.html'
+        raw_table = sorted(
+            (
+                (f'/url/{i}', [(i * 7) % 11 + j / 10 for j in range(i % 5 + 1)])
+                for i in range(25)
+            ),
+            key=lambda x: sum(x[1]),
+            reverse=True
+        )
+        self.table = prepare_table(raw_table, 100, 1000)
+
+    def test_shards_dir(self):
+        self.assertEqual(
+            get_shards_dir(self.report_path), self.dir / 'report-2017.06.30'
+        )
+        self.assertEqual(
+            get_shards_dir(self.dir / 'report-2017.06.30.html.gz'),
+            self.dir / 'report-2017.06.30'
+        )
+
+    def test_sharded_report(self):
+        save_sharded_report(self.table, self.report_path, 10)
+        shards_dir = get_shards_dir(self.report_path)
+        self.assertIn('"report-2017.06.30"', self.report_path.read_text())
+        self.assertNotIn('$shards_dir', self.report_path.read_text())
+        # Style and script are shared with the single page report
+        for placeholder, name in TEMPLATE_INCLUDES.items():
+            self.assertNotIn(placeholder, self.report_path.read_text())
+            self.assertIn(
+                get_report_template(name).strip(),
+                self.report_path.read_text()
+            )
+            self.assertIn(
+                get_report_template(name).strip(), get_report_template()
+            )
+
+        manifest, = load_script(shards_dir / 'manifest.js', 'reportManifest')
+        self.assertEqual(manifest['rows'], 25)
+        self.assertEqual(manifest['columns'], list(self.table[0]))
+        self.assertEqual(set(manifest['indexes']), set(SHARD_INDEXES))
+        for index in SHARD_INDEXES:
+            rows = []
+            bounds = manifest['indexes'][index]
+            self.assertEqual(len(bounds), 3)
+            for number, (first, last) in enumerate(bounds):
+                shard_index, shard_number, shard = load_script(
+                    shards_dir / f'{index}-{number}.js', 'reportShard'
+                )
+                self.assertEqual((shard_index, shard_number), (index, number))
+                self.assertEqual(
+                    (shard[0][index], shard[-1][index]), (first, last)
+                )
+                rows.extend(shard)
+            self.assertEqual(
+                rows,
+                sorted(self.table, key=lambda r: r[index], reverse=True)
+            )
+        self.assertEqual(
+            sorted(path.name for path in self.dir.iterdir()),
+            [shards_dir.name, self.report_path.name]
+        )
+
+    def test_replace_shards(self):
+        save_sharded_report(self.table, self.report_path, 10)
+        save_sharded_report(self.table[:5], self.report_path, 10)
+        shards_dir = get_shards_dir(self.report_path)
+        self.assertEqual(
+            sorted(path.name for path in shards_dir.iterdir()),
+            ['count-0.js', 'manifest.js', 'time_avg-0.js', 'time_med-0.js',
+             'time_sum-0.js']
+        )
+        self.assertEqual(
+            sorted(path.name for path in self.dir.iterdir()),
+            [shards_dir.name, self.report_path.name]
+        )
+
+    def test_empty_table(self):
+        save_sharded_report([], self.report_path, 10)
+        manifest, = load_script(
+            get_shards_dir(self.report_path) / 'manifest.js', 'reportManifest'
+        )
+        self.assertEqual(manifest['rows'], 0)
+        self.assertEqual(manifest['indexes']['count'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import random
+import unittest
+
+from log_analyzer.report.report import get_percentile, prepare_stats
+from log_analyzer.report.sketch import SKETCH_ACCURACY, TimeSketch
+
+
+def make_sketch(times: list[float]) -> TimeSketch:
+    sketch = TimeSketch()
+    for t in times:
+        sketch.append(t)
+    return sketch
+
+
+class TimeSketchTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        self.times = [
+            round(rnd.lognormvariate(-1, 1.5), 3)
+            for _ in range(10000)
+        ]
+
+    def test_quantiles_within_accuracy(self):
+        sketch = make_sketch(self.times)
+        sorted_times = sorted(self.times)
+        for q in (.1, .5, .9, .95, .99):
+            exact = sorted_times[int(q * (len(sorted_times) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - exact),
+                SKETCH_ACCURACY * exact + 1e-12
+            )
+
+    def test_exact_counters(self):
+        sketch = make_sketch(self.times)
+        self.assertEqual(len(sketch), len(self.times))
+        self.assertAlmostEqual(sketch.total, sum(self.times))
+        self.assertEqual(sketch.max, max(self.times))
+        self.assertEqual(sketch.quantile(1), max(self.times))
+
+    def test_merge(self):
+        whole = make_sketch(self.times)
+        merged = make_sketch(self.times[:3000])
+        merged.extend(make_sketch(self.times[3000:]))
+        self.assertEqual(merged.count, whole.count)
+        self.assertEqual(merged.zeros, whole.zeros)
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assertEqual(merged.quantile(.5), whole.quantile(.5))
+
+    def test_stats_generation(self):
+        stats = prepare_stats(make_sketch([0, 1, 2, 3, 4]), 10, 20)
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['count_perc'], 50)
+        self.assertEqual(stats['time_sum'], 10)
+        self.assertEqual(stats['time_avg'], 2)
+        self.assertEqual(stats['time_max'], 4)
+        self.assertAlmostEqual(stats['time_med'], 2, delta=2 * SKETCH_ACCURACY)
+        self.assertIn('time_p99', stats)
+
+    def test_exact_percentile(self):
+        self.assertEqual(get_percentile([1, 2, 3, 4, 5], .9), 4.6)
+        self.assertEqual(get_percentile([7], .99), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
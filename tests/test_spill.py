@@ -0,0 +1,126 @@
+import math
+import random
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+from log_analyzer.report import prepare_config
+from log_analyzer.report.batch import build_log_report
+from log_analyzer.report.fs import Log
+from log_analyzer.report.report import (
+    ReducedStat,
+    SpilledStat,
+    collect_stat,
+    prepare_report_table,
+)
+from log_analyzer.report.spill import (
+    SpillPartitions,
+    _add_exact,
+    collect_stat_spilled,
+    merge_partitions,
+)
+
+from helpers import make_line
+
+
+class SpillTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        # Many unique urls with equal totals and a few heavy ones
+        self.lines = []
+        for i in range(30000):
+            if i % 3:
+                banner = rnd.randrange(20000)
+                time = .5
+            else:
+                banner = f'heavy{rnd.randrange(50)}'
+                time = rnd.randrange(1, 1000) / 1000
+            self.lines.append(make_line(banner=banner, time=time))
+        self.lines[10] = 'WRONG FMT\n'
+        self.config = prepare_config()._replace(
+            report_size=100, memory_limit_mb=1
+        )
+
+    def assertSameTable(self, aggregate, spilled, report_size):
+        self.assertIsInstance(spilled.urls_stat, SpilledStat)
+        self.assertEqual(spilled.total_lines, aggregate.total_lines)
+        self.assertEqual(spilled.error_lines, aggregate.error_lines)
+        self.assertEqual(
+            prepare_report_table(spilled.urls_stat, report_size),
+            prepare_report_table(aggregate.urls_stat, report_size)
+        )
+
+    def test_same_table_as_in_memory(self):
+        aggregate = collect_stat(self.lines)
+        spilled = collect_stat_spilled(self.lines, self.config, 100)
+        self.assertEqual(len(spilled.urls_stat), 100)
+        self.assertSameTable(aggregate, spilled, 100)
+        # Kept urls take fixed memory
+        for stats in spilled.urls_stat.values():
+            self.assertIsInstance(stats, ReducedStat)
+
+    def test_split_large_partitions(self):
+        aggregate = collect_stat(self.lines)
+        with mock.patch('log_analyzer.report.spill.SPILL_EXPANSION', 1000):
+            spilled = collect_stat_spilled(self.lines, self.config, None)
+        self.assertEqual(len(spilled.urls_stat), len(aggregate.urls_stat))
+        self.assertSameTable(aggregate, spilled, None)
+
+    def test_sorted_partitions(self):
+        # Partitions over the limit at the max depth are sorted externally
+        # instead of being loaded
+        aggregate = collect_stat(self.lines)
+        for keep_urls in (100, None):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                spill = SpillPartitions(Path(tmp_dir), 'spill', 'exact')
+                for i in range(0, len(self.lines), 3000):
+                    spill.write(
+                        collect_stat(self.lines[i:i + 3000]).urls_stat
+                    )
+                spill.close()
+                with (
+                    mock.patch('log_analyzer.report.spill.MAX_SPILL_DEPTH', 0),
+                    mock.patch('log_analyzer.report.spill.RUN_READ_RECORDS', 7),
+                    self.assertLogs('log_analyzer.report.spill')
+                ):
+                    urls_stat = merge_partitions(spill, 1 << 12, keep_urls)
+                self.assertEqual(list(Path(tmp_dir).iterdir()), [])
+            self.assertEqual(
+                prepare_report_table(urls_stat, keep_urls),
+                prepare_report_table(aggregate.urls_stat, keep_urls)
+            )
+
+    def test_fits_memory(self):
+        config = self.config._replace(memory_limit_mb=100)
+        aggregate = collect_stat_spilled(self.lines, config, 100)
+        self.assertNotIsInstance(aggregate.urls_stat, SpilledStat)
+        self.assertEqual(aggregate, collect_stat(self.lines))
+
+    def test_unsupported_aggregation(self):
+        config = self.config._replace(aggregation='columnar')
+        with self.assertRaises(ValueError):
+            collect_stat_spilled(self.lines, config, 100)
+
+    def test_exact_sum(self):
+        rnd = random.Random(0)
+        values = [rnd.uniform(-1e10, 1e10) * rnd.random() for _ in range(1000)]
+        partials = []
+        for value in values:
+            _add_exact(partials, value)
+        self.assertEqual(math.fsum(partials), math.fsum(values))
+
+    def test_spilled_not_cached(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            log = Log(tmp_dir / 'nginx-access-ui.log-20170630', date.today())
+            log.path.write_text(''.join(self.lines))
+            report_path = tmp_dir / 'report-2017.06.30.html'
+            self.assertTrue(build_log_report(log, report_path, self.config))
+            self.assertTrue(report_path.is_file())
+            self.assertFalse(report_path.with_suffix('.stat').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import io
+import unittest
+from datetime import date
+from unittest import mock
+
+from log_analyzer.report import build_log_report
+from log_analyzer.report.cache import get_cache_path, load_cached_stat
+from log_analyzer.report.columnar import np
+from log_analyzer.report.fs import Log
+from log_analyzer.report.report import (
+    SpilledStat,
+    collect_stat,
+    prepare_report_table,
+    reduce_urls_stat,
+)
+from log_analyzer.report.storage import (
+    StorageError,
+    dump_aggregate,
+    load_aggregate,
+)
+
+from helpers import TmpDirTestCase, make_line
+
+LINES = [
+    make_line(banner=i % 11, time=(i % 7) / 3)
+    for i in range(300)
+] + ['WRONG FMT\n']
+
+
+def dump(aggregate, meta=None) -> bytes:
+    f = io.BytesIO()
+    dump_aggregate(aggregate, f, meta)
+    return f.getvalue()
+
+
+class StorageTest(unittest.TestCase):
+    def test_exact_round_trip(self):
+        aggregate = collect_stat(LINES)
+        loaded, meta = load_aggregate(io.BytesIO(dump(aggregate, {'a': 1})))
+        self.assertEqual(meta, {'a': 1})
+        self.assertEqual(loaded.total_lines, 301)
+        self.assertEqual(loaded.error_lines, 1)
+        self.assertEqual(dict(loaded.urls_stat), dict(aggregate.urls_stat))
+        self.assertEqual(list(loaded.urls_stat), list(aggregate.urls_stat))
+
+    def test_binary_urls_round_trip(self):
+        aggregate = collect_stat(line.encode() for line in LINES)
+        loaded, _ = load_aggregate(io.BytesIO(dump(aggregate)))
+        self.assertEqual(dict(loaded.urls_stat), dict(aggregate.urls_stat))
+        self.assertIsInstance(next(iter(loaded.urls_stat)), bytes)
+
+    def test_sketch_round_trip(self):
+        aggregate = collect_stat(LINES, aggregation='sketch')
+        loaded, _ = load_aggregate(io.BytesIO(dump(aggregate)))
+        for url, sketch in aggregate.urls_stat.items():
+            loaded_sketch = loaded.urls_stat[url]
+            self.assertEqual(loaded_sketch.count, sketch.count)
+            self.assertEqual(loaded_sketch.total, sketch.total)
+            self.assertEqual(loaded_sketch.buckets, sketch.buckets)
+            self.assertEqual(loaded_sketch.quantile(.5), sketch.quantile(.5))
+
+    @unittest.skipIf(np is None, 'NumPy is not installed')
+    def test_columnar_round_trip(self):
+        aggregate = collect_stat(LINES, aggregation='columnar')
+        loaded, _ = load_aggregate(io.BytesIO(dump(aggregate)))
+        self.assertEqual(list(loaded.urls_stat), list(aggregate.urls_stat))
+        self.assertEqual(loaded.urls_stat.ids, aggregate.urls_stat.ids)
+        self.assertEqual(loaded.urls_stat.times, aggregate.urls_stat.times)
+
+    def test_reduced_round_trip(self):
+        aggregate = collect_stat(LINES)
+        reduced = aggregate._replace(
+            urls_stat=reduce_urls_stat(aggregate.urls_stat)
+        )
+        loaded, _ = load_aggregate(io.BytesIO(dump(reduced)))
+        self.assertIsInstance(loaded.urls_stat, SpilledStat)
+        self.assertEqual(list(loaded.urls_stat), list(aggregate.urls_stat))
+        self.assertEqual(dict(loaded.urls_stat), dict(reduced.urls_stat))
+        self.assertEqual(
+            prepare_report_table(loaded.urls_stat, None),
+            prepare_report_table(aggregate.urls_stat, None)
+        )
+        empty, _ = load_aggregate(io.BytesIO(dump(
+            collect_stat([])._replace(urls_stat=reduce_urls_stat({}))
+        )))
+        self.assertEqual(empty.urls_stat, {})
+        self.assertEqual(empty.urls_stat.total_requests, 0)
+
+    def test_corrupt(self):
+        data = dump(collect_stat(LINES))
+        for broken in (b'', data[:-1], data[:50] + b'X' + data[51:]):
+            with self.assertRaises(StorageError):
+                load_aggregate(io.BytesIO(broken))
+
+
+class AggregateCacheTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = Log(self.dir / 'nginx-access-ui.log-20170630', date.today())
+        self.log.path.write_text(''.join(LINES))
+        self.report_path = self.dir / 'report-2017.06.30.html'
+        self.cache_path = get_cache_path(self.report_path)
+
+    def test_rebuild_from_cache(self):
+        self.assertTrue(
+            build_log_report(self.log, self.report_path, self.config)
+        )
+        self.assertTrue(self.cache_path.is_file())
+        # Statistics of urls are cached instead of request times
+        self.assertIsInstance(
+            load_cached_stat(self.log, self.cache_path, self.config)
+            .urls_stat, SpilledStat
+        )
+        content = self.report_path.read_bytes()
+        self.report_path.unlink()
+        with mock.patch(
+            'log_analyzer.report.batch.collect_log_stat'
+        ) as collect_log_stat:
+            self.assertTrue(
+                build_log_report(self.log, self.report_path, self.config)
+            )
+            self.assertEqual(self.report_path.read_bytes(), content)
+            config = self.config._replace(report_size=3)
+            self.assertTrue(
+                build_log_report(self.log, self.report_path, config)
+            )
+            self.assertNotEqual(self.report_path.read_bytes(), content)
+        collect_log_stat.assert_not_called()
+
+    def test_stale_cache(self):
+        build_log_report(self.log, self.report_path, self.config)
+        self.log.path.write_text(''.join(LINES[:10]))
+        self.assertIsNone(
+            load_cached_stat(self.log, self.cache_path, self.config)
+        )
+        config = self.config._replace(aggregation='sketch')
+        self.assertIsNone(load_cached_stat(self.log, self.cache_path, config))
+
+    def test_broken_cache(self):
+        build_log_report(self.log, self.report_path, self.config)
+        self.cache_path.write_bytes(b'garbage')
+        self.assertIsNone(
+            load_cached_stat(self.log, self.cache_path, self.config)
+        )
+        self.report_path.unlink()
+        build_log_report(self.log, self.report_path, self.config)
+        self.assertIsNotNone(
+            load_cached_stat(self.log, self.cache_path, self.config)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
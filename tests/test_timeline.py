@@ -0,0 +1,167 @@
+import calendar
+import json
+import random
+import unittest
+from datetime import date, datetime, timedelta
+
+from log_analyzer.report.batch import build_log_report
+from log_analyzer.report.fs import Log
+from log_analyzer.report.report import collect_stat, scan_stat
+from log_analyzer.report.timeline import (
+    Timeline,
+    get_bin_bound,
+    get_bin_quantile,
+)
+
+from helpers import TmpDirTestCase
+from helpers import make_line as make_log_line
+
+DAY = datetime(2017, 6, 29)
+
+
+def make_line(banner, seconds, request_time):
+    time_local = (DAY + timedelta(seconds=seconds)).strftime(
+        '%d/%b/%Y:%H:%M:%S'
+    )
+    return make_log_line(
+        banner=banner, time=request_time, time_local=time_local
+    )
+
+
+class TimelineTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        self.lines = []
+        # A request a second, 10 minute spike of latency at 12:00
+        for second in range(0, 86400, 10):
+            spike = 12 * 3600 <= second < 12 * 3600 + 600
+            request_time = rnd.uniform(2, 3) if spike else rnd.uniform(.1, .2)
+            self.lines.append(
+                make_line('spiky', second, f'{request_time:.3f}')
+            )
+            self.lines.append(make_line(rnd.randrange(3), second, '.05'))
+
+    def test_spike(self):
+        timeline = Timeline(300, 10)
+        aggregate = collect_stat(self.lines, timeline=timeline)
+        row = timeline.get_row('/api/v2/banner/spiky')
+        self.assertEqual(row['step'], 300)
+        # Local time of log
+        self.assertEqual(row['start'], calendar.timegm(DAY.timetuple()))
+        self.assertEqual(len(row['p95']), 288)
+        self.assertEqual(sum(row['count']), 8640)
+        self.assertEqual(
+            sum(sum(row['count']) for row in map(
+                timeline.get_row, timeline.histograms
+            )),
+            aggregate.total_lines
+        )
+        spike = [i for i, value in enumerate(row['p95']) if value > 1]
+        self.assertEqual(spike, [144, 145])
+        self.assertTrue(all(value < .3 for value in row['p95'][:144]))
+
+    def test_scan_same_as_lines(self):
+        lines_timeline = Timeline(60, 10)
+        collect_stat(
+            (line.encode().rstrip(b'\n') for line in self.lines),
+            timeline=lines_timeline
+        )
+        scan_timeline = Timeline(60, 10)
+        scan_stat([''.join(self.lines).encode()], timeline=scan_timeline)
+        url = b'/api/v2/banner/spiky'
+        self.assertEqual(
+            scan_timeline.get_row(url), lines_timeline.get_row(url)
+        )
+
+    def test_memory_is_bounded(self):
+        rnd = random.Random(1)
+        lines = []
+        for second in range(0, 43200, 3):
+            lines.append(make_line(rnd.randrange(1000), second, '.1'))
+            if second % 600 == 0:
+                lines.append(make_line('late', second, '.001'))
+        # Url growing into the top in the afternoon
+        lines += [
+            make_line('late', second, '5')
+            for second in range(43200, 86400, 60)
+        ]
+        timeline = Timeline(300, 5)
+        tracked = 0
+        for line in lines:
+            collect_stat([line], timeline=timeline)
+            tracked = max(tracked, len(timeline.histograms))
+        self.assertLessEqual(tracked, 10)
+        row = timeline.get_row('/api/v2/banner/late')
+        self.assertIsNotNone(row)
+        self.assertTrue(all(count is None for count in row['count'][:144]))
+        self.assertEqual(sum(filter(None, row['count'])), 720)
+
+    def test_totals_are_bounded(self):
+        timeline = Timeline(300, 5)
+        counted = 0
+        for i in range(20000):
+            timeline.add(f'/unique/{i}', '29/Jun/2017:03:50:22', .1)
+            if i % 10 == 0:
+                timeline.add('/heavy', '29/Jun/2017:03:50:22', 1)
+            counted = max(counted, len(timeline.totals))
+        self.assertLessEqual(counted, 20)
+        self.assertLessEqual(len(timeline.histograms), 10)
+        self.assertEqual(sum(timeline.get_row('/heavy')['count']), 2000)
+        self.assertAlmostEqual(timeline.totals['/heavy'], 2000)
+
+    def test_bins(self):
+        timeline = Timeline(60, 1)
+        for request_time in (0, .0005, .001, .1, .7, 1, 100):
+            timeline.add('/', '29/Jun/2017:03:50:22', request_time)
+        counts = timeline.histograms['/'][timeline.first]
+        self.assertEqual(sum(counts), 7)
+        self.assertEqual(counts[0], 2)
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(get_bin_quantile(counts, 0), get_bin_bound(0))
+        self.assertGreaterEqual(get_bin_quantile(counts, .5), .1)
+        self.assertLess(get_bin_quantile(counts, .5), .1 * 2 ** .5)
+        self.assertGreater(get_bin_quantile(counts, 1), 30)
+
+    def test_format_without_local_time(self):
+        with self.assertRaises(ValueError):
+            collect_stat(
+                ['0.5 /api\n'], '$request_time $request_uri',
+                timeline=Timeline(60, 1)
+            )
+
+
+class TimelineReportTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = Log(self.dir / 'nginx-access-ui.log-20170629', date.today())
+        with open(self.log.path, 'w') as f:
+            for second in range(0, 3600, 5):
+                f.write(make_line(second % 7, second, second / 3600))
+        self.config = self.config._replace(
+            report_dir=str(self.dir), timeline_bucket_min=5, timeline_size=4
+        )
+
+    def load_table(self, report_path):
+        content = report_path.read_text()
+        start = content.index('var table = ') + len('var table = ')
+        return json.loads(content[start:content.index(';\n', start)])
+
+    def test_report_has_timeline(self):
+        for mmap_read in (True, False):
+            report_path = self.dir / f'report-{mmap_read}.html'
+            config = self.config._replace(mmap_read=mmap_read)
+            self.assertTrue(build_log_report(self.log, report_path, config))
+            table = self.load_table(report_path)
+            self.assertEqual(len(table), 7)
+            timelines = [row['timeline'] for row in table]
+            # All urls fit, they are tracked from the start
+            for timeline in timelines:
+                self.assertEqual(len(timeline['count']), 12)
+                self.assertNotIn(None, timeline['count'])
+            self.assertEqual(
+                sum(sum(timeline['count']) for timeline in timelines), 720
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import gzip
+import unittest
+from datetime import date
+from unittest import mock
+
+from log_analyzer.report.batch import build_log_report, collect_log_stat
+from log_analyzer.report.fs import Log, read_log_bytes, sample_log
+from log_analyzer.report.report import collect_stat
+from log_analyzer.report.validate import (
+    MONITOR_LINES,
+    TooManyErrors,
+    check_log_sample,
+    get_abort_error_lines,
+    get_abort_error_rate,
+    is_error_rate_exceeded,
+)
+
+from helpers import TmpDirTestCase, make_line
+
+
+class ValidateTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config = self.config._replace(
+            aggregate_cache=False, metrics=False
+        )
+
+    def write_log(
+        self, name, lines, bad_every=None, bad_from=None, bad_until=None
+    ):
+        path = self.dir / name
+        opener = gzip.open if path.suffix == '.gz' else open
+        with opener(path, 'wt') as f:
+            for i in range(lines):
+                bad = (
+                    (bad_every is not None and i % bad_every == 0)
+                    or (bad_from is not None and i >= bad_from)
+                    or (bad_until is not None and i < bad_until)
+                )
+                if bad:
+                    f.write(f'WRONG FMT {i}\n')
+                else:
+                    f.write(make_line(banner=i % 37, time=(i % 13) / 7))
+        return Log(path, date.today())
+
+    def test_error_rate_bound(self):
+        self.assertFalse(is_error_rate_exceeded(0, 0, .05))
+        self.assertFalse(is_error_rate_exceeded(1, 10, .05))
+        # A few broken lines next to each other are not enough
+        self.assertFalse(is_error_rate_exceeded(10, 100, .05))
+        self.assertTrue(is_error_rate_exceeded(100, 100, .05))
+        self.assertTrue(is_error_rate_exceeded(2000, 10000, .05))
+        self.assertFalse(is_error_rate_exceeded(520, 10000, .05))
+
+    def test_sample_log(self):
+        log = self.write_log('nginx-access-ui.log-20170630', 5000)
+        lines = log.path.read_bytes().splitlines()
+        sample = sample_log(log, points=10, point_lines=3)
+        self.assertEqual(len(sample), 30)
+        self.assertTrue(set(sample) <= set(lines))
+        self.assertEqual(sample[:3], lines[:3])
+        self.assertIn(sample[-1], lines[4000:])
+
+        short_log = self.write_log('nginx-access-ui.log-20170629', 20)
+        sample = sample_log(short_log, points=10, point_lines=3)
+        self.assertEqual(sample, short_log.path.read_bytes().splitlines())
+
+    def test_sample_rejected(self):
+        log = self.write_log(
+            'nginx-access-ui.log-20170630', 5000, bad_every=2
+        )
+        with self.assertRaises(TooManyErrors) as cm:
+            check_log_sample(log, self.config)
+        self.assertGreater(cm.exception.error_lines, 0)
+        report_path = self.dir / 'report-2017.06.30.html'
+        self.assertFalse(build_log_report(log, report_path, self.config))
+        self.assertFalse(report_path.exists())
+
+    def test_monitor_aborts_parsing(self):
+        lines = MONITOR_LINES * 4
+        log = self.write_log(
+            'nginx-access-ui.log-20170630.gz', lines, bad_from=MONITOR_LINES
+        )
+        # The first lines of gzip log are sampled, they are valid
+        check_log_sample(log, self.config)
+        with self.assertRaises(TooManyErrors) as cm:
+            collect_log_stat(log, self.config)
+        self.assertLess(cm.exception.total_lines, lines)
+
+        config = self.config._replace(early_abort=False)
+        aggregate = collect_log_stat(log, config)
+        self.assertEqual(aggregate.total_lines, lines)
+        self.assertFalse(
+            build_log_report(log, self.dir / 'report.html', config)
+        )
+
+    @mock.patch(
+        'log_analyzer.report.validate.get_uncompressed_size',
+        return_value=None
+    )
+    def test_unknown_size(self, _):
+        # Size of large gzip log is unknown, lines parsed so far are checked
+        lines = MONITOR_LINES * 4
+        log = self.write_log(
+            'nginx-access-ui.log-20170630.gz', lines, bad_from=MONITOR_LINES
+        )
+        self.assertIsNone(get_abort_error_lines(log, self.config))
+        self.assertEqual(
+            get_abort_error_rate(log, self.config), self.config.max_error_rate
+        )
+        check_log_sample(log, self.config)
+        configs = [
+            self.config,
+            self.config._replace(checkpoint_interval=0),
+            self.config._replace(workers=2, gzip_index=True),
+            self.config._replace(memory_limit_mb=64),
+        ]
+        for config in configs:
+            with self.subTest(config=config):
+                with self.assertRaises(TooManyErrors) as cm:
+                    collect_log_stat(log, config)
+                self.assertLess(cm.exception.total_lines, lines)
+
+        broken_log = self.write_log(
+            'nginx-access-ui.log-20170629.gz', lines, bad_every=1
+        )
+        with self.assertRaises(TooManyErrors):
+            check_log_sample(broken_log, self.config)
+
+    def test_valid_log_with_errors(self):
+        log = self.write_log(
+            'nginx-access-ui.log-20170630', MONITOR_LINES * 2, bad_every=50
+        )
+        aggregate = collect_stat(
+            read_log_bytes(log),
+            max_error_lines=get_abort_error_lines(log, self.config)
+        )
+        self.assertEqual(aggregate.total_lines, MONITOR_LINES * 2)
+        report_path = self.dir / 'report-2017.06.30.html'
+        self.assertTrue(build_log_report(log, report_path, self.config))
+        self.assertTrue(report_path.exists())
+
+    def test_error_burst(self):
+        # Broken lines at the start of the log are over the limit of lines
+        # parsed so far, but error rate of the whole log is under it
+        lines = 41700
+        for name in (
+            'nginx-access-ui.log-20170630', 'nginx-access-ui.log-20170630.gz'
+        ):
+            log = self.write_log(name, lines, bad_until=1700)
+            configs = [
+                self.config,
+                self.config._replace(mmap_read=False),
+                self.config._replace(workers=2, gzip_index=True),
+            ]
+            for i, config in enumerate(configs):
+                with self.subTest(name=name, config=config):
+                    aggregate = collect_log_stat(log, config)
+                    self.assertEqual(aggregate.total_lines, lines)
+                    self.assertEqual(aggregate.error_lines, 1700)
+                    report_path = self.dir / f'report-{i}.html'
+                    self.assertTrue(
+                        build_log_report(log, report_path, config)
+                    )
+
+    def test_empty_log(self):
+        log = self.write_log('nginx-access-ui.log-20170630', 0)
+        report_path = self.dir / 'report-2017.06.30.html'
+        self.assertTrue(build_log_report(log, report_path, self.config))
+        self.assertTrue(report_path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+import unittest
+from copy import copy
+from pathlib import Path
+from unittest import mock
+
+from log_analyzer.report import LogWatcher
+from log_analyzer.report.batch import build_log_report
+from log_analyzer.report.fs import iter_logs
+from log_analyzer.report.watch import WatchedDir, get_watch_configs
+
+from helpers import LOG_LINE, TmpDirTestCase
+
+
+def build_after_crash(log, report_path, config):
+    """Kills worker process on the first call, builds report on the next"""
+    marker = Path(config.report_dir) / '.crashed'
+    if not marker.exists():
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        os._exit(1)
+    return build_log_report(log, report_path, config)
+
+
+class WatchTest(TmpDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log_dir = self.dir / 'logs'
+        self.log_dir.mkdir()
+        self.config = self.config._replace(
+            log_dir=str(self.log_dir),
+            batch_workers=1,
+            watch_interval=.05,
+            watch_port=0,
+            metrics=True,
+            aggregate_cache=False,
+        )
+
+    def write_log(self, name, lines=3, old=True):
+        path = self.log_dir / name
+        with open(path, 'w') as f:
+            f.write(LOG_LINE * lines)
+        if old:
+            mtime = time.time() - 3600
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_watch_dirs(self):
+        self.assertEqual(get_watch_configs(self.config), [self.config])
+        config = self.config._replace(watch_dirs=[['a', 'b'], ['c', 'd']])
+        self.assertEqual(
+            [(c.log_dir, c.report_dir) for c in get_watch_configs(config)],
+            [('a', 'b'), ('c', 'd')]
+        )
+
+    def test_poll(self):
+        watched = WatchedDir(self.config)
+        self.assertEqual(watched.poll(), [])
+        self.write_log('nginx-access-ui.log-20170630')
+        new_path = self.write_log('nginx-access-ui.log-20170701', old=False)
+        logs = watched.poll()
+        self.assertEqual(
+            [log.path.name for log, _ in logs],
+            ['nginx-access-ui.log-20170630']
+        )
+        # Recent log is taken when it is not changed since previous poll
+        new_logs = watched.poll()
+        self.assertEqual([log.path for log, _ in new_logs], [new_path])
+        # Log is not taken again while it is built
+        self.assertEqual(watched.poll(), [])
+        for log, _ in logs + new_logs:
+            watched.done(log)
+        self.assertEqual(watched.poll(), [])
+        # Log is taken again only if it is changed
+        with open(new_path, 'a') as f:
+            f.write(LOG_LINE)
+        os.utime(self.log_dir)
+        self.assertEqual(watched.poll(), [])
+        self.assertEqual(
+            [log.path for log, _ in watched.poll()], [new_path]
+        )
+
+    def test_scan_apart_from_update(self):
+        watched = WatchedDir(self.config)
+        self.write_log('nginx-access-ui.log-20170630')
+        (log, _), = watched.poll()
+        os.utime(self.log_dir)
+        state = {name: copy(value) for name, value in vars(watched).items()}
+        scan = watched.scan(watched.get_scanned_stat())
+        self.assertEqual(vars(watched), state)
+        # Log built while the directory is scanned is not taken again
+        watched.done(log)
+        self.assertEqual(watched.update(scan), [])
+        self.assertIsNone(watched.scan(watched.get_scanned_stat()))
+
+    def test_watcher(self):
+        self.write_log('nginx-access-ui.log-20170630')
+        with gzip.open(self.log_dir / 'nginx-access-ui.log-20170701.gz',
+                       'wt') as f:
+            f.write('WRONG FMT\n' * 3)
+        watcher = LogWatcher(self.config)
+
+        async def watch():
+            stop = asyncio.Event()
+            task = asyncio.create_task(watcher.run(stop))
+            for _ in range(600):
+                await asyncio.sleep(.05)
+                if len(watcher.runs) == 2:
+                    break
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', watcher.port
+            )
+            writer.write(b'GET /status HTTP/1.0\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+            stop.set()
+            await task
+            return response
+
+        response = asyncio.run(watch())
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(head.startswith(b'HTTP/1.0 200'))
+        status = json.loads(body)
+        self.assertEqual(status['queued'], [])
+        self.assertEqual(
+            sorted(
+                (Path(run['log']).name, run['status'])
+                for run in status['runs']
+            ),
+            [
+                ('nginx-access-ui.log-20170630', 'built'),
+                ('nginx-access-ui.log-20170701.gz', 'rejected'),
+            ]
+        )
+        self.assertEqual(
+            [run['metrics']['total_lines'] for run in status['runs']],
+            [3, 3]
+        )
+        self.assertTrue(
+            (self.dir / 'reports' / 'report-2017.06.30.html').is_file()
+        )
+
+    def watch_until(self, watcher, runs):
+        async def watch():
+            stop = asyncio.Event()
+            task = asyncio.create_task(watcher.run(stop))
+            for _ in range(600):
+                await asyncio.sleep(.05)
+                if len(watcher.runs) == runs:
+                    break
+            stop.set()
+            await task
+
+        asyncio.run(watch())
+
+    def test_worker_crash(self):
+        self.write_log('nginx-access-ui.log-20170630')
+        watcher = LogWatcher(self.config)
+        with mock.patch(
+            'log_analyzer.report.watch.build_log_report', build_after_crash
+        ), self.assertLogs('log_analyzer.report.watch'):
+            self.watch_until(watcher, 2)
+        # Log is built again by a new worker
+        self.assertEqual(
+            [run.status for run in watcher.runs], ['failed', 'built']
+        )
+        self.assertTrue(
+            (self.dir / 'reports' / 'report-2017.06.30.html').is_file()
+        )
+
+    def test_poll_error(self):
+        self.write_log('nginx-access-ui.log-20170630')
+        watcher = LogWatcher(self.config)
+        calls = []
+
+        def iter_logs_after_error(config):
+            calls.append(config)
+            if len(calls) == 1:
+                raise OSError('Stale file handle')
+            return iter_logs(config)
+
+        with mock.patch(
+            'log_analyzer.report.watch.iter_logs', iter_logs_after_error
+        ), self.assertLogs('log_analyzer.report.watch') as logs:
+            self.watch_until(watcher, 1)
+        self.assertTrue(
+            any('Unable to poll' in line for line in logs.output)
+        )
+        self.assertEqual(
+            [run.status for run in watcher.runs], ['built']
+        )
+        self.assertEqual(watcher.status()['poll_errors'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()